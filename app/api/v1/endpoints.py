@@ -1,19 +1,62 @@
 # app/api/v1/endpoints.py
 
-from fastapi import APIRouter
+import uuid
+from typing import Optional
+from fastapi import APIRouter, Query, Request, WebSocket
 from fastapi.responses import StreamingResponse
 from app.schemas.chat import ChatRequest
 from app.services.chat_service import stream_langgraph_response
+from app.services.event_encoder import EventEncoder, negotiate_encoding
+from app.services.ws_multiplexer import MultiplexedConnection
+from app.core.metrics import metrics_registry
+from app.core.profiler import profiling_requested
 
 router = APIRouter()
 
 @router.post("/chat/stream", summary="Stream LangGraph chat responses")
-async def chat_stream_endpoint(request: ChatRequest):
+async def chat_stream_endpoint(request: ChatRequest, http_request: Request,
+                               profile: Optional[str] = Query(default=None, include_in_schema=False)):
     """
     Initiates a chat session with the LangGraph agent and streams
     intermediate states and the final answer back to the client.
+    The stream is gzip/deflate compressed (flushed per event) when the
+    client advertises support via Accept-Encoding.
+    Pass the returned X-Session-Id as `session_id` to send a follow-up
+    request that continues the same session.
+    When PROFILING_ENABLED is set, an `X-Profile` header or `?profile=` flag
+    (equal to PROFILING_TOKEN if one is configured) runs the session under
+    the sampling profiler; see app/core/profiler.py.
     """
+    if not request.session_id:
+        request = request.model_copy(update={"session_id": uuid.uuid4().hex})
+    encoder = EventEncoder(negotiate_encoding(http_request.headers.get("accept-encoding")))
+    profiled = profiling_requested(http_request.headers.get("x-profile") or profile)
     return StreamingResponse(
-        stream_langgraph_response(request),
-        media_type="text/event-stream" # Standard for Server-Sent Events
+        stream_langgraph_response(request, encoder, profile=profiled),
+        media_type="text/event-stream", # Standard for Server-Sent Events
+        headers={**encoder.headers, "X-Session-Id": request.session_id}
     )
+
+
+@router.websocket("/ws")
+async def chat_websocket_endpoint(websocket: WebSocket):
+    """
+    Multiplexes many chat sessions over one WebSocket connection.
+    Each session's events are the same StreamEvent payloads as /chat/stream,
+    wrapped in frames tagged with the session id and a per-session sequence
+    number. Clients acknowledge frames for flow control and can cancel a
+    session or resume it (also on a new connection, with the resume_token
+    from the session's "started" frame) after a disconnect;
+    see MultiplexedConnection in app/services/ws_multiplexer.py for the protocol.
+    """
+    await websocket.accept()
+    await MultiplexedConnection(websocket).run()
+
+
+@router.get("/metrics", summary="In-process metrics snapshot")
+async def metrics_endpoint():
+    """
+    Returns a JSON snapshot of all counters, gauges and histograms
+    registered in the process (e.g. python_repl pool hits and latency).
+    """
+    return metrics_registry.snapshot()
@@ -0,0 +1,282 @@
+# app/batch.py
+"""
+离线批量运行：从 JSONL 文件读取请求，不经过 HTTP 直接交给 main_app_graph 执行，结果逐条写入输出 JSONL。
+
+输入每行一个 JSON 对象，格式与 requests.jsonl 相同 (request_id、title、body)，也可以直接给出 message；
+可选字段 time_budget_s、token_budget、priority、tenant 与 ChatRequest 相同 (priority 默认为 batch)。
+
+输出文件同时是检查点：重新运行同一命令时跳过已经成功的请求 (--retry-errors 时失败的也重跑)，
+进程崩溃后从中断处继续 (写到一半的末行会被截掉)。重跑的请求在文件末尾追加新的结果，读取时同一请求以成功的、较新的一条为准。--shards N 时启动 N 个子进程，按行号分片并行执行，结束后合并各分片的输出。
+
+用法 (在项目根目录下):
+    python -m app.batch requests.jsonl --output results.jsonl --concurrency 16
+    python -m app.batch requests.jsonl --output results.jsonl --concurrency 16 --shards 4
+"""
+
+import argparse
+import asyncio
+import contextlib
+import glob
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import Any, Dict, Iterator, List, Optional, Set, TextIO
+
+# 批量任务中的 LLM 调用默认以 batch 优先级排队，不挤占交互式会话
+DEFAULT_PRIORITY = "batch"
+# 每写入多少条结果 fsync 一次输出文件 (进程崩溃时已 flush 的结果不会丢失，fsync 防止机器掉电)
+FSYNC_EVERY = 20
+
+_SHARD_SUFFIX = re.compile(r"\.shard\d+$")
+
+
+def read_requests(path: str) -> Iterator[Dict[str, Any]]:
+    """逐行读取请求，缺少 request_id 时用行号代替"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                print(f"Skipping line {line_number} of {path}: invalid JSON ({e})", file=sys.stderr)
+                continue
+            record.setdefault("request_id", f"line-{line_number}")
+            record["request_id"] = str(record["request_id"])
+            yield record
+
+
+def _message_of(record: Dict[str, Any]) -> str:
+    if record.get("message"):
+        return record["message"]
+    title, body = record.get("title") or "", record.get("body") or ""
+    return f"{title}\n\n{body}".strip()
+
+
+def _output_files(output: str) -> List[str]:
+    shard_files = sorted(path for path in glob.glob(f"{glob.escape(output)}.shard*") if _SHARD_SUFFIX.search(path))
+    return [path for path in [output, *shard_files] if os.path.exists(path)]
+
+
+def read_results(paths: List[str]) -> Dict[str, Dict[str, Any]]:
+    """读取已有的输出 (包括未合并的分片)，同一请求有多条结果时以成功的、较新的为准；写到一半的末行被忽略"""
+    results: Dict[str, Dict[str, Any]] = {}
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue
+                if not isinstance(result, dict) or "request_id" not in result:
+                    continue
+                previous = results.get(result.get("request_id"))
+                if previous is None or result.get("status") == "ok" or previous.get("status") != "ok":
+                    results[result["request_id"]] = result
+    return results
+
+
+def _open_for_append(path: str) -> TextIO:
+    """以追加方式打开输出文件；上次崩溃时写到一半的末行先截掉，保证输出始终是合法的 JSONL"""
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.seek(0)
+                f.truncate(f.read().rfind(b"\n") + 1)
+    return open(path, "a", encoding="utf-8")
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run_request(record: Dict[str, Any], tenant: Optional[str]) -> Dict[str, Any]:
+    """通过 stream_langgraph_response 执行一个请求 (与 SSE 接口的执行路径完全相同)，返回输出记录"""
+    from app.schemas.chat import ChatRequest
+    from app.services.chat_service import stream_langgraph_response
+    from app.services.session_store import session_store
+
+    session_id = f"batch-{record['request_id']}"
+    result: Dict[str, Any] = {"request_id": record["request_id"], "title": record.get("title"), "status": "error",
+                              "final_answer": None, "error": None, "usage": None, "latency_s": None}
+    start = time.perf_counter()
+    try:
+        request = ChatRequest(
+            message=_message_of(record), session_id=session_id,
+            time_budget_s=record.get("time_budget_s"), token_budget=record.get("token_budget"),
+            priority=record.get("priority") or DEFAULT_PRIORITY, tenant=record.get("tenant") or tenant,
+        )
+        async for chunk in stream_langgraph_response(request):
+            event = json.loads(chunk[len(b"data: "):])
+            if event["event_type"] == "final_answer":
+                result.update(status="ok", final_answer=event.get("message"), usage=event.get("usage"),
+                              schedule=(event.get("data") or {}).get("schedule"))
+            elif event["event_type"] == "error":
+                result.update(status="error", error=event.get("message"), usage=event.get("usage") or result["usage"])
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        # 批量请求不会有追加轮次，不在会话存储中保留它们的状态
+        session_store.delete(session_id)
+    result["latency_s"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+async def run_shard(input_path: str, output_path: str, concurrency: int, shard: int = 0, shards: int = 1,
+                    retry_errors: bool = False, tenant: Optional[str] = None) -> Dict[str, Any]:
+    """执行本分片中尚未完成的请求，最多 concurrency 个同时进行，结果完成一条写一条"""
+    done = read_results(_output_files(_SHARD_SUFFIX.sub("", output_path)))
+    finished: Set[str] = {rid for rid, r in done.items() if r.get("status") == "ok" or not retry_errors}
+    mine = [record for index, record in enumerate(read_requests(input_path)) if index % shards == shard]
+    pending = [record for record in mine if record["request_id"] not in finished]
+    skipped = len(mine) - len(pending)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    results: List[Dict[str, Any]] = []
+    start = time.perf_counter()
+    with _open_for_append(output_path) as out:
+        async def one(record: Dict[str, Any]) -> None:
+            async with semaphore:
+                result = await run_request(record, tenant)
+            # 单线程的事件循环中逐条写入，不会交错
+            out.write(json.dumps({**result, "shard": shard}, ensure_ascii=False, default=str) + "\n")
+            out.flush()
+            results.append(result)
+            if len(results) % FSYNC_EVERY == 0:
+                os.fsync(out.fileno())
+            print(f"[shard {shard}] {len(results)}/{len(pending)} {result['request_id']}: {result['status']} "
+                  f"({result['latency_s']:.1f}s)", file=sys.stderr)
+
+        await asyncio.gather(*(one(record) for record in pending))
+        out.flush()
+        os.fsync(out.fileno())
+    return summarize(results, time.perf_counter() - start, skipped)
+
+
+def summarize(results: List[Dict[str, Any]], wall_s: float, skipped: int) -> Dict[str, Any]:
+    latencies = [r["latency_s"] for r in results if r.get("latency_s") is not None]
+    usages = [r.get("usage") or {} for r in results]
+    total_tokens = sum(u.get("total_tokens") or 0 for u in usages)
+    costs = [u["cost_usd"] for u in usages if u.get("cost_usd") is not None]
+    completed = sum(1 for r in results if r.get("status") == "ok")
+    return {
+        "requests": len(results),
+        "completed": completed,
+        "errors": len(results) - completed,
+        "skipped_from_checkpoint": skipped,
+        "wall_s": round(wall_s, 2),
+        "requests_per_s": round(len(results) / wall_s, 3) if wall_s else None,
+        "tokens_per_s": round(total_tokens / wall_s, 1) if wall_s else None,
+        "latency_p50_s": percentile(latencies, 0.5),
+        "latency_p95_s": percentile(latencies, 0.95),
+        "total_tokens": total_tokens,
+        "llm_calls": sum(u.get("calls") or 0 for u in usages),
+        "cost_usd": round(sum(costs), 6) if costs else None,
+    }
+
+
+def merge_shards(output: str) -> None:
+    """把各分片的输出合并进主输出文件 (每个请求保留一条结果)，然后删除分片文件"""
+    shard_files = [path for path in _output_files(output) if path != output]
+    if not shard_files:
+        return
+    results = read_results(_output_files(output))
+    tmp_path = f"{output}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for result in results.values():
+            f.write(json.dumps(result, ensure_ascii=False, default=str) + "\n")
+    os.replace(tmp_path, output)
+    for path in shard_files:
+        os.remove(path)
+
+
+def combine_summaries(summaries: List[Dict[str, Any]], wall_s: float) -> Dict[str, Any]:
+    combined: Dict[str, Any] = {key: sum(s.get(key) or 0 for s in summaries)
+                                for key in ("requests", "completed", "errors", "skipped_from_checkpoint", "total_tokens", "llm_calls")}
+    costs = [s["cost_usd"] for s in summaries if s.get("cost_usd") is not None]
+    combined.update({
+        "shards": len(summaries),
+        "wall_s": round(wall_s, 2),
+        "requests_per_s": round(combined["requests"] / wall_s, 3) if wall_s else None,
+        "tokens_per_s": round(combined["total_tokens"] / wall_s, 1) if wall_s else None,
+        # 分位数无法从各分片的分位数精确合并，这里取各分片中的最大值作为上界
+        "latency_p50_s_max": max((s["latency_p50_s"] for s in summaries if s.get("latency_p50_s") is not None), default=None),
+        "latency_p95_s_max": max((s["latency_p95_s"] for s in summaries if s.get("latency_p95_s") is not None), default=None),
+        "cost_usd": round(sum(costs), 6) if costs else None,
+    })
+    return combined
+
+
+def run_sharded(args: argparse.Namespace) -> Dict[str, Any]:
+    """每个分片一个子进程 (各自有独立的事件循环和线程池)，等待全部结束后合并输出和汇总"""
+    start = time.perf_counter()
+    processes = []
+    for shard in range(args.shards):
+        command = [sys.executable, "-m", "app.batch", args.input, "--output", f"{args.output}.shard{shard}",
+                   "--concurrency", str(args.concurrency), "--shard", str(shard), "--shards", str(args.shards),
+                   "--summary-json", f"{args.output}.shard{shard}.summary"]
+        if args.retry_errors:
+            command.append("--retry-errors")
+        if args.tenant:
+            command += ["--tenant", args.tenant]
+        processes.append(subprocess.Popen(command))
+    failed = [shard for shard, process in enumerate(processes) if process.wait() != 0]
+    summaries = []
+    for shard in range(args.shards):
+        path = f"{args.output}.shard{shard}.summary"
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                summaries.append(json.load(f))
+            os.remove(path)
+    if failed:
+        # 保留分片文件：重新运行时会跳过其中已完成的请求
+        print(f"Shard(s) {failed} exited with errors; shard outputs kept for resuming.", file=sys.stderr)
+    else:
+        merge_shards(args.output)
+    return combine_summaries(summaries, time.perf_counter() - start)
+
+
+def print_summary(summary: Dict[str, Any]) -> None:
+    for key, value in summary.items():
+        print(f"{key:>26} | {'-' if value is None else value}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="请求 JSONL 文件")
+    parser.add_argument("--output", required=True, help="结果 JSONL 文件 (同时作为断点续跑的检查点)")
+    parser.add_argument("--concurrency", type=int, default=8, help="每个进程同时执行的请求数")
+    parser.add_argument("--shards", type=int, default=1, help="并行的进程数，按行号分片")
+    parser.add_argument("--shard", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--summary-json", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--retry-errors", action="store_true", help="续跑时重新执行之前失败的请求")
+    parser.add_argument("--tenant", default=None, help="请求没有指定 tenant 时使用的租户")
+    parser.add_argument("--verbose", action="store_true", help="保留应用打印到标准输出的调试信息")
+    args = parser.parse_args()
+
+    if args.shards > 1 and args.shard is None:
+        summary = run_sharded(args)
+    else:
+        # 图的各节点会把调试信息打印到标准输出，批量运行时默认丢弃
+        with open(os.devnull, "w") as devnull, \
+                (contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull)):
+            summary = asyncio.run(run_shard(args.input, args.output, args.concurrency, args.shard or 0, args.shards,
+                                            args.retry_errors, args.tenant))
+        if args.summary_json:
+            # 分片子进程只把汇总交给父进程，由父进程合并后打印
+            with open(args.summary_json, "w", encoding="utf-8") as f:
+                json.dump(summary, f)
+            return
+    print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# app/core/metrics.py
+
+import bisect
+import random
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# 默认的耗时分桶 (秒)
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# 每个直方图序列保留的样本数量，用于近似计算分位数
+_RESERVOIR_SIZE = 2048
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _label_str(key: LabelKey) -> str:
+    return ",".join(f"{k}={v}" for k, v in key)
+
+
+class Counter:
+    """单调递增的计数器"""
+
+    def __init__(self, name: str, description: str = ""):
+        self.name = name
+        self.description = description
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {_label_str(k): v for k, v in self._values.items()}
+
+
+class Gauge:
+    """可以任意设置的瞬时值"""
+
+    def __init__(self, name: str, description: str = ""):
+        self.name = name
+        self.description = description
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {_label_str(k): v for k, v in self._values.items()}
+
+
+class _HistogramSeries:
+    __slots__ = ("bucket_counts", "count", "total", "reservoir")
+
+    def __init__(self, bucket_count: int):
+        self.bucket_counts = [0] * (bucket_count + 1)  # 最后一个是 +Inf 桶
+        self.count = 0
+        self.total = 0.0
+        self.reservoir: List[float] = []
+
+
+class Histogram:
+    """分桶直方图，同时用蓄水池采样近似 p50/p95/p99"""
+
+    def __init__(self, name: str, description: str = "", buckets=DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelKey, _HistogramSeries] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _HistogramSeries(len(self.buckets))
+            series.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+            series.count += 1
+            series.total += value
+            if len(series.reservoir) < _RESERVOIR_SIZE:
+                series.reservoir.append(value)
+            else:
+                slot = random.randrange(series.count)
+                if slot < _RESERVOIR_SIZE:
+                    series.reservoir[slot] = value
+
+    def percentile(self, q: float, **labels) -> Optional[float]:
+        series = self._series.get(_label_key(labels))
+        if series is None or not series.reservoir:
+            return None
+        with self._lock:
+            samples = sorted(series.reservoir)
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def count(self, **labels) -> int:
+        series = self._series.get(_label_key(labels))
+        return series.count if series else 0
+
+    def snapshot(self) -> Dict[str, Dict[str, object]]:
+        result = {}
+        with self._lock:
+            for key, series in self._series.items():
+                samples = sorted(series.reservoir)
+
+                def pick(q: float) -> Optional[float]:
+                    return samples[min(len(samples) - 1, int(q * len(samples)))] if samples else None
+
+                result[_label_str(key)] = {
+                    "count": series.count,
+                    "sum": series.total,
+                    "p50": pick(0.50),
+                    "p95": pick(0.95),
+                    "p99": pick(0.99),
+                    "buckets": dict(zip([*map(str, self.buckets), "+Inf"], series.bucket_counts)),
+                }
+        return result
+
+
+class MetricsRegistry:
+    """进程内的指标注册表。同名指标重复注册时返回已有实例。"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise TypeError(f"Metric '{name}' is already registered as {type(metric).__name__}.")
+            return metric
+
+    def counter(self, name: str, description: str = "") -> Counter:
+        return self._get_or_create(Counter, name, description)
+
+    def gauge(self, name: str, description: str = "") -> Gauge:
+        return self._get_or_create(Gauge, name, description)
+
+    def histogram(self, name: str, description: str = "", buckets=DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, description, buckets=buckets)
+
+    def snapshot(self) -> Dict[str, Dict[str, object]]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {
+            metric.name: {
+                "type": type(metric).__name__.lower(),
+                "description": metric.description,
+                "values": metric.snapshot(),
+            }
+            for metric in metrics
+        }
+
+
+# 全局注册表，整个应用共享
+metrics_registry = MetricsRegistry()
@@ -0,0 +1,185 @@
+# app/core/profiler.py
+
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.core.metrics import metrics_registry
+
+logger = logging.getLogger(__name__)
+
+# --- 配置 ---
+# 管理开关：只有开启后，请求中的 X-Profile 头或 ?profile=1 才会生效
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+# 设置后 X-Profile 头 (或 profile 参数) 必须等于该值，防止任意客户端打开分析
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN")
+PROFILE_OUTPUT_DIR = os.getenv("PROFILE_OUTPUT_DIR", os.path.join("logs", "profiles"))
+PROFILE_SAMPLE_INTERVAL_S = float(os.getenv("PROFILE_SAMPLE_INTERVAL_S", "0.005"))
+_MAX_STACK_DEPTH = 128
+
+_profiles = metrics_registry.counter("profiled_sessions_total", "Sessions run with the sampling profiler attached")
+
+
+def profiling_requested(flag: Optional[str]) -> bool:
+    """请求携带的 profile 标志是否有效：需要管理开关已开启，配置了令牌时还要与令牌一致"""
+    if not flag or not PROFILING_ENABLED:
+        return False
+    if PROFILING_TOKEN:
+        return flag == PROFILING_TOKEN
+    return flag.lower() in ("1", "true", "yes")
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SessionProfile:
+    """
+    单个会话的采样分析器。会话的代码分散在事件循环 (流式输出、序列化) 和线程池 (同步节点、LLM 请求) 中，
+    因此不按线程整体采样，而是由 profile_scope() 把"正在为本会话工作"的线程登记进来，
+    后台采样线程每隔 interval_s 只采这些线程的调用栈，栈底标上所在的图节点。
+    同时按节点统计墙钟时间和 CPU 时间 (各线程 thread_time 之和)，区分计算和等待 I/O。
+    """
+
+    def __init__(self, session_id: str, interval_s: float = PROFILE_SAMPLE_INTERVAL_S):
+        self.session_id = session_id
+        self.interval_s = interval_s
+        self.samples: Counter = Counter()
+        self.nodes: Dict[str, Dict[str, float]] = defaultdict(lambda: {"wall_s": 0.0, "cpu_s": 0.0, "calls": 0})
+        self._threads: Dict[int, List[str]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._started_at = 0.0
+        self.wall_s = 0.0
+
+    def start(self) -> None:
+        self._started_at = time.perf_counter()
+        self._sampler = threading.Thread(target=self._run, name=f"profiler-{self.session_id[:8]}", daemon=True)
+        self._sampler.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self.wall_s = time.perf_counter() - self._started_at
+
+    def _enter(self, label: str) -> None:
+        with self._lock:
+            self._threads.setdefault(threading.get_ident(), []).append(label)
+
+    def _exit(self, label: str, wall_s: Optional[float], cpu_s: float) -> None:
+        with self._lock:
+            ident = threading.get_ident()
+            labels = self._threads.get(ident, [])
+            if labels:
+                labels.pop()
+            if not labels:
+                self._threads.pop(ident, None)
+            stats = self.nodes[label]
+            stats["cpu_s"] += cpu_s
+            if wall_s is not None:
+                stats["wall_s"] += wall_s
+                stats["calls"] += 1
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            with self._lock:
+                threads = {ident: labels[-1] for ident, labels in self._threads.items() if labels}
+            if not threads:
+                continue
+            frames = sys._current_frames()
+            for ident, label in threads.items():
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None and len(stack) < _MAX_STACK_DEPTH:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                self.samples[(label, *reversed(stack))] += 1
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "wall_s": round(self.wall_s, 4),
+            "sample_interval_s": self.interval_s,
+            "samples": sum(self.samples.values()),
+            "nodes": {label: {"wall_s": round(s["wall_s"], 4), "cpu_s": round(s["cpu_s"], 4), "calls": s["calls"]}
+                      for label, s in self.nodes.items()},
+        }
+
+    def write(self, output_dir: str = PROFILE_OUTPUT_DIR) -> str:
+        """写出 <会话>.collapsed (折叠栈，可用 flamegraph.pl 生成火焰图)、<会话>.speedscope.json 和节点耗时汇总，返回文件前缀"""
+        os.makedirs(output_dir, exist_ok=True)
+        prefix = os.path.join(output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{self.session_id}")
+        with open(f"{prefix}.collapsed", "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+
+        frame_index: Dict[str, int] = {}
+        samples, weights = [], []
+        for stack, count in self.samples.items():
+            samples.append([frame_index.setdefault(name, len(frame_index)) for name in stack])
+            weights.append(round(count * self.interval_s, 6))
+        speedscope = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": [{"name": name} for name in frame_index]},
+            "profiles": [{
+                "type": "sampled", "name": f"session {self.session_id}", "unit": "seconds",
+                "startValue": 0, "endValue": round(sum(weights), 6), "samples": samples, "weights": weights,
+            }],
+            "name": f"session {self.session_id}",
+            "exporter": "app.core.profiler",
+        }
+        with open(f"{prefix}.speedscope.json", "w", encoding="utf-8") as f:
+            json.dump(speedscope, f)
+        with open(f"{prefix}.summary.json", "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=2)
+        return prefix
+
+
+_current_profile: contextvars.ContextVar[Optional[SessionProfile]] = contextvars.ContextVar("session_profile", default=None)
+_current_label: contextvars.ContextVar[str] = contextvars.ContextVar("profile_label", default="stream")
+
+
+@contextmanager
+def profile_session(session_id: str) -> Iterator[SessionProfile]:
+    """在 with 块 (以及从中复制了上下文的线程) 内为该会话启用采样分析"""
+    profile = SessionProfile(session_id)
+    token = _current_profile.set(profile)
+    _profiles.inc()
+    profile.start()
+    try:
+        yield profile
+    finally:
+        profile.stop()
+        _current_profile.reset(token)
+
+
+@contextmanager
+def profile_scope(label: Optional[str] = None) -> Iterator[None]:
+    """
+    把当前线程登记为正在为被分析的会话工作；没有启用分析时不做任何事。
+    label 为 None 时沿用外层的节点 (例如线程池中的 LLM 请求)，此时只累计 CPU 时间，墙钟时间由外层计算。
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    scope_label = label or _current_label.get()
+    token = _current_label.set(scope_label) if label else None
+    profile._enter(scope_label)
+    wall_start, cpu_start = time.perf_counter(), time.thread_time()
+    try:
+        yield
+    finally:
+        profile._exit(scope_label, time.perf_counter() - wall_start if label else None, time.thread_time() - cpu_start)
+        if token is not None:
+            _current_label.reset(token)
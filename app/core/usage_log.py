@@ -0,0 +1,80 @@
+# app/core/usage_log.py
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# --- 配置 ---
+# JSONL 用量日志的路径，不设置则不记录；每行一条记录 (type 为 "call" 或 "session")
+USAGE_LOG_PATH = os.getenv("USAGE_LOG_PATH", "")
+# 队列积压超过该值时丢弃新记录，避免磁盘变慢时占用过多内存
+USAGE_LOG_MAX_PENDING = int(os.getenv("USAGE_LOG_MAX_PENDING", "10000"))
+
+
+class UsageLog:
+    """
+    离线分析用的 JSONL 用量日志。
+    write() 只把记录放进队列，由后台线程批量写入文件，请求处理路径上没有磁盘 IO。
+    """
+
+    def __init__(self, path: str, max_pending: int = USAGE_LOG_MAX_PENDING):
+        self.path = path
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=max_pending)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def write(self, record: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait({"ts": round(time.time(), 3), **record})
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """等待队列中已有的记录写入文件 (用于关闭进程前或测试)"""
+        deadline = time.time() + timeout
+        while self._thread is not None and self._queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.01)
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self._thread = threading.Thread(target=self._run, name="usage-log-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    for record in batch:
+                        f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            except OSError as e:
+                logger.error(f"Failed to write {len(batch)} usage record(s) to '{self.path}': {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+usage_log = UsageLog(USAGE_LOG_PATH)
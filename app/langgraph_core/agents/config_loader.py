@@ -1,6 +1,64 @@
 import yaml
 import os
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
+
+from app.langgraph_core.utils.result_validators import ResultValidators
+
+# 这些名字被图中的核心节点占用，工人不能使用
+_RESERVED_NAMES = {"supervisor", "planner", "__start__", "__end__"}
+
+
+class WorkerSettings(BaseModel):
+    """workers_config.yaml 中单个工人的配置"""
+    model_config = ConfigDict(extra="forbid")
+
+    name: str = Field(pattern=r"^[A-Za-z_][A-Za-z0-9_]*$")
+    handler_function: str
+    description: Optional[str] = None
+    tools: List[str] = []
+    # 整个进程内 (所有会话共享) 同时执行该工人的最大任务数，不设置则不限制
+    max_concurrency: Optional[int] = Field(default=None, ge=1)
+    # 单个子任务的 LLM 调用时限 (秒)，与会话预算的截止时间取较早者
+    timeout_s: Optional[float] = Field(default=None, gt=0)
+    # 该工人使用的模型和温度，不设置时使用默认的 other_worker_llm
+    model: Optional[str] = None
+    temperature: Optional[float] = Field(default=None, ge=0, le=2)
+    # 对结果的确定性校验规则；配置后 Supervisor 按规则判定结果，不再调用 LLM 评估
+    validators: Optional[ResultValidators] = None
+    # 是否把被接受的结果写入跨会话的结果缓存，并在相同任务再次出现时直接复用。
+    # 只应对没有副作用的工人开启 (例如只调用 LLM 的工人；写文件、执行代码的工人不要开启)
+    cache_results: bool = False
+
+    @field_validator("name")
+    @classmethod
+    def _not_reserved(cls, name: str) -> str:
+        if name in _RESERVED_NAMES:
+            raise ValueError(f"'{name}' is reserved for a core graph node")
+        return name
+
+
+def validate_workers_config(config: Dict[str, Any]) -> Dict[str, WorkerSettings]:
+    """校验工人配置，返回 name -> WorkerSettings；配置有误时抛出 ValueError 并指出出错的工人和字段"""
+    if not isinstance(config, dict):
+        raise ValueError("workers_config.yaml must contain a mapping with a 'workers' list.")
+    known_tools = set(config.get("tools") or {})
+    settings: Dict[str, WorkerSettings] = {}
+    for i, entry in enumerate(config.get("workers") or []):
+        label = entry.get("name", f"#{i + 1}") if isinstance(entry, dict) else f"#{i + 1}"
+        try:
+            worker = WorkerSettings.model_validate(entry)
+        except ValidationError as e:
+            raise ValueError(f"Invalid configuration for worker '{label}': {e}") from e
+        if worker.name in settings:
+            raise ValueError(f"Duplicate worker name '{worker.name}'.")
+        unknown_tools = [tool for tool in worker.tools if tool not in known_tools]
+        if unknown_tools:
+            raise ValueError(f"Worker '{worker.name}' references undefined tools: {unknown_tools}")
+        settings[worker.name] = worker
+    return settings
+
 
 def load_workers_config() -> Dict[str, Any]:
     """加载并解析 workers_config.yaml 文件"""
@@ -14,8 +72,14 @@ def load_workers_config() -> Dict[str, Any]:
 # 这使得其他模块可以简单地从这里导入 WORKERS_CONFIG
 try:
     WORKERS_CONFIG = load_workers_config()
+    WORKER_SETTINGS = validate_workers_config(WORKERS_CONFIG)
 except Exception as e:
     # 在加载配置失败时提供清晰的错误信息
     print(f"FATAL: Failed to load workers_config.yaml. Error: {e}")
     # 在实际应用中，你可能希望在这里让程序退出
-    WORKERS_CONFIG = {"workers": [], "tools": {}} 
\ No newline at end of file
+    WORKERS_CONFIG = {"workers": [], "tools": {}}
+    WORKER_SETTINGS = {}
+
+
+def get_worker_settings(name: Optional[str]) -> Optional[WorkerSettings]:
+    return WORKER_SETTINGS.get(name)
@@ -1,12 +1,20 @@
 # app/langgraph_core/agents/main/other_worker_agent.py
 
-from typing import Dict, Any, Optional
+import time
+from typing import Dict, Any, List, Optional
 from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 
 from app.langgraph_core.state.graph_state import AgentState, SubTask, Plan
-from app.llms.reasoning_models import other_worker_llm # 导入为 Other Worker 准备的 LLM
-from app.langgraph_core.prompts.utils import load_chat_prompt_template
+from app.langgraph_core.state.plan_index import find_task
+from app.langgraph_core.state.blob_store import offload_result
+from app.llms.reasoning_models import get_worker_llm # 按工人配置 (model/temperature) 选择 LLM
+from app.langgraph_core.agents.config_loader import get_worker_settings
+from app.langgraph_core.prompts.utils import load_chat_prompt_template, prompt_version
+from app.langgraph_core.memory.long_term_memory import retrieve_related_memories, format_memories_for_prompt
+from app.langgraph_core.memory.result_cache import get_result_cache, result_cache_key
+from app.langgraph_core.utils.budget import EXHAUSTED, MINIMAL, Budget, llm_budget_kwargs, tracks_token_usage
+from app.llms.resilience import DeadlineExceededError
 
 # 加载 Other Worker 的提示词模板
 worker_prompt_template = load_chat_prompt_template(
@@ -15,7 +23,15 @@ worker_prompt_template = load_chat_prompt_template(
     system_template_name="system_prompt" # 对应 prompts/worker/system_prompt.md
     # 暂时不使用 few_shot_examples
 )
+# 提示词文件的版本，作为结果缓存键的一部分：修改提示词后旧的缓存结果不再命中
+WORKER_PROMPT_VERSION = prompt_version("worker", "system_prompt", "task_execution")
 
+
+def _dependency_results(plan: Plan, task: SubTask) -> List[Optional[str]]:
+    return [(find_task(plan, dep_id) or {}).get("result") for dep_id in task.get("dependencies") or []]
+
+
+@tracks_token_usage
 def other_worker_node(state: AgentState) -> AgentState:
     print("\n--- Agent: Other Worker ---")
     active_subtask_id = state.get("active_subtask_id")
@@ -23,37 +39,88 @@ def other_worker_node(state: AgentState) -> AgentState:
 
     if not active_subtask_id or not overall_plan:
         print("Other Worker: No active subtask or plan found.")
-        return {"messages": [AIMessage(content="Other Worker: Error - No active subtask or plan.")], "current_agent_role": "supervisor", "last_agent_role": "other_worker", "last_worker_result": "Error: No subtask."}
+        return {"messages": [AIMessage(content="Other Worker: Error - No active subtask or plan.")], "current_agent_role": "supervisor", "last_agent_role": "other_worker", "last_worker_result": "Error: No subtask.", "last_task_completed": False}
 
     # 找到当前活跃的子任务
-    current_subtask: Optional[SubTask] = None
-    for subtask in overall_plan["steps"]:
-        if subtask["task_id"] == active_subtask_id:
-            current_subtask = subtask
-            break
+    current_subtask: Optional[SubTask] = find_task(overall_plan, active_subtask_id)
 
     if not current_subtask:
         print(f"Other Worker: Subtask with ID '{active_subtask_id}' not found in plan.")
-        return {"messages": [AIMessage(content=f"Other Worker: Error - Subtask '{active_subtask_id}' not found.")], "current_agent_role": "supervisor", "last_agent_role": "other_worker", "last_worker_result": f"Error: Subtask '{active_subtask_id}' not found."}
+        return {"messages": [AIMessage(content=f"Other Worker: Error - Subtask '{active_subtask_id}' not found.")], "current_agent_role": "supervisor", "last_agent_role": "other_worker", "last_worker_result": f"Error: Subtask '{active_subtask_id}' not found.", "last_task_completed": False}
 
     print(f"Other Worker: Executing subtask: '{current_subtask['description']}'")
 
-    # 构建 chain
-    chain = worker_prompt_template | other_worker_llm
+    # 构建 chain；单次调用的超时由会话剩余预算 (为最终报告预留时间) 和工人配置的 timeout_s 中较早者决定
+    worker_name = current_subtask.get("worker") or "other_worker"
+    settings = get_worker_settings(worker_name)
+    budget = Budget.from_state(state)
+    deadline = budget.call_deadline()
+    worker_deadline = time.time() + settings.timeout_s if settings and settings.timeout_s else None
+    if worker_deadline is not None and (deadline is None or worker_deadline < deadline):
+        deadline = worker_deadline
+    else:
+        worker_deadline = None
+    model = settings.model if settings else None
+    temperature = settings.temperature if settings else None
 
-    # 调用 LLM 来模拟执行任务并生成结果
-    response = chain.invoke({
-        "task_description": current_subtask["description"],
-        "messages": state["messages"] # 传递消息历史作为上下文
-    })
+    # 从长期记忆中检索历史会话里的相关结果作为参考；检索与工人调用共用截止时间，预算紧张时跳过这次额外的 embedding 调用
+    related_memories = ""
+    if budget.mode not in (MINIMAL, EXHAUSTED):
+        related_memories = format_memories_for_prompt(retrieve_related_memories(current_subtask["description"], deadline=deadline))
 
-    worker_result = response.content
+    # 结果缓存：只对显式开启 cache_results 的工人生效；按修改意见重做时结果取决于反馈，不查也不写缓存
+    cache_key = None
+    result_cache = get_result_cache()
+    if result_cache is not None and settings and settings.cache_results and not state.get("task_revision_count"):
+        cache_key = result_cache_key(
+            worker_name, current_subtask["description"], _dependency_results(overall_plan, current_subtask),
+            f"{WORKER_PROMPT_VERSION}:{model}:{temperature}",
+            messages=[f"{m.type}:{m.content}" for m in state["messages"]],
+            memories=related_memories, tenant=state.get("tenant"),
+        )
+        cached_result = result_cache.get(cache_key, worker_name)
+        if cached_result is not None:
+            print(f"Other Worker: Reusing cached result for subtask '{active_subtask_id}'.")
+            return {
+                "current_agent_role": "supervisor",
+                "last_agent_role": "other_worker",
+                "last_worker_result": offload_result(cached_result),
+                "last_result_cache_key": None,
+                "last_result_cached": True,
+                "last_task_completed": True,
+            }
+
+    llm = get_worker_llm(worker_name, model, temperature)
+    chain = worker_prompt_template | llm.bind(**llm_budget_kwargs(deadline))
+
+    # 调用 LLM 来模拟执行任务并生成结果
+    try:
+        response = chain.invoke({
+            "task_description": current_subtask["description"],
+            "related_memories": related_memories,
+            "messages": state["messages"] # 传递消息历史作为上下文
+        })
+        worker_result = response.content
+        completed = True
+    except DeadlineExceededError as e:
+        if worker_deadline is not None:
+            print(f"Other Worker: Subtask exceeded the {settings.timeout_s}s timeout of worker '{worker_name}': {e}")
+            worker_result = f"该子任务超出了工人的执行时限 ({settings.timeout_s:g} 秒)，未能完成。"
+        else:
+            print(f"Other Worker: Session deadline reached while executing subtask: {e}")
+            worker_result = "由于会话时间预算已用完，该子任务未能完成。"
+        cache_key = None # 未完成的结果不能缓存
+        completed = False
     print(f"Other Worker: Subtask result: '{worker_result}'")
 
     # 返回更新后的状态，将结果传递给 Supervisor
     return {
         "current_agent_role": "supervisor", # 任务完成后，将控制权交回给 Supervisor
         "last_agent_role": "other_worker",
-        "last_worker_result": worker_result # 将任务结果存储起来
+        # 较长的结果写入 blob 存储，状态中只保留引用和预览，避免在每次状态合并和事件中复制全文
+        "last_worker_result": offload_result(worker_result), # 将任务结果存储起来
+        "last_result_cache_key": cache_key, # Supervisor 接受结果后据此写入缓存
+        "last_result_cached": False,
+        "last_task_completed": completed, # 超时的执行不计入耗时统计
     }
 
@@ -1,13 +1,21 @@
 # app/langgraph_core/agents/main/planner_agent.py
 
+import contextvars
 import json
 import logging
-from app.langgraph_core.prompts.utils import load_prompt_template
+import os
+from concurrent.futures import ThreadPoolExecutor
+from app.langgraph_core.prompts.utils import LayeredPrompt, load_layered_prompt, load_prompt_template
+from app.langgraph_core.prompts import example_selector
+from app.langgraph_core.prompts.example_selector import SemanticExampleSelector
 from app.llms.reasoning_models import planner_llm
 from app.langgraph_core.state.graph_state import AgentState, Plan, SubTask
+from app.langgraph_core.state.plan_index import IndexedPlan, amend_plan, rank_plan_candidates
+from app.langgraph_core.utils.structured_output import PlanAmendment, PlanOutput, invoke_structured
+from app.langgraph_core.utils.budget import EXHAUSTED, MINIMAL, Budget, llm_budget_kwargs, tracks_token_usage
+from app.llms.resilience import DeadlineExceededError
 from langchain_core.messages import AIMessage, SystemMessage, HumanMessage
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
 from typing import List
 
 # 导入工人配置
@@ -16,30 +24,186 @@ from app.langgraph_core.agents.config_loader import WORKERS_CONFIG
 # 获取logger实例
 logger = logging.getLogger(__name__)
 
+def generate_worker_descriptions() -> str:
+    """根据配置文件生成工人描述字符串"""
+    descriptions = []
+    for worker in WORKERS_CONFIG.get("workers", []):
+        # 使用 .get() 安全地访问 'description'，并提供默认值
+        worker_desc = worker.get("description", "一个通用的工人，负责处理未分配或常规的任务。")
+        description = f"- **{worker['name']}**: {worker_desc}"
+        descriptions.append(description)
+    return "\n".join(descriptions)
+
+def _format_few_shot_examples(examples: List[dict]) -> str:
+    few_shot_text = ""
+    for example in examples:
+        few_shot_text += f"\n用户请求: {example['input']}\n"
+        # 直接使用字符串拼接，避免 JSON 格式化问题
+        steps_text = ""
+        for step in example['output']['steps']:
+            steps_text += f"  - 任务ID: {step['task_id']}, 名称: {step['task_name']}, 描述: {step['description']}, 工人: {step['worker']}, 时间: {step['estimated_time']}\n"
+        few_shot_text += f"计划输出:\n{steps_text}\n"
+    return few_shot_text
+
 # --- 加载所有需要的 Prompt 模板 ---
+# 工人说明和 few-shot 示例与请求无关，只在加载时格式化一次并放在提示词最前面，
+# 每次调用的前缀逐字节一致，便于命中服务商的前缀缓存；请求相关的数据放在最后
 try:
-    # 场景1: 首次生成计划的系统模板
+    available_workers_desc = generate_worker_descriptions()
+    # 场景1: 首次生成计划 (系统模板 + few-shot 示例)
     system_prompt_template = load_prompt_template("planner/system_prompt.md")
-    # 场景2: 根据反馈修正计划的模板
-    plan_revision_prompt = load_prompt_template("planner/plan_revision.md")
-    # 加载 Few-shot 示例
     with open('app/langgraph_core/prompts/planner/few_shot_examples.json', 'r', encoding='utf-8') as f:
         few_shot_examples = json.load(f)
+    plan_generation_prompt = LayeredPrompt(
+        system_prompt_template.format(available_workers=available_workers_desc)
+        + "\n\n示例:\n" + _format_few_shot_examples(few_shot_examples) + "\n\n现在请为以下用户请求生成计划:",
+        "用户请求: {user_request}"
+    )
+    # 按请求选择示例时，示例随请求变化，只能放在可变部分；前缀只剩系统模板
+    selective_plan_generation_prompt = LayeredPrompt(
+        system_prompt_template.format(available_workers=available_workers_desc),
+        "示例:\n{few_shot_examples}\n\n现在请为以下用户请求生成计划:\n用户请求: {user_request}"
+    )
+    # 场景2: 根据反馈修正计划的模板
+    plan_revision_prompt = load_layered_prompt("planner/plan_revision.md", available_workers=available_workers_desc)
+    # 场景3: 多轮会话中根据追加请求增量修改已执行过的计划
+    plan_amendment_prompt = load_layered_prompt("planner/plan_amendment.md", available_workers=available_workers_desc)
     logger.info("Planner prompts and examples loaded successfully.")
 except Exception as e:
     logger.critical(f"Failed to load planner prompts or examples: {e}", exc_info=True)
     raise
 
-def generate_worker_descriptions() -> str:
-    """根据配置文件生成工人描述字符串"""
-    descriptions = []
-    for worker in WORKERS_CONFIG.get("workers", []):
-        # 使用 .get() 安全地访问 'description'，并提供默认值
-        worker_desc = worker.get("description", "一个通用的工人，负责处理未分配或常规的任务。")
-        description = f"- **{worker['name']}**: {worker_desc}"
-        descriptions.append(description)
-    return "\n".join(descriptions)
 
+
+def _embedding_model():
+    # 延迟导入：只有按语义选择示例时才需要创建 embedding 客户端
+    from app.llms.embedding_models import batched_embedding_model
+    return batched_embedding_model
+
+
+few_shot_selector = SemanticExampleSelector(
+    'app/langgraph_core/prompts/planner/few_shot_examples.json',
+    embeddings_factory=_embedding_model,
+    format_example=lambda example: _format_few_shot_examples([example]),
+)
+
+
+def _initial_plan_prompt(current_request: str):
+    """
+    首次生成计划的提示词。默认 (FEW_SHOT_SELECTION=all) 放入全部示例，提示词前缀固定，便于命中前缀缓存；
+    显式设置 FEW_SHOT_SELECTION=semantic 时只放入与请求最相关的几个示例 (提示词更短)，选择失败时同样退回全部示例。
+    """
+    if example_selector.FEW_SHOT_SELECTION == "semantic":
+        selected = few_shot_selector.select_examples({"input": current_request})
+        if selected:
+            return selective_plan_generation_prompt.to_messages(
+                few_shot_examples=_format_few_shot_examples(selected), user_request=current_request)
+    return plan_generation_prompt.to_messages(user_request=current_request)
+
+# 修改计划时每个已完成任务的结果只截取开头部分，足够判断是否受追加请求影响
+AMENDMENT_RESULT_PREVIEW_CHARS = 300
+
+# --- Best-of-N 规划 ---
+# 首次生成计划时并行生成的候选计划数；1 表示只生成一份 (由 Supervisor 逐份评估、修订)
+PLAN_CANDIDATES = int(os.getenv("PLAN_CANDIDATES", "1"))
+# 各候选计划使用的温度 (逗号分隔，不足时循环使用)，让候选之间有差异
+PLAN_CANDIDATE_TEMPERATURES = [float(t) for t in os.getenv("PLAN_CANDIDATE_TEMPERATURES", "0.3,0.7,1.0").split(",") if t.strip()]
+# 候选在这个线程池中等待 LLM 返回 (不占用 LLM 请求线程池)；池太小时并发会话的候选会互相排队
+_candidate_executor = ThreadPoolExecutor(max_workers=int(os.getenv("PLAN_CANDIDATE_POOL_SIZE", "32")),
+                                         thread_name_prefix="plan-candidate")
+
+
+def _normalize_subtask(task: dict) -> SubTask:
+    """补全 LLM 生成的子任务字段，并设置初始的 status 和 result"""
+    return {
+        "task_id": task.get("task_id", ""),
+        "task_name": task.get("task_name", ""),
+        "description": task.get("description", ""),
+        "worker": task.get("worker") or "other_worker",
+        "estimated_time": task.get("estimated_time") or "1小时",
+        "dependencies": task.get("dependencies", []),
+        "status": "pending",
+        "result": None
+    }
+
+
+def _plan_from_output(parsed_response: dict) -> Plan:
+    """把结构化输出转换为计划：{"plan": [...]} 或直接返回列表等格式已在 PlanOutput 中统一为 steps"""
+    generated_subtasks = parsed_response["steps"]
+    if not generated_subtasks:
+        raise ValueError("Could not extract subtasks from LLM response.")
+    # 为每个任务添加默认的 status 和 result 字段
+    processed_subtasks = []
+    for task in generated_subtasks:
+        if isinstance(task, dict):
+            processed_subtasks.append(_normalize_subtask(task))
+        else:
+            logger.error(f"Invalid task format: {task}")
+    return {"steps": processed_subtasks}
+
+
+def _generate_plan_candidates(llm_prompt, count: int, deadline_kwargs: dict) -> List[Plan]:
+    """以不同温度并行生成 count 份候选计划；个别候选失败时丢弃，全部失败时抛出第一个错误"""
+    def generate(temperature: float) -> Plan:
+        return _plan_from_output(invoke_structured(
+            planner_llm, llm_prompt, PlanOutput, agent="planner", temperature=temperature, **deadline_kwargs
+        ).model_dump())
+
+    temperatures = [PLAN_CANDIDATE_TEMPERATURES[i % len(PLAN_CANDIDATE_TEMPERATURES)] for i in range(count)]
+    # 复制上下文，让 token 统计、会话分析等 contextvars 在线程中依然可见
+    futures = [_candidate_executor.submit(contextvars.copy_context().run, generate, t) for t in temperatures]
+    candidates, errors = [], []
+    for temperature, future in zip(temperatures, futures):
+        try:
+            candidates.append(future.result())
+        except Exception as e:
+            logger.warning(f"Plan candidate at temperature {temperature} failed ({type(e).__name__}: {e}).")
+            errors.append(e)
+    if not candidates:
+        raise errors[0]
+    return candidates
+
+
+def _amend_plan(state: AgentState, plan: IndexedPlan) -> dict:
+    """
+    多轮会话的追加请求：只新增或重跑受影响的子任务，复用上一轮已完成的结果。
+    LLM 调用失败时退化为追加一个处理追加请求的新任务。
+    """
+    current_request = state["current_request"]
+    plan_preview = [
+        {**task, "result": (task.get("result") or "")[:AMENDMENT_RESULT_PREVIEW_CHARS] or None}
+        for task in plan.steps
+    ]
+    prompt = plan_amendment_prompt.to_messages(
+        previous_requests="\n".join(f"{i + 1}. {r}" for i, r in enumerate(state.get("previous_requests") or [])),
+        user_request=current_request,
+        current_plan=json.dumps(plan_preview, indent=2, ensure_ascii=False)
+    )
+    try:
+        amendment = invoke_structured(
+            planner_llm, prompt, PlanAmendment, agent="planner_amendment",
+            **llm_budget_kwargs(Budget.from_state(state).call_deadline())
+        ).model_dump()
+        rerun_ids = amendment["rerun_task_ids"]
+        new_steps = [_normalize_subtask(task) for task in amendment["new_steps"]]
+    except Exception as e:
+        logger.error(f"Plan amendment failed ({type(e).__name__}: {e}). Appending a single task for the follow-up request.")
+        rerun_ids = []
+        new_steps = [_normalize_subtask({"task_id": "", "task_name": "处理追加请求", "description": current_request})]
+    if not rerun_ids and not new_steps:
+        # 模型认为不需要任何新工作时，仍然至少执行一次追加请求，保证本轮有针对性的结果
+        new_steps = [_normalize_subtask({"task_id": "", "task_name": "处理追加请求", "description": current_request})]
+
+    amended_plan, stats = amend_plan(plan, rerun_ids, new_steps)
+    logger.info(f"Amended plan: reused {stats['skipped']}, re-executing {stats['re_executed']}, added {stats['added']} task(s).")
+    return {
+        "overall_plan": amended_plan,
+        "amendment_stats": stats,
+        "current_agent_role": "supervisor",
+        "last_agent_role": "planner"
+    }
+
+@tracks_token_usage
 def planner_agent(state: AgentState) -> AgentState:
     logger.info("--- Agent: Planner ---")
     
@@ -47,122 +211,68 @@ def planner_agent(state: AgentState) -> AgentState:
     overall_plan = state.get("overall_plan")
     messages = state.get("messages", [])
     
-    prompt_to_use = None
-    llm_input = {}
-    
-    # 动态生成当前可用的工人描述
-    available_workers_desc = generate_worker_descriptions()
-    
     # --- 根据场景选择和构建 Prompt ---
     is_revision = overall_plan and messages and isinstance(messages[-1], AIMessage)
 
+    if not is_revision and overall_plan and overall_plan.get("steps") and state.get("previous_requests"):
+        logger.info("Scenario: Amending the session's existing plan for a follow-up request.")
+        return _amend_plan(state, IndexedPlan.from_plan(overall_plan))
+
     if is_revision:
         logger.info("Scenario: Revising plan based on feedback.")
-        prompt_to_use = plan_revision_prompt
-        feedback = messages[-1].content
-        
-        llm_input = {
-            "user_request": current_request,
-            "original_plan": json.dumps(overall_plan, indent=2, ensure_ascii=False),
-            "supervisor_feedback": feedback,
-            "available_workers": available_workers_desc
-        }
+        llm_prompt = plan_revision_prompt.to_messages(
+            user_request=current_request,
+            original_plan=json.dumps(overall_plan, indent=2, ensure_ascii=False),
+            supervisor_feedback=messages[-1].content
+        )
     else:
         logger.info("Scenario: Generating initial plan.")
-        # 从加载的模板动态构建系统 Prompt
-        final_system_prompt = system_prompt_template.format(available_workers=available_workers_desc)
-        
-        # 构建包含 few-shot 示例的完整提示
-        few_shot_text = ""
-        for example in few_shot_examples:
-            few_shot_text += f"\n用户请求: {example['input']}\n"
-            # 直接使用字符串拼接，避免 JSON 格式化问题
-            steps_text = ""
-            for step in example['output']['steps']:
-                steps_text += f"  - 任务ID: {step['task_id']}, 名称: {step['task_name']}, 描述: {step['description']}, 工人: {step['worker']}, 时间: {step['estimated_time']}\n"
-            few_shot_text += f"计划输出:\n{steps_text}\n"
-        
-        complete_prompt = final_system_prompt + "\n\n示例:\n" + few_shot_text + "\n\n现在请为以下用户请求生成计划:\n"
-        
-        # 直接使用字符串格式化，避免 ChatPromptTemplate 的问题
-        formatted_prompt = complete_prompt + f"\n\n用户请求: {current_request}"
-        
-        llm_input = {
-            "prompt": formatted_prompt
-        }
+        llm_prompt = _initial_plan_prompt(current_request)
 
+    budget = Budget.from_state(state)
+    deadline_kwargs = llm_budget_kwargs(budget.call_deadline())
     try:
-        # --- 2. 直接调用 LLM 并解析响应 ---
-        if is_revision:
-            # 对于修订场景，使用原有的 prompt_to_use
-            parser = JsonOutputParser()
-            chain = prompt_to_use | planner_llm | parser
-            parsed_response = chain.invoke(llm_input)
-        else:
-            # 对于初始计划生成，直接调用 LLM
-            response = planner_llm.invoke(llm_input["prompt"])
-            # 尝试解析 JSON 响应
-            try:
-                import re
-                # 提取 JSON 部分
-                content = response.content
-                json_match = re.search(r'\{.*\}', content, re.DOTALL)
-                if json_match:
-                    json_str = json_match.group()
-                    parsed_response = json.loads(json_str)
-                else:
-                    raise ValueError("No JSON found in response")
-            except Exception as json_error:
-                logger.error(f"Failed to parse JSON from response: {json_error}")
-                raise ValueError(f"Could not parse LLM response as JSON: {response.content}")
+        if not is_revision and PLAN_CANDIDATES > 1 and budget.mode not in (MINIMAL, EXHAUSTED):
+            # Best-of-N：并行生成多份候选，按结构启发式排序后交给 Supervisor 一次性选择，
+            # 只有所有候选都不合格时才进入串行的修订循环
+            candidates = _generate_plan_candidates(llm_prompt, PLAN_CANDIDATES, deadline_kwargs)
+            known_workers = [worker["name"] for worker in WORKERS_CONFIG.get("workers", [])]
+            ranked = [plan for plan, _ in rank_plan_candidates(candidates, known_workers)]
+            logger.info(f"Generated {len(ranked)} plan candidate(s); heuristic best has {len(ranked[0]['steps'])} step(s).")
+            return {
+                "overall_plan": ranked[0],
+                "plan_candidates": ranked if len(ranked) > 1 else None,
+                "current_agent_role": "supervisor",
+                "last_agent_role": "planner"
+            }
+
+        # --- 2. 以 schema 约束的结构化输出调用 LLM，解析失败时先本地修复再重新询问 ---
+        parsed_response = invoke_structured(
+            planner_llm, llm_prompt, PlanOutput, agent="planner", **deadline_kwargs
+        ).model_dump()
         
         logger.info(f"LLM parsed response: {parsed_response}")
 
-        # --- 3. 重写解析逻辑，使其更健壮 ---
-        generated_subtasks = []
-        if isinstance(parsed_response, dict):
-            # 兼容两种常见格式: {"plan": [...]} 或 {"steps": [...]}
-            if "plan" in parsed_response and isinstance(parsed_response["plan"], list):
-                generated_subtasks = parsed_response["plan"]
-            elif "steps" in parsed_response and isinstance(parsed_response["steps"], list):
-                generated_subtasks = parsed_response["steps"]
-            else:
-                logger.error(f"Parsed JSON dictionary has unexpected structure: {parsed_response}")
-        elif isinstance(parsed_response, list):
-            # LLM 直接返回了一个步骤列表
-            generated_subtasks = parsed_response
-        else:
-            logger.error(f"Unexpected response type from LLM after parsing: {type(parsed_response)}")
-
-        if not generated_subtasks:
-             raise ValueError("Could not extract subtasks from LLM response.")
-
-        # 为每个任务添加默认的 status 和 result 字段
-        processed_subtasks = []
-        for task in generated_subtasks:
-            if isinstance(task, dict):
-                # 确保所有必需字段都存在
-                processed_task = {
-                    "task_id": task.get("task_id", ""),
-                    "task_name": task.get("task_name", ""),
-                    "description": task.get("description", ""),
-                    "worker": task.get("worker", "other_worker"),
-                    "estimated_time": task.get("estimated_time", "1小时"),
-                    "dependencies": task.get("dependencies", []),
-                    "status": "pending",
-                    "result": None
-                }
-                processed_subtasks.append(processed_task)
-            else:
-                logger.error(f"Invalid task format: {task}")
-
-        generated_plan: Plan = {"steps": processed_subtasks}
+        # --- 3. 转换为计划，并为每个任务添加默认的 status 和 result 字段 ---
+        generated_plan = _plan_from_output(parsed_response)
         logger.info(f"Generated plan: {generated_plan}")
 
         return {"overall_plan": generated_plan, "current_agent_role": "supervisor", "last_agent_role": "planner"}
 
+    except DeadlineExceededError as e:
+        if is_revision:
+            # 没有时间修订了：保留原计划交回 Supervisor，由它在预算不足的模式下直接执行
+            logger.warning(f"Plan revision skipped, session deadline reached: {e}")
+            return {"current_agent_role": "supervisor", "last_agent_role": "planner"}
+        logger.error(f"Session deadline reached before a plan could be generated: {e}")
+        return {
+            "messages": [AIMessage(content="Planner: Session time budget exhausted before a plan could be generated.")],
+            "current_agent_role": "supervisor",
+            "last_agent_role": "planner",
+            "overall_plan": {"steps": []}
+        }
     except Exception as e:
-        # 这个 Exception 会捕获 JsonOutputParser 的解析错误以及其他所有错误
+        # 这个 Exception 会捕获结构化输出最终解析失败 (StructuredOutputError) 以及其他所有错误
         logger.error(f"Error during LLM invocation or plan parsing: {e}", exc_info=True)
         return {
             "messages": [AIMessage(content=f"Planner: Failed to generate a valid plan. Error: {e}")],
@@ -2,40 +2,56 @@
 
 import json
 import logging
+import os
 from typing import Dict, Any, List, Optional
 from langchain_core.messages import AIMessage
 from langchain_core.prompts import ChatPromptTemplate
 
 from app.langgraph_core.state.graph_state import AgentState, Plan, SubTask
+from app.langgraph_core.state.plan_index import IndexedPlan, plan_structure_problems
+from app.langgraph_core.state.blob_store import resolve_result
 from app.llms.reasoning_models import supervisor_llm
-from app.langgraph_core.prompts.utils import load_prompt_template
-from app.langgraph_core.agents.config_loader import WORKERS_CONFIG
+from app.langgraph_core.prompts.utils import load_layered_prompt
+from app.langgraph_core.agents.config_loader import WORKERS_CONFIG, get_worker_settings
+from app.langgraph_core.utils.result_validators import validate_result
+from app.core.metrics import metrics_registry
+from app.langgraph_core.memory.long_term_memory import remember_subtask_result, remember_final_report
+from app.langgraph_core.memory.result_cache import get_result_cache
+from app.langgraph_core.memory.duration_store import build_schedule
+from app.langgraph_core.utils.structured_output import (
+    PlanCandidatesEvaluation, PlanEvaluation, ResultEvaluation, StructuredOutputError, invoke_structured
+)
+from app.langgraph_core.utils.budget import (
+    EXHAUSTED, FULL, MINIMAL, SHORTENED, SHORTENED_RESULT_CHARS, Budget, llm_budget_kwargs, tracks_token_usage
+)
+from app.llms.resilience import DeadlineExceededError
 
-# --- 加载所有需要的 Supervisor Prompts ---
-plan_evaluation_prompt = load_prompt_template("supervisor/plan_evaluation.md")
-result_evaluation_prompt = load_prompt_template("supervisor/result_evaluation.md")
-final_summary_prompt = load_prompt_template("supervisor/final_summary.md")
+# --- 加载所有需要的 Supervisor Prompts (固定的指令在前，请求数据在后，以便命中前缀缓存) ---
+plan_evaluation_prompt = load_layered_prompt("supervisor/plan_evaluation.md")
+plan_candidates_evaluation_prompt = load_layered_prompt("supervisor/plan_candidates_evaluation.md")
+result_evaluation_prompt = load_layered_prompt("supervisor/result_evaluation.md")
+final_summary_prompt = load_layered_prompt("supervisor/final_summary.md")
 
-# --- 在文件顶部定义最大重试次数配置 ---
+# --- 在文件顶部定义最大重试次数配置 (预算不足时由 Budget.revision_limit 进一步收紧) ---
 MAX_PLAN_REVISIONS = 2
 MAX_TASK_REVISIONS = 1
+# 规划师给出多份候选计划时的选择方式：llm 为一次批量评估所有候选；heuristic 只做结构检查，不调用 LLM
+PLAN_SELECTION = os.getenv("PLAN_SELECTION", "llm")
 
 logger = logging.getLogger(__name__)
 
+# kind: plan_evaluation / result_evaluation / final_summary；reason: 跳过的原因
+_skipped_llm_calls = metrics_registry.counter(
+    "supervisor_llm_calls_skipped_total", "Supervisor LLM calls avoided, by kind and reason"
+)
 
-def _find_subtask_by_id(plan: Dict[str, Any], task_id: str) -> Optional[Dict[str, Any]]:
-    """Helper function to find a subtask dictionary by its ID in the plan."""
-    for task in plan.get("steps", []):
-        if task.get("task_id") == task_id:
-            return task
-    return None
 
-def _validate_and_correct_plan(plan: Plan) -> (Plan, bool):
+def _validate_and_correct_plan(plan: IndexedPlan) -> (IndexedPlan, bool):
     """
     校验并修正计划的合法性。
     1. 检查每个步骤是否有 'worker' 字段，如果没有则分配给兜底工人。
     2. 检查 'worker' 的值是否是已知的工人，如果不是则分配给兜底工人。
-    返回修正后的计划和一个布尔值，表示计划是否被修正过。
+    返回修正后的计划 (新的 IndexedPlan，原计划不变) 和一个布尔值，表示计划是否被修正过。
     """
     was_corrected = False
     available_worker_names = {worker['name'] for worker in WORKERS_CONFIG.get('workers', [])}
@@ -52,21 +68,90 @@ def _validate_and_correct_plan(plan: Plan) -> (Plan, bool):
         assignee = task.get("worker")
         if not assignee:
             logger.warning(f"计划修正：第 {i+1} 步任务 '{task.get('description')}' 没有指定执行人。自动分配给 other_worker。")
-            task["worker"] = "other_worker"
+            plan = plan.with_task_update(task["task_id"], worker="other_worker")
             was_corrected = True
         elif assignee not in available_worker_names:
             logger.warning(f"计划修正：第 {i+1} 步任务指定了不存在的工人 '{assignee}'。自动重新分配给 other_worker。")
-            task["worker"] = "other_worker"
+            plan = plan.with_task_update(task["task_id"], worker="other_worker")
             was_corrected = True
     
     return plan, was_corrected
 
+def _select_plan_candidate(candidates: List[Plan], request_context: str, budget: Budget) -> (Optional[Plan], Dict[str, Any]):
+    """
+    一次 LLM 调用评估所有候选计划 (候选已按结构启发式排序)，返回 (选中的候选, 评估结果)。
+    评估无法完成时退回启发式排序的第一份，并按结构检查的结果决定是否批准。
+    """
+    candidates_json = json.dumps(
+        [{"candidate": i, "steps": [{k: v for k, v in task.items() if k not in ("status", "result")} for task in plan["steps"]]}
+         for i, plan in enumerate(candidates)],
+        indent=2 if budget.mode == FULL else None, ensure_ascii=False
+    )
+    prompt = plan_candidates_evaluation_prompt.to_messages(user_request=request_context, candidates=candidates_json)
+    try:
+        evaluation = invoke_structured(
+            supervisor_llm, prompt, PlanCandidatesEvaluation, agent="supervisor_plan_eval",
+            **llm_budget_kwargs(budget.call_deadline())
+        ).model_dump()
+    except (StructuredOutputError, DeadlineExceededError) as e:
+        logger.error(f"Plan candidates evaluation unusable ({type(e).__name__}: {e}). Using the heuristic ranking.")
+        return None, {"is_approved": True, "feedback": ""}
+    best = evaluation.get("best_candidate")
+    if not isinstance(best, int) or not 0 <= best < len(candidates):
+        logger.warning(f"Plan candidates evaluation picked an invalid candidate ({best}). Using the heuristic ranking.")
+        return None, evaluation
+    return candidates[best], evaluation
+
+
+def _request_context(state: AgentState) -> str:
+    """多轮会话中把之前各轮的请求和本轮的追加请求一起交给评估和总结，单轮时就是原始请求"""
+    current_request = state.get("current_request")
+    previous_requests = state.get("previous_requests") or []
+    if not previous_requests:
+        return current_request
+    history = "\n".join(f"{i + 1}. {r}" for i, r in enumerate(previous_requests))
+    return f"之前的请求:\n{history}\n\n本轮追加请求:\n{current_request}"
+
+
+def _amendment_note(stats: Optional[Dict[str, int]]) -> str:
+    if not stats:
+        return ""
+    return (f"\n\n(本轮复用了 {stats['skipped']} 个已完成子任务的结果，"
+            f"重新执行 {stats['re_executed']} 个，新增 {stats['added']} 个)")
+
+
+def _with_full_results(plan: IndexedPlan) -> Dict[str, Any]:
+    """最终总结需要完整的子任务结果：把 blob 引用替换为原文 (只用于构造提示词，不写回状态)"""
+    return {**plan, "steps": [{**task, "result": resolve_result(task.get("result"))} for task in plan.steps]}
+
+
+def _best_effort_report(plan: Optional[IndexedPlan], reason: str) -> str:
+    """无法调用 LLM 生成最终报告时，直接汇总已完成子任务的结果"""
+    completed = plan.tasks_with_status("completed") if plan else []
+    if not completed:
+        return f"{reason}，未能完成任何子任务。"
+    sections = [f"{reason}，以下是已完成子任务的结果汇总："]
+    for task in completed:
+        sections.append(f"### {task.get('task_name') or task['task_id']}\n{resolve_result(task.get('result')) or ''}")
+    unfinished = len(plan["steps"]) - len(completed)
+    if unfinished:
+        sections.append(f"(另有 {unfinished} 个子任务未完成)")
+    return "\n\n".join(sections)
+
+@tracks_token_usage
 def supervisor_agent(state: AgentState) -> dict:
     logger.info("--- Agent: Supervisor ---")
     
     current_request = state.get("current_request")
-    overall_plan = state.get("overall_plan")
+    request_context = _request_context(state)
+    amendment_stats = state.get("amendment_stats")
+    # 计划以 IndexedPlan 的形式在状态中流转；所有修改都生成新版本，不原地修改 state
+    overall_plan = IndexedPlan.from_plan(state.get("overall_plan"))
     last_agent_role = state.get("last_agent_role")
+    updates: Dict[str, Any] = {}
+    budget = Budget.from_state(state)
+    if budget.deadline is not None or budget.token_budget is not None:
+        logger.info(f"Session budget: {budget.describe()}")
 
     logger.info(f"Supervisor state: last_role='{last_agent_role}', plan_exists={bool(overall_plan and overall_plan.get('steps'))}, active_task_id='{state.get('active_subtask_id')}'")
 
@@ -87,114 +172,172 @@ def supervisor_agent(state: AgentState) -> dict:
         corrected_plan, was_corrected = _validate_and_correct_plan(overall_plan)
         if was_corrected:
             logger.info("Plan has been auto-corrected by the supervisor.")
-            # 更新状态中的计划
-            state["overall_plan"] = corrected_plan
+            overall_plan = corrected_plan
         
-        # 即使修正了，也继续进行 LLM 评估，因为计划的逻辑可能仍然有问题
-        prompt = plan_evaluation_prompt.format(
-            user_request=current_request,
-            plan=json.dumps(corrected_plan, indent=2, ensure_ascii=False) # 使用修正后的计划进行评估
-        )
-        llm_response = supervisor_llm.invoke(prompt, response_format={"type": "json_object"})
-        
-        try:
-            raw_content = llm_response.content
-            json_start_index = raw_content.find('{')
-            json_end_index = raw_content.rfind('}') + 1
-            json_str = raw_content[json_start_index:json_end_index]
-            evaluation = json.loads(json_str)
-            logger.info(f"Plan evaluation result: {evaluation}")
-
-            if not evaluation.get("is_approved", False):
-                # --- 新增：计划重试计数和检查 ---
-                current_revisions = state.get("plan_revision_count", 0) + 1
-                logger.warning(f"Plan rejected. Revision count: {current_revisions}/{MAX_PLAN_REVISIONS}.")
-
-                if current_revisions > MAX_PLAN_REVISIONS:
-                    logger.error("Maximum plan revisions reached. Forcibly approving the last plan to proceed.")
-                    # 强制接受，让流程继续，而不是终止
-                    state["plan_revision_count"] = 0 # 重置计数器
-                    # 此处不返回，让代码继续向下执行到任务分配逻辑
-                else:
-                    return {
-                        "messages": [AIMessage(content=evaluation.get("feedback", "No feedback provided."))],
-                        "plan_revision_count": current_revisions, # 更新计数
-                        "current_agent_role": "planner",
-                        "last_agent_role": "supervisor"
-                    }
-            
-            logger.info("Plan approved. Resetting plan revision count and proceeding to execution.")
-            state["plan_revision_count"] = 0
-        except (json.JSONDecodeError, KeyError) as e:
-            logger.error(f"Failed to parse plan evaluation: {e}. Raw content: '{llm_response.content}'")
-            return {"current_agent_role": "end_process", "last_agent_role": "supervisor"}
+        # 即使修正了，也继续进行 LLM 评估，因为计划的逻辑可能仍然有问题；预算所剩无几时跳过评估
+        max_plan_revisions = budget.revision_limit(MAX_PLAN_REVISIONS)
+        plan_candidates = state.get("plan_candidates") or []
+        updates["plan_candidates"] = None # 候选只在本轮评估中使用
+        if amendment_stats:
+            # 多轮会话的增量修改：已有部分在上一轮评估并执行过，不再重新评估整个计划
+            logger.info(f"Plan amended for a follow-up request ({amendment_stats}). Skipping LLM plan evaluation.")
+            evaluation = {"is_approved": True, "feedback": ""}
+            _skipped_llm_calls.inc(kind="plan_evaluation", reason="amendment")
+        elif budget.mode in (MINIMAL, EXHAUSTED):
+            logger.warning(f"Budget low ({budget.describe()}). Skipping LLM plan evaluation and approving the plan.")
+            evaluation = {"is_approved": True, "feedback": ""}
+            _skipped_llm_calls.inc(kind="plan_evaluation", reason="budget")
+        elif len(plan_candidates) > 1 and PLAN_SELECTION == "heuristic":
+            # 候选已由规划师按结构启发式排序，排在第一的结构合法即批准
+            problems = plan_structure_problems(corrected_plan, [w["name"] for w in WORKERS_CONFIG.get("workers", [])])
+            logger.info(f"Best of {len(plan_candidates)} plan candidates selected by heuristics: {problems or 'no structural problems'}.")
+            evaluation = {"is_approved": not problems, "feedback": "\n".join(problems)}
+            _skipped_llm_calls.inc(kind="plan_evaluation", reason="heuristic")
+        elif len(plan_candidates) > 1:
+            selected, evaluation = _select_plan_candidate(plan_candidates, request_context, budget)
+            if selected is not None:
+                overall_plan, _ = _validate_and_correct_plan(IndexedPlan.from_plan(selected))
+                corrected_plan = overall_plan
+            logger.info(f"Evaluated {len(plan_candidates)} plan candidates in one call: {evaluation}")
+        else:
+            prompt = plan_evaluation_prompt.to_messages(
+                user_request=request_context,
+                # 使用修正后的计划进行评估；缩短模式下去掉缩进以减少 token
+                plan=json.dumps(corrected_plan, indent=2 if budget.mode == FULL else None, ensure_ascii=False)
+            )
+            try:
+                evaluation = invoke_structured(
+                    supervisor_llm, prompt, PlanEvaluation, agent="supervisor_plan_eval",
+                    **llm_budget_kwargs(budget.call_deadline())
+                ).model_dump()
+            except (StructuredOutputError, DeadlineExceededError) as e:
+                # 评估本身无法完成时不再终止整个流程，而是按批准处理 (计划结构已经过上面的校验)
+                logger.error(f"Plan evaluation unusable ({type(e).__name__}: {e}). Treating the plan as approved.")
+                evaluation = {"is_approved": True, "feedback": ""}
+        logger.info(f"Plan evaluation result: {evaluation}")
+
+        if not evaluation.get("is_approved", False):
+            # --- 新增：计划重试计数和检查 ---
+            current_revisions = state.get("plan_revision_count", 0) + 1
+            logger.warning(f"Plan rejected. Revision count: {current_revisions}/{max_plan_revisions}.")
+
+            if current_revisions > max_plan_revisions:
+                logger.error("Maximum plan revisions reached. Forcibly approving the last plan to proceed.")
+                # 强制接受，让流程继续，而不是终止
+                # 此处不返回，让代码继续向下执行到任务分配逻辑
+            else:
+                return {
+                    **updates,
+                    # 所有候选都不合格时，修订的是评估选出的那一份
+                    "overall_plan": overall_plan,
+                    "messages": [AIMessage(content=evaluation.get("feedback") or "No feedback provided.")],
+                    "plan_revision_count": current_revisions, # 更新计数
+                    "current_agent_role": "planner",
+                    "last_agent_role": "supervisor"
+                }
+
+        logger.info("Plan approved. Resetting plan revision count and proceeding to execution.")
+        updates["plan_revision_count"] = 0
 
     # 场景3: 从 Worker 处收到结果，或从 Planner 处收到批准的计划后，决定下一步
     if last_agent_role == "other_worker":
         logger.info(f"Scenario 3: Received result from Worker for task '{state.get('active_subtask_id')}'. Evaluating result...")
-        active_task = _find_subtask_by_id(overall_plan, state.get('active_subtask_id'))
+        active_task = overall_plan.get_task(state.get('active_subtask_id')) if overall_plan else None
         if not active_task:
              logger.error(f"Logic error: Could not find active task with ID '{state.get('active_subtask_id')}'")
              return {"current_agent_role": "end_process"}
 
-        prompt = result_evaluation_prompt.format(
-            user_request=current_request,
-            subtask_description=active_task["description"],
-            worker_result=state.get("last_worker_result", "")
+        max_task_revisions = budget.revision_limit(MAX_TASK_REVISIONS)
+        worker_settings = get_worker_settings(active_task.get("worker"))
+        # 状态中的结果可能是 blob 引用，评估、校验、缓存和记忆都使用完整结果
+        full_result = resolve_result(state.get("last_worker_result"))
+        result_cached = bool(state.get("last_result_cached"))
+        if result_cached:
+            # 结果来自结果缓存：写入缓存前已经被接受过，不再重复评估
+            logger.info(f"Result for task '{active_task['task_id']}' came from the result cache. Skipping evaluation.")
+            evaluation = {"is_satisfactory": True, "feedback": ""}
+            _skipped_llm_calls.inc(kind="result_evaluation", reason="cached")
+        elif worker_settings and worker_settings.validators:
+            # 工人配置了确定性校验规则：按规则判定，不调用 LLM
+            failures = validate_result(worker_settings.validators, full_result)
+            logger.info(f"Result for task '{active_task['task_id']}' checked by validators: {failures or 'all passed'}.")
+            evaluation = {"is_satisfactory": not failures, "feedback": "\n".join(failures)}
+            _skipped_llm_calls.inc(kind="result_evaluation", reason="validators")
+        elif budget.mode in (MINIMAL, EXHAUSTED):
+            logger.warning(f"Budget low ({budget.describe()}). Skipping LLM result evaluation and accepting the result.")
+            evaluation = {"is_satisfactory": True, "feedback": ""}
+            _skipped_llm_calls.inc(kind="result_evaluation", reason="budget")
+        else:
+            worker_result = full_result or ""
+            if budget.mode == SHORTENED:
+                worker_result = worker_result[:SHORTENED_RESULT_CHARS]
+            prompt = result_evaluation_prompt.to_messages(
+                user_request=request_context,
+                subtask_description=active_task["description"],
+                worker_result=worker_result
+            )
+            try:
+                evaluation = invoke_structured(
+                    supervisor_llm, prompt, ResultEvaluation, agent="supervisor_result_eval",
+                    **llm_budget_kwargs(budget.call_deadline())
+                ).model_dump()
+            except (StructuredOutputError, DeadlineExceededError) as e:
+                logger.error(f"Result evaluation unusable ({type(e).__name__}: {e}). Accepting the worker result.")
+                evaluation = {"is_satisfactory": True, "feedback": ""}
+        logger.info(f"Result evaluation: {evaluation}")
+
+        if not evaluation.get("is_satisfactory", False):
+            current_revisions = state.get("task_revision_count", 0) + 1
+            logger.warning(f"Result for task '{active_task['task_id']}' not satisfactory. Revision count: {current_revisions}/{max_task_revisions}.")
+
+            if current_revisions > max_task_revisions:
+                logger.error(f"Maximum revisions for task '{active_task['task_id']}' reached. Forcibly accepting the last result.")
+                # 强制接受，标记任务为完成，然后继续
+                # 此处不返回，让代码继续向下执行到下一个任务分配逻辑
+            else:
+                return {
+                    "messages": [AIMessage(content=evaluation.get("feedback") or "Result was not satisfactory.")],
+                    "task_revision_count": current_revisions, # 更新计数
+                    "current_agent_role": "other_worker",
+                    "last_agent_role": "supervisor"
+                }
+
+        logger.info(f"Result for task '{active_task['task_id']}' is satisfactory. Resetting task revision count and marking as completed.")
+        result_cache = get_result_cache()
+        if evaluation.get("is_satisfactory") and state.get("last_result_cache_key") and result_cache is not None:
+            # 只缓存通过评估的结果；被强制接受的结果不写入缓存
+            result_cache.put(state["last_result_cache_key"], active_task.get("worker"), full_result or "")
+        overall_plan = overall_plan.with_task_update(
+            active_task["task_id"], status="completed", result=state.get("last_worker_result"), cached=result_cached,
+            duration_s=state.get("last_task_duration_s") if state.get("last_task_completed") and not result_cached else None
         )
-        llm_response = supervisor_llm.invoke(prompt, response_format={"type": "json_object"})
-        
-        try:
-            raw_content = llm_response.content
-            json_start_index = raw_content.find('{')
-            json_end_index = raw_content.rfind('}') + 1
-            json_str = raw_content[json_start_index:json_end_index]
-            evaluation = json.loads(json_str)
-            logger.info(f"Result evaluation: {evaluation}")
-
-            if not evaluation.get("is_satisfactory", False):
-                current_revisions = state.get("task_revision_count", 0) + 1
-                logger.warning(f"Result for task '{active_task['task_id']}' not satisfactory. Revision count: {current_revisions}/{MAX_TASK_REVISIONS}.")
-
-                if current_revisions > MAX_TASK_REVISIONS:
-                    logger.error(f"Maximum revisions for task '{active_task['task_id']}' reached. Forcibly accepting the last result.")
-                    # 强制接受，标记任务为完成，然后继续
-                    state["task_revision_count"] = 0 # 重置计数器
-                    active_task["status"] = "completed"
-                    active_task["result"] = state.get("last_worker_result", "Result forcibly accepted after max revisions.")
-                    # 此处不返回，让代码继续向下执行到下一个任务分配逻辑
-                else:
-                    return {
-                        "messages": [AIMessage(content=evaluation.get("feedback", "Result was not satisfactory."))],
-                        "task_revision_count": current_revisions, # 更新计数
-                        "current_agent_role": "other_worker",
-                        "last_agent_role": "supervisor"
-                    }
-
-            logger.info(f"Result for task '{active_task['task_id']}' is satisfactory. Resetting task revision count and marking as completed.")
-            state["task_revision_count"] = 0
-            active_task["status"] = "completed"
-            active_task["result"] = state.get("last_worker_result")
-
-        except (json.JSONDecodeError, KeyError) as e:
-            logger.error(f"Failed to parse result evaluation: {e}. Raw content: '{llm_response.content}'")
-            return {"current_agent_role": "end_process", "last_agent_role": "supervisor"}
+        remember_subtask_result(current_request, active_task, full_result)
 
     # --- 任务分配逻辑 (场景2批准后和场景3完成后都会进入这里) ---
     logger.info("Entering task assignment logic...")
-    next_pending_task = None
-    for task in overall_plan.get("steps", []):
-        if task.get("status") is None or task.get("status") == "pending":
-            next_pending_task = task
-            break
+    # 计划批准后 (或计划中出现新任务时) 根据历史耗时估计一次各任务的耗时，最终答案中与实际耗时对比
+    schedule = state.get("task_schedule")
+    if overall_plan and any(task["task_id"] not in (schedule or {}).get("estimates", {}) for task in overall_plan.ready_tasks()):
+        schedule = updates["task_schedule"] = build_schedule(overall_plan, schedule)
+        if schedule:
+            logger.info(f"Task schedule: predicted {schedule['predicted_serial_s']:.1f}s for "
+                        f"{overall_plan.count('pending')} pending task(s).")
+    next_pending_task = overall_plan.next_ready_task() if overall_plan else None
+
+    if next_pending_task and budget.mode == EXHAUSTED:
+        # 预算耗尽：剩余子任务标记为 skipped，直接进入最终报告
+        remaining_tasks = overall_plan.tasks_with_status("pending")
+        logger.warning(f"Budget exhausted ({budget.describe()}). Skipping {len(remaining_tasks)} remaining task(s) and finalizing.")
+        for task in remaining_tasks:
+            overall_plan = overall_plan.with_task_update(task["task_id"], status="skipped")
+        next_pending_task = None
 
     if next_pending_task:
         assignee = next_pending_task.get("worker")
         logger.info(f"Found next pending task: '{next_pending_task['description']}'. Activating and assigning to '{assignee}'.")
-        # --- 新增：分配新任务前，确保任务计数器已清零 ---
-        state["task_revision_count"] = 0 
-        next_pending_task["status"] = "active"
+        overall_plan = overall_plan.with_task_update(next_pending_task["task_id"], status="active")
         return {
+            **updates,
             "overall_plan": overall_plan,
             "active_subtask_id": next_pending_task["task_id"],
             "task_revision_count": 0, # 显式返回清零后的状态
@@ -203,34 +346,63 @@ def supervisor_agent(state: AgentState) -> dict:
         }
     else:
         # --- 2. 重写最终报告生成逻辑 ---
+        completed_tasks = overall_plan.tasks_with_status("completed") if overall_plan else []
+        if overall_plan and len(overall_plan.steps) == 1 and len(completed_tasks) == 1:
+            # 单任务计划：总结只会复述这一个结果，直接把它作为最终报告
+            logger.info("Single-task plan completed. Using the task result as the final report without an LLM summary.")
+            _skipped_llm_calls.inc(kind="final_summary", reason="single_task")
+            final_report = (resolve_result(completed_tasks[0].get("result")) or "") + _amendment_note(amendment_stats)
+            remember_final_report(current_request, final_report)
+            return {
+                **updates,
+                "overall_plan": overall_plan,
+                "messages": [AIMessage(content=final_report)],
+                "current_agent_role": "end_process",
+                "last_agent_role": "supervisor"
+            }
+
         logger.info("All tasks are completed. Invoking LLM for final summary.")
         
         try:
             # 准备上下文
-            plan_and_results_json = json.dumps(overall_plan, indent=2, ensure_ascii=False)
+            plan_and_results_json = json.dumps(_with_full_results(overall_plan), indent=2, ensure_ascii=False)
             
             # 格式化 Prompt
-            summary_prompt_str = final_summary_prompt.format(
-                user_request=current_request,
+            summary_messages = final_summary_prompt.to_messages(
+                user_request=request_context,
                 plan_and_results=plan_and_results_json
             )
             
-            # 调用 LLM 生成最终报告
-            final_response = supervisor_llm.invoke(summary_prompt_str)
-            final_report = final_response.content
+            # 调用 LLM 生成最终报告 (使用会话的真实截止时间，不再预留)
+            final_response = supervisor_llm.invoke(summary_messages, **llm_budget_kwargs(budget.deadline))
+            final_report = final_response.content + _amendment_note(amendment_stats)
             
             logger.info(f"Generated final report: {final_report}")
+            remember_final_report(current_request, final_report)
 
             return {
+                **updates,
+                "overall_plan": overall_plan,
                 "messages": [AIMessage(content=final_report)],
                 "current_agent_role": "end_process",
                 "last_agent_role": "supervisor"
             }
+        except DeadlineExceededError as e:
+            logger.warning(f"No time left for the final summary ({e}). Returning a best-effort report.")
+            return {
+                **updates,
+                "overall_plan": overall_plan,
+                "messages": [AIMessage(content=_best_effort_report(overall_plan, "由于时间预算已用完") + _amendment_note(amendment_stats))],
+                "current_agent_role": "end_process",
+                "last_agent_role": "supervisor"
+            }
         except Exception as e:
             logger.error(f"Failed to generate final summary: {e}", exc_info=True)
-            # 发生错误时，返回一个标准的错误信息
+            # 发生错误时，退化为直接汇总已完成的子任务结果
             return {
-                "messages": [AIMessage(content=f"An error occurred while generating the final report: {e}")],
+                **updates,
+                "overall_plan": overall_plan,
+                "messages": [AIMessage(content=_best_effort_report(overall_plan, f"生成最终报告时出错 ({type(e).__name__})") + _amendment_note(amendment_stats))],
                 "current_agent_role": "end_process",
                 "last_agent_role": "supervisor"
             }
@@ -0,0 +1,176 @@
+# app/langgraph_core/agents/worker_scheduler.py
+
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+from langchain_core.runnables import RunnableLambda
+
+from app.core.metrics import metrics_registry
+from app.langgraph_core.agents.config_loader import WorkerSettings, get_worker_settings
+from app.langgraph_core.memory.duration_store import get_duration_store
+from app.langgraph_core.state.plan_index import find_task
+
+logger = logging.getLogger(__name__)
+
+_queue_wait = metrics_registry.histogram("worker_queue_wait_seconds", "Time a subtask waited for a worker slot, by worker")
+_active = metrics_registry.gauge("worker_active", "Subtasks currently executing, by worker")
+_waiting = metrics_registry.gauge("worker_waiting", "Subtasks waiting for a worker slot, by worker")
+_utilization = metrics_registry.gauge("worker_utilization", "Active subtasks / max_concurrency, by worker")
+_busy_seconds = metrics_registry.counter("worker_busy_seconds_total", "Total subtask execution time, by worker")
+
+
+class ConcurrencyLimiter:
+    """
+    进程内共享的计数信号量，同时支持线程 (同步调用) 和协程 (异步调用) 等待，
+    等待者按先来先服务的顺序获得名额。limit 为 None 时不限制，只做统计。
+    """
+
+    def __init__(self, name: str, limit: Optional[int]):
+        self.name = name
+        self.limit = limit
+        self.active = 0
+        self._waiters: Deque[Callable[[], bool]] = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _try_acquire_locked(self) -> bool:
+        if self.limit is None or (self.active < self.limit and not self._waiters):
+            self.active += 1
+            return True
+        return False
+
+    def acquire(self) -> None:
+        event = threading.Event()
+        with self._lock:
+            if self._try_acquire_locked():
+                return self._report()
+
+            def wake() -> bool:
+                event.set()
+                return True
+
+            self._waiters.append(wake)
+            self._report()
+        event.wait()
+
+    async def acquire_async(self) -> None:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def grant() -> None:
+            # 名额已经转交给这个等待者；如果它在此之前被取消了，把名额继续交给下一个
+            if future.cancelled():
+                self.release()
+            elif not future.done():
+                future.set_result(None)
+
+        def wake() -> bool:
+            loop.call_soon_threadsafe(grant)
+            return True
+
+        with self._lock:
+            if self._try_acquire_locked():
+                return self._report()
+            self._waiters.append(wake)
+            self._report()
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if wake in self._waiters:
+                    # 还没有轮到它：直接退出队列；已经转交的名额由 grant() 归还
+                    self._waiters.remove(wake)
+                    self._report()
+            if future.done() and not future.cancelled():
+                # 名额已经交给了它，但协程在恢复执行前被取消
+                self.release()
+            raise
+
+    def release(self) -> None:
+        with self._lock:
+            if self._waiters:
+                # 名额直接转交给下一个等待者，active 不变
+                self._waiters.popleft()()
+            else:
+                self.active -= 1
+            self._report()
+
+    def _report(self) -> None:
+        _active.set(self.active, worker=self.name)
+        _waiting.set(len(self._waiters), worker=self.name)
+        if self.limit:
+            _utilization.set(round(self.active / self.limit, 4), worker=self.name)
+
+
+class WorkerScheduler:
+    """
+    按 workers_config.yaml 中的 max_concurrency 限制每个工人在整个进程内的并发任务数。
+    图中的工人节点由 wrap() 包装：先排队获得名额再执行，并记录排队时间和利用率。
+    """
+
+    def __init__(self):
+        self._limiters: Dict[str, ConcurrencyLimiter] = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, worker_name: str) -> ConcurrencyLimiter:
+        with self._lock:
+            limiter = self._limiters.get(worker_name)
+            if limiter is None:
+                settings: Optional[WorkerSettings] = get_worker_settings(worker_name)
+                limit = settings.max_concurrency if settings else None
+                limiter = self._limiters[worker_name] = ConcurrencyLimiter(worker_name, limit)
+            return limiter
+
+    def wrap(self, worker_name: str, handler: Callable[[Dict[str, Any]], Dict[str, Any]]) -> RunnableLambda:
+        """返回同时支持同步和异步执行的节点；异步执行时排队不占用线程池中的线程"""
+        limiter = self.limiter(worker_name)
+
+        def run(state: Dict[str, Any], waited_since: float) -> Dict[str, Any]:
+            _queue_wait.observe(time.perf_counter() - waited_since, worker=worker_name)
+            start = time.perf_counter()
+            try:
+                result = handler(state)
+            finally:
+                elapsed = time.perf_counter() - start
+                _busy_seconds.inc(elapsed, worker=worker_name)
+            # 记录实际耗时，供估计同类任务的耗时；只记录正常完成的执行：
+            # 超时、出错的执行和取自结果缓存的执行都不代表任务的真实耗时
+            task = find_task(state.get("overall_plan"), state.get("active_subtask_id"))
+            store = get_duration_store()
+            if task is not None and store is not None and result.get("last_task_completed") and not result.get("last_result_cached"):
+                store.record(worker_name, task, elapsed)
+            return {**result, "last_task_duration_s": elapsed}
+
+        def invoke(state: Dict[str, Any]) -> Dict[str, Any]:
+            waited_since = time.perf_counter()
+            limiter.acquire()
+            try:
+                return run(state, waited_since)
+            finally:
+                limiter.release()
+
+        async def ainvoke(state: Dict[str, Any]) -> Dict[str, Any]:
+            waited_since = time.perf_counter()
+            await limiter.acquire_async()
+            try:
+                # 处理函数是同步的，放到线程池中执行；复制上下文以保留 LangGraph 的 config 等 contextvars
+                context = contextvars.copy_context()
+                return await asyncio.get_running_loop().run_in_executor(
+                    None, functools.partial(context.run, run, state, waited_since)
+                )
+            finally:
+                limiter.release()
+
+        return RunnableLambda(invoke, afunc=ainvoke, name=worker_name)
+
+
+worker_scheduler = WorkerScheduler()
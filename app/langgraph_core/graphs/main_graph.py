@@ -3,23 +3,19 @@ import logging
 import importlib
 from langgraph.graph import StateGraph, END
 from app.langgraph_core.state.graph_state import AgentState, SubTask
+from app.langgraph_core.state.plan_index import find_task
 from app.langgraph_core.agents.main.supervisor_agent import supervisor_agent
 from app.langgraph_core.agents.main.planner_agent import planner_agent
 
 # 导入我们的配置加载器
 from app.langgraph_core.agents.config_loader import WORKERS_CONFIG
+from app.langgraph_core.agents.worker_scheduler import worker_scheduler
 
 logger = logging.getLogger(__name__)
 
 def _find_active_task(state: AgentState) -> SubTask | None:
-    """在计划中找到当前激活的任务"""
-    active_task_id = state.get("active_subtask_id")
-    if not active_task_id:
-        return None
-    for task in state.get("overall_plan", {}).get("steps", []):
-        if task.get("task_id") == active_task_id:
-            return task
-    return None
+    """在计划中找到当前激活的任务 (通过 IndexedPlan 的 ID 索引，O(1))"""
+    return find_task(state.get("overall_plan"), state.get("active_subtask_id"))
 
 def import_from_string(path: str):
     """根据字符串路径动态导入函数或类"""
@@ -71,7 +67,8 @@ def build_main_graph():
         handler_path = worker_config["handler_function"]
         try:
             handler_function = import_from_string(handler_path)
-            workflow.add_node(worker_name, handler_function)
+            # 经过调度器包装：按 max_concurrency 在所有会话之间限制该工人的并发任务数
+            workflow.add_node(worker_name, worker_scheduler.wrap(worker_name, handler_function))
             worker_nodes[worker_name] = worker_name # 用于后面条件边的映射
             logger.info(f"Dynamically added worker node: '{worker_name}' from '{handler_path}'")
         except Exception as e:
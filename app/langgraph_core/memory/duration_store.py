@@ -0,0 +1,220 @@
+# app/langgraph_core/memory/duration_store.py
+
+import bisect
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.metrics import metrics_registry
+from app.langgraph_core.state.graph_state import Plan, SubTask
+from app.langgraph_core.state.plan_index import COMPLETED_STATUS
+
+logger = logging.getLogger(__name__)
+
+# --- 配置 ---
+TASK_DURATIONS_ENABLED = os.getenv("TASK_DURATIONS_ENABLED", "true").lower() == "true"
+TASK_DURATIONS_PATH = os.getenv("TASK_DURATIONS_PATH", os.path.join("data", "task_durations.sqlite3"))
+# 某个 (工人, 任务类型) 的样本少于该数时，退回到该工人所有任务的分布，再退回到默认值
+TASK_DURATION_MIN_SAMPLES = int(os.getenv("TASK_DURATION_MIN_SAMPLES", "3"))
+TASK_DURATION_DEFAULT_S = float(os.getenv("TASK_DURATION_DEFAULT_S", "30"))
+
+# 直方图桶的上界 (秒)，最后一个桶收集更长的耗时
+_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+_ALL_TYPES = "*"
+
+_task_seconds = metrics_registry.histogram("task_duration_seconds", "Subtask execution time, by worker",
+                                           buckets=_BUCKETS)
+_prediction_ratio = metrics_registry.histogram(
+    "task_duration_prediction_ratio", "Actual / predicted subtask execution time, by estimate source",
+    buckets=(0.25, 0.5, 0.8, 1.25, 2, 4, 8),
+)
+
+_CJK = re.compile(r"[\u4e00-\u9fff]")
+_WORD = re.compile(r"[A-Za-z]+")
+
+
+def task_type(task: SubTask) -> str:
+    """
+    粗略的任务类型，用于把相似的任务归到一起统计耗时：任务名称开头的动词，
+    中文取前两个汉字 (例如 "收集"、"撰写")，英文取第一个单词；都没有时为 "other"。
+    """
+    name = (task.get("task_name") or task.get("description") or "").strip()
+    if len(name) >= 2 and _CJK.match(name[0]) and _CJK.match(name[1]):
+        return name[:2]
+    word = _WORD.search(name)
+    return word.group(0).lower() if word else "other"
+
+
+class _Histogram:
+    __slots__ = ("counts", "samples", "sum_s")
+
+    def __init__(self, counts: Optional[List[int]] = None, samples: int = 0, sum_s: float = 0.0):
+        self.counts = counts or [0] * (len(_BUCKETS) + 1)
+        self.samples = samples
+        self.sum_s = sum_s
+
+    def add(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(_BUCKETS, seconds)] += 1
+        self.samples += 1
+        self.sum_s += seconds
+
+    def median(self) -> float:
+        """按桶内线性插值估计中位数；落在最后一个 (无上界) 桶时用平均值"""
+        target = self.samples / 2
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if count and cumulative + count >= target:
+                if index == len(_BUCKETS):
+                    return self.sum_s / self.samples
+                lower = _BUCKETS[index - 1] if index else 0.0
+                return lower + (_BUCKETS[index] - lower) * (target - cumulative) / count
+            cumulative += count
+        return self.sum_s / max(self.samples, 1)
+
+
+class DurationStore:
+    """
+    子任务实际执行耗时的本地直方图，按 (工人, 任务类型) 和 (工人, 全部类型) 两级统计，
+    存放在 SQLite 文件中跨进程重启保留；查询走内存中的副本，不访问磁盘。
+    """
+
+    def __init__(self, path: str = TASK_DURATIONS_PATH, min_samples: int = TASK_DURATION_MIN_SAMPLES,
+                 default_s: float = TASK_DURATION_DEFAULT_S):
+        self.path = path
+        self.min_samples = min_samples
+        self.default_s = default_s
+        self._conn: Optional[sqlite3.Connection] = None
+        self._histograms: Optional[Dict[Tuple[str, str], _Histogram]] = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS durations ("
+                " worker TEXT NOT NULL, task_type TEXT NOT NULL, counts TEXT NOT NULL,"
+                " samples INTEGER NOT NULL, sum_s REAL NOT NULL, updated_at REAL NOT NULL,"
+                " PRIMARY KEY (worker, task_type))"
+            )
+            self._conn = conn
+        return self._conn
+
+    def _loaded(self) -> Dict[Tuple[str, str], _Histogram]:
+        if self._histograms is None:
+            histograms: Dict[Tuple[str, str], _Histogram] = {}
+            try:
+                rows = self._connection().execute("SELECT worker, task_type, counts, samples, sum_s FROM durations").fetchall()
+            except sqlite3.Error as e:
+                logger.error(f"Failed to load task duration history: {e}")
+                rows = []
+            for worker, kind, counts, samples, sum_s in rows:
+                counts = json.loads(counts)
+                if len(counts) == len(_BUCKETS) + 1:
+                    histograms[(worker, kind)] = _Histogram(counts, samples, sum_s)
+            self._histograms = histograms
+        return self._histograms
+
+    def record(self, worker: str, task: SubTask, seconds: float) -> None:
+        _task_seconds.observe(seconds, worker=worker)
+        now = time.time()
+        with self._lock:
+            histograms = self._loaded()
+            rows = []
+            for key in ((worker, task_type(task)), (worker, _ALL_TYPES)):
+                histogram = histograms.setdefault(key, _Histogram())
+                histogram.add(seconds)
+                rows.append((*key, json.dumps(histogram.counts), histogram.samples, histogram.sum_s, now))
+            try:
+                conn = self._connection()
+                conn.executemany("INSERT OR REPLACE INTO durations (worker, task_type, counts, samples, sum_s, updated_at)"
+                                 " VALUES (?, ?, ?, ?, ?, ?)", rows)
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Failed to store task duration: {e}")
+
+    def estimate(self, task: SubTask) -> Tuple[float, str]:
+        """预计耗时 (秒) 及其来源：type (同类任务)、worker (该工人的所有任务) 或 default"""
+        worker = task.get("worker") or ""
+        with self._lock:
+            histograms = self._loaded()
+            for key, source in (((worker, task_type(task)), "type"), ((worker, _ALL_TYPES), "worker")):
+                histogram = histograms.get(key)
+                if histogram is not None and histogram.samples >= self.min_samples:
+                    return histogram.median(), source
+        return self.default_s, "default"
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_duration_store: Optional[DurationStore] = None
+_duration_store_lock = threading.Lock()
+
+
+def get_duration_store() -> Optional[DurationStore]:
+    """进程内共享的耗时统计；TASK_DURATIONS_ENABLED=false 时返回 None"""
+    global _duration_store
+    if not TASK_DURATIONS_ENABLED:
+        return None
+    if _duration_store is None:
+        with _duration_store_lock:
+            if _duration_store is None:
+                _duration_store = DurationStore()
+    return _duration_store
+
+
+def build_schedule(plan: Plan, previous: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    为计划中尚未完成的任务估计耗时，返回存入状态的调度信息：
+    estimates / sources (task_id -> 预计秒数 / 估计来源) 和 predicted_serial_s (剩余任务逐个执行的预计总耗时)。
+    previous 中已有的估计保持不变，最终答案中已完成的任务仍然按执行前的估计对比。
+    """
+    store = get_duration_store()
+    if store is None:
+        return None
+    estimates = dict((previous or {}).get("estimates") or {})
+    sources = dict((previous or {}).get("sources") or {})
+    remaining = [task for task in plan.get("steps") or [] if task.get("status") != COMPLETED_STATUS]
+    for task in remaining:
+        if task["task_id"] not in estimates:
+            estimates[task["task_id"]], sources[task["task_id"]] = store.estimate(task)
+    return {
+        "estimates": estimates,
+        "sources": sources,
+        "predicted_serial_s": round(sum(estimates[task["task_id"]] for task in remaining), 3),
+    }
+
+
+def schedule_report(plan: Optional[Plan], schedule: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    最终答案中的预测与实际对比：每个正常完成的任务的预计/实际耗时，以及这些任务的预计/实际总耗时。
+    两个总数只统计同一组任务的执行时间，不包括监督者评估、重做和生成报告的时间；
+    超时、跳过或取自缓存的任务没有实际耗时，不参与对比。
+    """
+    if not plan or not schedule:
+        return None
+    tasks = []
+    for task in plan.get("steps") or []:
+        predicted = schedule["estimates"].get(task["task_id"])
+        actual = task.get("duration_s")
+        if predicted is None or actual is None:
+            continue
+        source = schedule["sources"].get(task["task_id"])
+        _prediction_ratio.observe(actual / predicted if predicted else 0.0, source=source)
+        tasks.append({"task_id": task["task_id"], "worker": task.get("worker"), "task_type": task_type(task),
+                      "predicted_s": round(predicted, 3), "actual_s": round(actual, 3), "source": source})
+    return {
+        "predicted_serial_s": round(sum(t["predicted_s"] for t in tasks), 3),
+        "actual_task_s": round(sum(t["actual_s"] for t in tasks), 3),
+        "tasks": tasks,
+    }
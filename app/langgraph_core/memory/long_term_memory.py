@@ -0,0 +1,199 @@
+# app/langgraph_core/memory/long_term_memory.py
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from app.langgraph_core.memory.vector_store import VectorStore, text_hash
+from app.llms.embedding_batcher import MicroBatchingEmbeddings
+
+logger = logging.getLogger(__name__)
+
+# --- 配置 ---
+# 默认关闭：开启后每个子任务都会先做一次 embedding 检索 (以及每个被接受的结果一次写入)
+MEMORY_ENABLED = os.getenv("LONG_TERM_MEMORY_ENABLED", "false").lower() == "true"
+MEMORY_STORE_DIR = os.getenv("MEMORY_STORE_DIR", os.path.join("data", "memory"))
+MEMORY_TOP_K = int(os.getenv("MEMORY_TOP_K", "3"))
+MEMORY_MIN_SCORE = float(os.getenv("MEMORY_MIN_SCORE", "0.8"))
+_EMBEDDING_CACHE_SIZE = 4096
+_MAX_EMBED_CHARS = 8000  # 超长文本截断后再做 embedding
+_MAX_STORED_CHARS = 4000  # 元数据中保存的文本长度上限
+
+
+class EmbeddingCache:
+    """以文本哈希为键的 LRU 向量缓存，未命中时再查持久化存储中已有的向量"""
+
+    def __init__(self, max_size: int = _EMBEDDING_CACHE_SIZE):
+        self.max_size = max_size
+        self._items: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest: str, store: Optional[VectorStore]) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._items.get(digest)
+            if vector is not None:
+                self._items.move_to_end(digest)
+                self.hits += 1
+                return vector
+        row = store.row_for_hash(digest) if store is not None else None
+        if row is not None:
+            vector = store.vector(row)
+            self.put(digest, vector)
+            self.hits += 1
+            return vector
+        self.misses += 1
+        return None
+
+    def put(self, digest: str, vector: np.ndarray) -> None:
+        with self._lock:
+            self._items[digest] = vector
+            self._items.move_to_end(digest)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+
+class LongTermMemory:
+    """
+    跨会话的长期记忆：把子任务结果和最终报告做 embedding 后写入 VectorStore，
+    并按语义相似度为新的任务检索相关的历史结果。
+    """
+
+    def __init__(self, embeddings: Embeddings, directory: str = MEMORY_STORE_DIR):
+        self.embeddings = embeddings
+        self.directory = directory
+        self.cache = EmbeddingCache()
+        self._store: Optional[VectorStore] = None
+        self._store_lock = threading.Lock()
+
+    def _get_store(self, dim: int) -> VectorStore:
+        # 向量维度取决于 embedding 模型，第一次拿到向量时才创建存储
+        if self._store is None:
+            with self._store_lock:
+                if self._store is None:
+                    self._store = VectorStore(self.directory, dim)
+        return self._store
+
+    def embed_texts(self, texts: List[str], timeout: Optional[float] = None) -> np.ndarray:
+        texts = [t[:_MAX_EMBED_CHARS] for t in texts]
+        digests = [text_hash(t) for t in texts]
+        vectors: List[Optional[np.ndarray]] = [self.cache.get(d, self._store) for d in digests]
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            # 单条文本走 embed_query，让微批处理器把它和其他会话的请求合并
+            if len(missing) == 1 and isinstance(self.embeddings, MicroBatchingEmbeddings):
+                embedded = [self.embeddings.embed_query(texts[missing[0]], timeout=timeout)]
+            elif len(missing) == 1:
+                embedded = [self.embeddings.embed_query(texts[missing[0]])]
+            else:
+                embedded = self.embeddings.embed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, embedded):
+                vectors[i] = np.asarray(vector, dtype=np.float32)
+                self.cache.put(digests[i], vectors[i])
+        return np.stack(vectors)
+
+    def remember(self, text: str, kind: str, metadata: Optional[Dict[str, Any]] = None) -> bool:
+        """写入一条记忆，相同文本只保存一次。返回是否新写入。"""
+        if not text or not text.strip():
+            return False
+        digest = text_hash(text[:_MAX_EMBED_CHARS])
+        if self._store is not None and self._store.row_for_hash(digest) is not None:
+            return False
+        vector = self.embed_texts([text])
+        store = self._get_store(vector.shape[1])
+        if store.row_for_hash(digest) is not None:
+            return False
+        store.add(vector, [{"hash": digest, "kind": kind, "text": text[:_MAX_STORED_CHARS], **(metadata or {})}])
+        return True
+
+    def recall(self, query: str, k: int = MEMORY_TOP_K, min_score: float = MEMORY_MIN_SCORE,
+               kinds: Optional[List[str]] = None, timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        """检索与 query 最相关的记忆，返回带 score 字段的记录列表；query 的 embedding 超过 timeout 秒时抛出 TimeoutError"""
+        vector = self.embed_texts([query], timeout=timeout)[0]
+        store = self._get_store(vector.shape[0])
+        return [{**record, "score": score} for score, record in store.search(vector, k, min_score, kinds)]
+
+
+# --- 全局实例与对外的钩子函数 ---
+_memory: Optional[LongTermMemory] = None
+_memory_lock = threading.Lock()
+# 写入在后台单线程中进行，不阻塞主流程
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-writer")
+
+
+def get_long_term_memory() -> LongTermMemory:
+    global _memory
+    with _memory_lock:
+        if _memory is None:
+            from app.llms.embedding_models import batched_embedding_model
+            _memory = LongTermMemory(batched_embedding_model)
+        return _memory
+
+
+def _remember_in_background(text: str, kind: str, metadata: Dict[str, Any]) -> None:
+    if not MEMORY_ENABLED:
+        return
+
+    def write():
+        try:
+            get_long_term_memory().remember(text, kind, metadata)
+        except Exception as e:
+            logger.warning(f"Failed to write long-term memory ({kind}): {e}")
+
+    _writer.submit(write)
+
+
+def remember_subtask_result(user_request: str, subtask: Dict[str, Any], result: Optional[str]) -> None:
+    """Supervisor 认可一个子任务结果后调用"""
+    if not result:
+        return
+    text = f"任务: {subtask.get('description', '')}\n结果: {result}"
+    _remember_in_background(text, "subtask_result", {
+        "user_request": (user_request or "")[:500],
+        "task_name": subtask.get("task_name"),
+        "worker": subtask.get("worker"),
+    })
+
+
+def remember_final_report(user_request: str, report: str) -> None:
+    """最终报告生成后调用"""
+    text = f"用户请求: {user_request}\n最终报告: {report}"
+    _remember_in_background(text, "final_report", {"user_request": (user_request or "")[:500]})
+
+
+def retrieve_related_memories(query: str, k: int = MEMORY_TOP_K, kinds: Optional[List[str]] = None,
+                              deadline: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    供工人调用的检索钩子，失败时返回空列表而不是中断任务。
+    deadline 为调用方的截止时间 (time.time() 时间戳)，检索不会超过它；到期时同样返回空列表。
+    """
+    if not MEMORY_ENABLED or not query:
+        return []
+    timeout = deadline - time.time() if deadline is not None else None
+    if timeout is not None and timeout <= 0:
+        return []
+    try:
+        return get_long_term_memory().recall(query, k=k, kinds=kinds, timeout=timeout)
+    except TimeoutError:
+        logger.warning("Long-term memory retrieval timed out; continuing without memories.")
+        return []
+    except Exception as e:
+        logger.warning(f"Long-term memory retrieval failed: {e}")
+        return []
+
+
+def format_memories_for_prompt(memories: List[Dict[str, Any]]) -> str:
+    if not memories:
+        return ""
+    lines = ["以下是历史会话中与当前任务相关的结果，仅供参考："]
+    for i, memory in enumerate(memories, 1):
+        lines.append(f"[{i}] (相似度 {memory['score']:.2f}) {memory['text']}")
+    return "\n".join(lines)
@@ -0,0 +1,134 @@
+# app/langgraph_core/memory/result_cache.py
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterable, Optional, Sequence
+
+from app.core.metrics import metrics_registry
+
+logger = logging.getLogger(__name__)
+
+# --- 配置 ---
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", os.path.join("data", "result_cache.sqlite3"))
+RESULT_CACHE_TTL_S = float(os.getenv("RESULT_CACHE_TTL_S", str(24 * 3600)))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000"))
+
+_lookups = metrics_registry.counter("result_cache_lookups_total", "Subtask result cache lookups, by worker and outcome")
+_evictions = metrics_registry.counter("result_cache_evictions_total", "Entries removed from the result cache, by reason")
+
+
+def result_cache_key(worker: str, description: str, dependency_results: Iterable[Optional[str]],
+                     prompt_version: str, messages: Sequence[str] = (), memories: str = "",
+                     tenant: Optional[str] = None) -> str:
+    """
+    内容寻址的缓存键：工人、任务描述、依赖任务的结果 (按依赖顺序)、提示词版本，以及提示词中的其余输入
+    (消息历史，即用户请求和之前的对话；检索到的长期记忆) 和租户的哈希。
+    键覆盖了工人 prompt 的全部输入，任何一项变化都会得到不同的键，因此不需要主动失效；
+    不同租户之间的结果互不可见。
+    """
+    payload = json.dumps([worker, description, list(dependency_results), prompt_version,
+                          list(messages), memories, tenant], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    跨会话共享的子任务结果缓存，存放在本地 SQLite 文件中 (WAL 模式，多个进程可以共用)。
+    条目在 ttl_s 后过期；超过 max_entries 时按最近使用时间淘汰最久未用的条目。
+    """
+
+    def __init__(self, path: str = RESULT_CACHE_PATH, ttl_s: float = RESULT_CACHE_TTL_S,
+                 max_entries: int = RESULT_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key TEXT PRIMARY KEY, worker TEXT NOT NULL, result TEXT NOT NULL,"
+                " created_at REAL NOT NULL, last_used_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS results_created ON results (created_at)")
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str, worker: str) -> Optional[str]:
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._connection()
+                row = conn.execute("SELECT result, created_at FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None and now - row[1] > self.ttl_s:
+                    conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                    conn.commit()
+                    _evictions.inc(reason="ttl")
+                    row = None
+                if row is not None:
+                    conn.execute("UPDATE results SET last_used_at = ? WHERE key = ?", (now, key))
+                    conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Result cache lookup failed: {e}")
+            _lookups.inc(worker=worker, outcome="error")
+            return None
+        _lookups.inc(worker=worker, outcome="hit" if row is not None else "miss")
+        return row[0] if row is not None else None
+
+    def put(self, key: str, worker: str, result: str) -> None:
+        now = time.time()
+        try:
+            with self._lock:
+                conn = self._connection()
+                conn.execute(
+                    "INSERT OR REPLACE INTO results (key, worker, result, created_at, last_used_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, worker, result, now, now),
+                )
+                expired = conn.execute("DELETE FROM results WHERE created_at < ?", (now - self.ttl_s,)).rowcount
+                overflow = conn.execute(
+                    "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                ).rowcount
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to store subtask result in cache: {e}")
+            return
+        if expired:
+            _evictions.inc(expired, reason="ttl")
+        if overflow:
+            _evictions.inc(overflow, reason="lru")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_result_cache: Optional[ResultCache] = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    """进程内共享的结果缓存；RESULT_CACHE_ENABLED=false 时返回 None"""
+    global _result_cache
+    if not RESULT_CACHE_ENABLED:
+        return None
+    if _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                _result_cache = ResultCache()
+    return _result_cache
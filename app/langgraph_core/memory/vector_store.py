@@ -0,0 +1,210 @@
+# app/langgraph_core/memory/vector_store.py
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 向量数量超过该阈值后启用 IVF 倒排分区检索
+IVF_THRESHOLD = int(os.getenv("MEMORY_IVF_THRESHOLD", "50000"))
+# IVF 检索时探查的分区数量
+IVF_NPROBE = int(os.getenv("MEMORY_IVF_NPROBE", "8"))
+_INITIAL_CAPACITY = 1024
+_KMEANS_ITERATIONS = 10
+_KMEANS_SAMPLE = 100_000
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """返回 scores 中最大的 k 个元素的下标 (按分数降序)"""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates])]
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """把每个向量分配给最近 (点积最大) 的质心，分批计算避免生成 (n, nlist) 的巨大矩阵"""
+    return np.concatenate([
+        np.argmax(vectors[i:i + 16384] @ centroids.T, axis=1)
+        for i in range(0, vectors.shape[0], 16384)
+    ])
+
+
+class IVFIndex:
+    """基于 k-means 质心的倒排分区索引，只在质心最近的 nprobe 个分区中做暴力检索"""
+
+    def __init__(self, vectors: np.ndarray):
+        count = vectors.shape[0]
+        self.nlist = max(1, int(np.sqrt(count)))
+        self.built_at = count
+        rng = np.random.default_rng(0)
+        sample = vectors[np.sort(rng.choice(count, size=min(count, _KMEANS_SAMPLE), replace=False))]
+        centroids = sample[rng.choice(sample.shape[0], size=self.nlist, replace=False)].copy()
+        for _ in range(_KMEANS_ITERATIONS):
+            assignment = _assign(sample, centroids)
+            counts = np.bincount(assignment, minlength=self.nlist)
+            nonempty = np.flatnonzero(counts)
+            starts = (np.cumsum(counts) - counts)[nonempty]
+            # 向量已经单位化，质心只需要方向，用分组求和代替求平均
+            centroids[nonempty] = np.add.reduceat(sample[np.argsort(assignment, kind="stable")], starts, axis=0)
+            centroids = _normalize(centroids)
+        self.centroids = centroids.astype(np.float32)
+        # 每个分区保存若干个行号数组，增量添加时直接追加新数组
+        self.lists: List[List[np.ndarray]] = [[] for _ in range(self.nlist)]
+        self.add(vectors, 0)
+
+    def add(self, vectors: np.ndarray, first_row: int) -> None:
+        assignment = _assign(vectors, self.centroids)
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.searchsorted(assignment[order], np.arange(self.nlist + 1))
+        for c in range(self.nlist):
+            if bounds[c + 1] > bounds[c]:
+                self.lists[c].append(order[bounds[c]:bounds[c + 1]] + first_row)
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        arrays = [rows for c in _top_k(self.centroids @ query, nprobe) for rows in self.lists[c]]
+        return np.concatenate(arrays) if arrays else np.empty(0, dtype=np.int64)
+
+
+class VectorStore:
+    """
+    持久化的向量存储。
+    - 向量以单位化后的 float32 矩阵保存在 vectors.f32 中，通过 np.memmap 读写，容量按倍数增长。
+    - 每条向量对应的元数据 (文本、类型、来源等) 以 JSONL 追加写入 records.jsonl。
+    - 余弦相似度退化为点积，用一次矩阵乘法完成暴力 top-k；
+      数量超过 IVF_THRESHOLD 后改用 IVF 分区检索。
+    """
+
+    def __init__(self, directory: str, dim: int):
+        self.directory = directory
+        self.dim = dim
+        self._vectors_path = os.path.join(directory, "vectors.f32")
+        self._records_path = os.path.join(directory, "records.jsonl")
+        self._meta_path = os.path.join(directory, "meta.json")
+        self._lock = threading.RLock()
+        self._ivf: Optional[IVFIndex] = None
+        self.records: List[Dict[str, Any]] = []
+        self._rows_by_hash: Dict[str, int] = {}
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    # --- 持久化 ---
+
+    def _load(self) -> None:
+        capacity = _INITIAL_CAPACITY
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["dim"] != self.dim:
+                raise ValueError(f"Vector store at '{self.directory}' has dim {meta['dim']}, expected {self.dim}.")
+            capacity = meta["capacity"]
+        if os.path.exists(self._records_path):
+            with open(self._records_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        self.records.append(json.loads(line))
+        self._rows_by_hash = {r["hash"]: i for i, r in enumerate(self.records)}
+        self._open_matrix(capacity)
+
+    def _open_matrix(self, capacity: int) -> None:
+        required = capacity * self.dim * 4
+        if not os.path.exists(self._vectors_path) or os.path.getsize(self._vectors_path) < required:
+            with open(self._vectors_path, "ab") as f:
+                f.truncate(required)
+        self.capacity = capacity
+        self.matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+        with open(self._meta_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "capacity": capacity, "count": len(self.records)}, f)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    # --- 写入 ---
+
+    def row_for_hash(self, digest: str) -> Optional[int]:
+        return self._rows_by_hash.get(digest)
+
+    def vector(self, row: int) -> np.ndarray:
+        return np.array(self.matrix[row])
+
+    def add(self, vectors: np.ndarray, records: List[Dict[str, Any]]) -> List[int]:
+        """追加一批向量和对应的元数据，返回它们的行号。元数据中必须包含 hash 字段。"""
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim))
+        with self._lock:
+            start = len(self.records)
+            end = start + vectors.shape[0]
+            if end > self.capacity:
+                capacity = self.capacity
+                while capacity < end:
+                    capacity *= 2
+                self.matrix.flush()
+                del self.matrix
+                self._open_matrix(capacity)
+            self.matrix[start:end] = vectors
+            self.matrix.flush()
+            with open(self._records_path, "a", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            for offset, record in enumerate(records):
+                self.records.append(record)
+                self._rows_by_hash[record["hash"]] = start + offset
+            if self._ivf is not None:
+                self._ivf.add(vectors, start)
+            return list(range(start, end))
+
+    # --- 检索 ---
+
+    def _maybe_build_ivf(self) -> None:
+        count = len(self.records)
+        if count < IVF_THRESHOLD:
+            return
+        # 首次超过阈值，或自上次构建以来数据量翻倍时重建质心
+        if self._ivf is None or count >= 2 * self._ivf.built_at:
+            logger.info(f"Building IVF index over {count} memory vectors.")
+            self._ivf = IVFIndex(np.asarray(self.matrix[:count]))
+
+    def search(self, query: np.ndarray, k: int = 5, min_score: float = 0.0,
+               kinds: Optional[List[str]] = None) -> List[Tuple[float, Dict[str, Any]]]:
+        """返回与 query 余弦相似度最高的 k 条记录 [(score, record), ...]"""
+        query = _normalize(np.asarray(query, dtype=np.float32).reshape(self.dim))
+        with self._lock:
+            count = len(self.records)
+            if count == 0:
+                return []
+            self._maybe_build_ivf()
+            if self._ivf is not None:
+                rows = self._ivf.candidates(query, IVF_NPROBE)
+                scores = self.matrix[rows] @ query
+            else:
+                rows = None
+                scores = self.matrix[:count] @ query
+            # 按类型过滤时多取一些候选，过滤后再截断
+            fetch = k if not kinds else min(scores.shape[0], k * 4)
+            results = []
+            for i in _top_k(scores, fetch):
+                row = int(rows[i]) if rows is not None else int(i)
+                score = float(scores[i])
+                record = self.records[row]
+                if score < min_score or (kinds and record.get("kind") not in kinds):
+                    continue
+                results.append((score, record))
+                if len(results) >= k:
+                    break
+            return results
@@ -0,0 +1,140 @@
+# app/langgraph_core/prompts/example_selector.py
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.example_selectors.base import BaseExampleSelector
+
+from app.core.metrics import metrics_registry
+
+logger = logging.getLogger(__name__)
+
+# --- 配置 ---
+# all (默认): 每次都放入全部示例，示例位于固定的提示词前缀中，便于前缀缓存，不需要额外的 embedding 调用；
+# semantic: 按与当前请求的语义相似度选择 few-shot 示例 (提示词更短，但每次生成计划前多一次 embedding 调用，且示例不再属于固定前缀)
+FEW_SHOT_SELECTION = os.getenv("FEW_SHOT_SELECTION", "all").lower()
+FEW_SHOT_TOP_K = int(os.getenv("FEW_SHOT_TOP_K", "2"))
+# 选中示例的 token 上限 (估算值)；至少保留相似度最高的一个示例
+FEW_SHOT_MAX_TOKENS = int(os.getenv("FEW_SHOT_MAX_TOKENS", "1500"))
+FEW_SHOT_CACHE_DIR = os.getenv("FEW_SHOT_CACHE_DIR", os.path.join("data", "few_shot"))
+
+_selections = metrics_registry.counter("few_shot_selections_total", "Few-shot example selections, by prompt and outcome")
+_tokens_saved = metrics_registry.counter(
+    "few_shot_prompt_tokens_saved_total", "Estimated prompt tokens saved by selecting examples instead of including all, by prompt"
+)
+
+_CJK = re.compile(r"[\u3000-\u9fff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计 token 数：中日韩字符按每字 1 个，其余按每 4 个字符 1 个"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _embedding_model_name(embeddings: Embeddings) -> str:
+    inner = getattr(embeddings, "inner", embeddings)
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", str(getattr(inner, "model", None) or type(inner).__name__))
+
+
+class SemanticExampleSelector(BaseExampleSelector):
+    """
+    按语义相似度选择 few-shot 示例。示例的向量预先计算并缓存在磁盘上，
+    缓存文件名包含示例文件的内容哈希和 embedding 模型名，示例文件修改后自动重新计算。
+    add_example() 添加的示例只保存在内存中，重新读取示例文件后仍然保留。
+    select_examples() 返回相似度最高的 k 个示例中不超过 token 上限的部分；
+    embedding 不可用时返回 None，由调用方退回到使用全部示例。
+    """
+
+    def __init__(self, examples_path: str, embeddings_factory: Callable[[], Embeddings],
+                 format_example: Callable[[Dict[str, Any]], str], input_key: str = "input",
+                 k: int = FEW_SHOT_TOP_K, max_tokens: int = FEW_SHOT_MAX_TOKENS,
+                 cache_dir: str = FEW_SHOT_CACHE_DIR):
+        self.examples_path = examples_path
+        self.name = os.path.splitext(os.path.basename(examples_path))[0]
+        self._embeddings_factory = embeddings_factory
+        self.format_example = format_example
+        self.input_key = input_key
+        self.k = k
+        self.max_tokens = max_tokens
+        self.cache_dir = cache_dir
+        self.examples: List[Dict[str, Any]] = []
+        self._vectors: Optional[np.ndarray] = None
+        self._example_tokens: List[int] = []
+        self._mtime: Optional[float] = None
+        # add_example() 添加的示例及其 (已归一化的) 向量
+        self._added: List[Dict[str, Any]] = []
+        self._added_vectors: List[np.ndarray] = []
+        self._lock = threading.Lock()
+
+    def add_example(self, example: Dict[str, Any]) -> None:
+        vector = np.asarray(self._embeddings_factory().embed_documents([str(example[self.input_key])])[0], dtype=np.float32)
+        vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        with self._lock:
+            self._load()
+            self._added.append(example)
+            self._added_vectors.append(vector)
+            self.examples = self.examples + [example]
+            self._vectors = np.vstack([self._vectors, vector[None, :]])
+            self._example_tokens = self._example_tokens + [estimate_tokens(self.format_example(example))]
+
+    def _load(self) -> None:
+        """示例文件没有变化时直接返回；变化时重新读取，并从磁盘缓存加载或重新计算向量"""
+        mtime = os.path.getmtime(self.examples_path)
+        if self._vectors is not None and mtime == self._mtime:
+            return
+        with open(self.examples_path, "rb") as f:
+            raw = f.read()
+        examples = json.loads(raw.decode("utf-8"))
+        embeddings = self._embeddings_factory()
+        prefix = os.path.join(self.cache_dir, f"{self.name}-{_embedding_model_name(embeddings)}-")
+        cache_path = f"{prefix}{hashlib.sha256(raw).hexdigest()[:16]}.npy"
+        if os.path.exists(cache_path):
+            vectors = np.load(cache_path)
+        else:
+            vectors = np.asarray(embeddings.embed_documents([str(e[self.input_key]) for e in examples]), dtype=np.float32)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for stale in glob.glob(f"{prefix}*.npy"):
+                os.remove(stale)
+            np.save(cache_path, vectors)
+            logger.info(f"Embedded {len(examples)} few-shot examples from '{self.examples_path}' into {cache_path}.")
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        if self._added:
+            examples = examples + self._added
+            vectors = np.vstack([vectors, *(v[None, :] for v in self._added_vectors)])
+        self._example_tokens = [estimate_tokens(self.format_example(e)) for e in examples]
+        self.examples, self._vectors, self._mtime = examples, vectors, mtime
+
+    def select_examples(self, input_variables: Dict[str, str]) -> Optional[List[Dict[str, Any]]]:
+        query = input_variables.get(self.input_key) or ""
+        try:
+            with self._lock:
+                self._load()
+                examples, vectors, example_tokens = self.examples, self._vectors, self._example_tokens
+            query_vector = np.asarray(self._embeddings_factory().embed_query(query), dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"Few-shot example selection for '{self.name}' unavailable ({type(e).__name__}: {e}).")
+            _selections.inc(prompt=self.name, outcome="error")
+            return None
+        scores = vectors @ (query_vector / max(float(np.linalg.norm(query_vector)), 1e-12))
+        selected, used_tokens = [], 0
+        for index in np.argsort(-scores)[:self.k]:
+            tokens = example_tokens[index]
+            if selected and used_tokens + tokens > self.max_tokens:
+                break
+            selected.append(examples[index])
+            used_tokens += tokens
+        all_tokens = sum(example_tokens)
+        _selections.inc(prompt=self.name, outcome="selected")
+        _tokens_saved.inc(all_tokens - used_tokens, prompt=self.name)
+        logger.info(f"Selected {len(selected)}/{len(examples)} few-shot examples for '{self.name}' "
+                    f"(~{used_tokens} of {all_tokens} example tokens).")
+        return selected
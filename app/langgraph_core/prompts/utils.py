@@ -1,4 +1,5 @@
 # app/langgraph_core/prompts/utils.py
+import hashlib
 import os
 import json
 from typing import Optional, List, Dict, Any
@@ -12,6 +13,10 @@ from langchain_core.prompts import (
     PromptTemplate  # 确保导入 PromptTemplate
 )
 from langchain_core.example_selectors import LengthBasedExampleSelector  # 确保导入路径正确
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+
+# 提示词文件中 "输入数据" 一节之前的内容与请求无关，之后的内容每次调用都不同
+INPUT_SECTION_MARKER = "\n---\n**输入数据:**"
 
 
 def _load_file_content(file_path: str) -> str:
@@ -34,6 +39,14 @@ def get_examples_path(agent_name: str, examples_name: str) -> str:
     return os.path.join(current_dir, agent_name, f"{examples_name}.json")
 
 
+def prompt_version(agent_name: str, *prompt_types: str) -> str:
+    """提示词文件内容的哈希，文件被修改后版本随之变化 (用于缓存键)"""
+    digest = hashlib.sha256()
+    for prompt_type in prompt_types:
+        digest.update(_load_file_content(get_prompt_path(agent_name, prompt_type)).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
 def load_chat_prompt_template(agent_name: str, human_template_name: str, system_template_name: str = "system_prompt",
                               examples_name: Optional[str] = None) -> ChatPromptTemplate:
     """
@@ -93,3 +106,36 @@ def load_prompt_template(relative_path: str) -> PromptTemplate:
 
     return PromptTemplate.from_template(template_content)
 
+
+
+class LayeredPrompt:
+    """
+    按 "稳定前缀 + 可变数据" 组织的提示词，便于命中服务商的前缀缓存 (prompt caching)。
+
+    前缀 (角色、指令、工人/工具说明、few-shot 示例) 在创建时格式化一次，之后每次调用
+    都作为同一个字符串发送，保证逐字节一致；每次请求不同的数据只出现在后面的消息中。
+    """
+
+    def __init__(self, prefix: str, variable_template: str):
+        self.prefix = prefix
+        self.variable_template = PromptTemplate.from_template(variable_template)
+
+    def to_messages(self, **variables: Any) -> List[BaseMessage]:
+        return [SystemMessage(content=self.prefix), HumanMessage(content=self.variable_template.format(**variables))]
+
+    def format(self, **variables: Any) -> str:
+        """拼接为单个字符串 (用于日志或只接受文本的场景)，前缀部分与 to_messages 相同"""
+        return self.prefix + "\n\n" + self.variable_template.format(**variables)
+
+
+def load_layered_prompt(relative_path: str, **static_variables: Any) -> LayeredPrompt:
+    """
+    加载提示词文件并在 "输入数据" 一节处拆分：之前的部分用 static_variables (例如可用工人列表) 格式化为固定前缀，
+    之后的部分保留为每次调用时填充的模板。
+    """
+    template_content = _load_file_content(os.path.join(os.path.dirname(__file__), relative_path))
+    position = template_content.find(INPUT_SECTION_MARKER)
+    if position < 0:
+        raise ValueError(f"Prompt file '{relative_path}' has no input data section ('{INPUT_SECTION_MARKER.strip()}').")
+    prefix = PromptTemplate.from_template(template_content[:position]).format(**static_variables)
+    return LayeredPrompt(prefix.rstrip(), template_content[position:].lstrip("\n-").lstrip())
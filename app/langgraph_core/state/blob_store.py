@@ -0,0 +1,99 @@
+# app/langgraph_core/state/blob_store.py
+
+import functools
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from typing import Any, Optional
+
+from app.core.metrics import metrics_registry
+
+logger = logging.getLogger(__name__)
+
+# --- 配置 ---
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", os.path.join("data", "blobs"))
+# 超过该长度 (字符) 的工人结果写入 blob 存储，状态中只保留引用和预览；设为 0 关闭
+BLOB_INLINE_MAX_CHARS = int(os.getenv("BLOB_INLINE_MAX_CHARS", "4000"))
+BLOB_PREVIEW_CHARS = int(os.getenv("BLOB_PREVIEW_CHARS", "400"))
+
+_writes = metrics_registry.counter("blob_store_writes_total", "Worker results offloaded to the blob store, by outcome (new/existing)")
+_offloaded_chars = metrics_registry.counter("blob_store_offloaded_chars_total", "Characters of worker results kept out of graph state")
+_loads = metrics_registry.counter("blob_store_loads_total", "Blob reference resolutions, by outcome")
+
+# 引用的格式：首行是 [[blob:<sha256>:<原文长度>]]，之后是原文的开头部分作为预览。
+# 引用本身仍是普通字符串，状态、事件和计划的结构都不需要改变
+_REF_PATTERN = re.compile(r"^\[\[blob:([0-9a-f]{64}):(\d+)\]\]\n")
+
+
+def _blob_path(digest: str) -> str:
+    return os.path.join(BLOB_STORE_DIR, digest[:2], digest)
+
+
+def is_blob_ref(text: Optional[str]) -> bool:
+    return bool(text) and _REF_PATTERN.match(text) is not None
+
+
+def offload_result(text: Optional[str]) -> Optional[str]:
+    """结果较长时写入内容寻址的 blob 存储 (相同内容只存一份)，返回引用；否则原样返回"""
+    if not text or BLOB_INLINE_MAX_CHARS <= 0 or len(text) <= BLOB_INLINE_MAX_CHARS or is_blob_ref(text):
+        return text
+    data = text.encode("utf-8")
+    digest = hashlib.sha256(data).hexdigest()
+    path = _blob_path(digest)
+    try:
+        if os.path.exists(path):
+            _writes.inc(outcome="existing")
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再改名，并发写入同一内容时也不会读到半个文件
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            _writes.inc(outcome="new")
+    except OSError as e:
+        logger.error(f"Failed to write result blob {digest[:12]}: {e}. Keeping the result inline.")
+        return text
+    _offloaded_chars.inc(len(text) - BLOB_PREVIEW_CHARS)
+    preview = text[:BLOB_PREVIEW_CHARS].rstrip()
+    return f"[[blob:{digest}:{len(text)}]]\n{preview}\n…(共 {len(text)} 字，完整内容见 blob 存储)"
+
+
+@functools.lru_cache(maxsize=64)
+def _load_blob(digest: str) -> Optional[str]:
+    try:
+        with open(_blob_path(digest), "rb") as f:
+            return f.read().decode("utf-8")
+    except OSError as e:
+        logger.error(f"Result blob {digest[:12]} could not be loaded: {e}")
+        return None
+
+
+def resolve_result(text: Optional[str]) -> Optional[str]:
+    """需要完整结果的地方 (评估、校验、最终总结、记忆) 调用：引用按需加载为原文，其他内容原样返回"""
+    match = _REF_PATTERN.match(text) if text else None
+    if match is None:
+        return text
+    full_text = _load_blob(match.group(1))
+    if full_text is None:
+        # blob 丢失时退化为预览，不中断流程
+        _loads.inc(outcome="missing")
+        return text[match.end():]
+    _loads.inc(outcome="loaded")
+    return full_text
+
+
+def state_size_bytes(value: Any) -> int:
+    """粗略估计状态的大小 (字符串按 UTF-8 字节数，消息按内容)，用于按步骤统计状态体积"""
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, dict):
+        return sum(len(str(k)) + state_size_bytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(state_size_bytes(v) for v in value)
+    content = getattr(value, "content", None)
+    if content is not None:
+        return state_size_bytes(content)
+    return 8
@@ -4,6 +4,8 @@ import operator
 from typing import Annotated, List, TypedDict, Optional, Dict, Any
 from langchain_core.messages import BaseMessage
 
+from app.llms.usage import merge_usage
+
 class SubTask(TypedDict):
     task_id: str
     task_name: str
@@ -13,6 +15,8 @@ class SubTask(TypedDict):
     dependencies: List[str]
     status: Optional[str] # "pending", "in_progress", "completed", "failed"
     result: Optional[str] # 任务结果
+    cached: Optional[bool] # 结果是否直接取自跨会话的结果缓存 (未重新执行)
+    duration_s: Optional[float] # 最后一次执行的实际耗时 (秒)，用于与预计耗时对比
 
 class Plan(TypedDict):
     steps: List[SubTask] # 计划现在包含子任务列表
@@ -25,8 +29,29 @@ class AgentState(TypedDict):
     current_agent_role: Optional[str] # 当前活跃的代理角色 (e.g., "supervisor", "planner", "other_worker")
     last_agent_role: Optional[str] # 上一个执行的代理角色，用于路由判断
     last_worker_result: Optional[str] # Other Worker 返回的结果
+    last_result_cache_key: Optional[str] # 可缓存的工人结果对应的缓存键，结果被接受后写入缓存
+    last_result_cached: Optional[bool] # last_worker_result 是否来自结果缓存
+    last_task_completed: Optional[bool] # 工人最后一次执行是否正常完成 (超时、出错时为 False)
+    last_task_duration_s: Optional[float] # 工人最后一次执行子任务的耗时
+    # 各任务的预计耗时及其来源，以及计划的预计总耗时 (见 memory/duration_store.py)
+    task_schedule: Optional[Dict[str, Any]]
+    plan_candidates: Optional[List[Plan]] # 并行生成的候选计划 (按结构启发式排序)，由 Supervisor 选出一份后清空
     plan_revision_count: int  # 计划被修改的次数
     task_revision_count: int  # 单个子任务被修改的次数
+    # 会话预算：deadline 为 time.time() 时间戳，tokens_used 由各节点以增量形式累加
+    deadline: Optional[float]
+    time_budget_s: Optional[float]
+    token_budget: Optional[int]
+    tokens_used: Annotated[int, operator.add]
+    # 会话累计用量 (token、缓存命中、LLM 耗时、费用，按节点和模型分组)，各节点以增量形式合并
+    usage: Annotated[Dict[str, Any], merge_usage]
+    # 多轮会话：之前各轮的请求 (按时间顺序)、当前轮次，以及本轮对计划做增量修改的统计
+    session_id: Optional[str]
+    # 会话所属的租户 (请求的 tenant)，跨会话共享的数据 (例如结果缓存) 按它隔离
+    tenant: Optional[str]
+    turn: int
+    previous_requests: Optional[List[str]]
+    amendment_stats: Optional[Dict[str, int]]
     # tool_calls 和 tool_output 暂时保留，以防未来需要
     tool_calls: Optional[List[dict]]
     tool_output: Optional[str]
@@ -0,0 +1,314 @@
+# app/langgraph_core/state/plan_index.py
+
+import bisect
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.langgraph_core.state.graph_state import Plan, SubTask
+
+# 这些状态都视为 "尚未开始"
+PENDING_STATUSES = (None, "pending")
+COMPLETED_STATUS = "completed"
+
+
+def _status_key(status: Optional[str]) -> str:
+    return "pending" if status in PENDING_STATUSES else status
+
+
+class IndexedPlan(dict):
+    """
+    带索引的不可变计划。
+
+    它本身就是一个 {"steps": [...]} 字典，因此可以直接放进 AgentState、json.dumps
+    或作为 StreamEvent 的数据，序列化结果与 Plan/SubTask TypedDict 完全一致。
+    在此之上维护:
+    - task_id -> 下标 的映射，按 ID 查找子任务为 O(1)；
+    - 各状态的任务计数；
+    - "就绪队列"：依赖全部完成的待执行任务的有序下标列表，取下一个任务为 O(1)。
+
+    约定不要原地修改 steps 或其中的子任务。所有更新都通过 with_task_update()
+    返回一个新的 IndexedPlan (写时复制)：未改动的子任务字典和静态索引在新旧版本之间共享，
+    LangGraph 合并状态时不需要深拷贝整个计划。
+    """
+
+    __slots__ = ("_index", "_dependents", "_dependencies", "_status_counts", "_ready", "_renamed")
+
+    def __init__(self, steps: Iterable[SubTask] = ()):
+        steps = list(steps)
+        # 缺失或重复的 task_id 会让按 ID 查找变得不确定，这里为它们生成唯一 ID，
+        # 并记录下来，让 plan_structure_problems 仍然能把它报告为结构问题
+        seen = set()
+        renamed: List[str] = []
+        for i, task in enumerate(steps):
+            task_id = task.get("task_id")
+            if not task_id or task_id in seen:
+                renamed.append(task_id or "")
+                task_id = f"{task_id or 'task'}#{i + 1}"
+                steps[i] = {**task, "task_id": task_id}
+            seen.add(task_id)
+        self._renamed: Tuple[str, ...] = tuple(renamed)
+        super().__init__(steps=steps)
+        self._index: Dict[str, int] = {task.get("task_id"): i for i, task in enumerate(steps)}
+
+        # 依赖关系是静态的，只在构建时计算一次，之后所有版本共享
+        dependencies: List[Tuple[int, ...]] = []
+        dependents: Dict[int, List[int]] = {}
+        for i, task in enumerate(steps):
+            deps = tuple(self._index[d] for d in (task.get("dependencies") or []) if d in self._index and self._index[d] != i)
+            dependencies.append(deps)
+            for d in deps:
+                dependents.setdefault(d, []).append(i)
+        self._dependencies = dependencies
+        self._dependents = {k: tuple(v) for k, v in dependents.items()}
+
+        self._status_counts: Dict[str, int] = {}
+        self._ready: List[int] = []
+        for i, task in enumerate(steps):
+            status = _status_key(task.get("status"))
+            self._status_counts[status] = self._status_counts.get(status, 0) + 1
+            if status == "pending" and self._deps_completed(i):
+                self._ready.append(i)
+
+    @classmethod
+    def from_plan(cls, plan: Optional[Plan]) -> Optional["IndexedPlan"]:
+        """把普通的 Plan 字典转换为 IndexedPlan；已经是 IndexedPlan 时原样返回"""
+        if plan is None or isinstance(plan, IndexedPlan):
+            return plan
+        return cls(plan.get("steps", []) if isinstance(plan, dict) else [])
+
+    # --- 只读查询 ---
+
+    @property
+    def steps(self) -> List[SubTask]:
+        return self["steps"]
+
+    @property
+    def renamed_task_ids(self) -> Tuple[str, ...]:
+        """构建索引时因为重复或缺失而被改名的原始 task_id (缺失的为空字符串)"""
+        return self._renamed
+
+    def index_of(self, task_id: Optional[str]) -> Optional[int]:
+        return self._index.get(task_id)
+
+    def get_task(self, task_id: Optional[str]) -> Optional[SubTask]:
+        index = self._index.get(task_id)
+        return self["steps"][index] if index is not None else None
+
+    def tasks_with_status(self, status: Optional[str]) -> List[SubTask]:
+        key = _status_key(status)
+        return [task for task in self["steps"] if _status_key(task.get("status")) == key]
+
+    def count(self, status: Optional[str]) -> int:
+        return self._status_counts.get(_status_key(status), 0)
+
+    def ready_tasks(self) -> List[SubTask]:
+        """所有依赖都已完成的待执行任务，按计划顺序排列"""
+        steps = self["steps"]
+        return [steps[i] for i in self._ready]
+
+    def next_ready_task(self) -> Optional[SubTask]:
+        """
+        返回下一个可执行的任务。
+        如果还有待执行任务但都被未完成的依赖阻塞 (例如依赖失败或循环依赖)，
+        退回到计划顺序中的第一个待执行任务，保证流程能继续推进。
+        """
+        if self._ready:
+            return self["steps"][self._ready[0]]
+        if self._status_counts.get("pending"):
+            return self.tasks_with_status("pending")[0]
+        return None
+
+    def to_plan(self) -> Plan:
+        """导出为普通的 Plan 字典 (子任务也是新的普通字典)"""
+        return {"steps": [dict(task) for task in self["steps"]]}
+
+    # --- 写时复制更新 ---
+
+    def _derive(self, steps: List[SubTask]) -> "IndexedPlan":
+        clone = IndexedPlan.__new__(IndexedPlan)
+        dict.__init__(clone, steps=steps)
+        clone._index = self._index
+        clone._dependencies = self._dependencies
+        clone._dependents = self._dependents
+        clone._status_counts = self._status_counts
+        clone._ready = self._ready
+        clone._renamed = self._renamed
+        return clone
+
+    def with_task_update(self, task_id: str, **changes: Any) -> "IndexedPlan":
+        """返回一个新计划，其中 task_id 对应的子任务应用了 changes，原计划保持不变"""
+        index = self._index.get(task_id)
+        if index is None:
+            raise KeyError(f"Subtask '{task_id}' not found in plan.")
+        old_task = self["steps"][index]
+        new_task = {**old_task, **changes}
+        steps = list(self["steps"])
+        steps[index] = new_task
+        clone = self._derive(steps)
+
+        old_status = _status_key(old_task.get("status"))
+        new_status = _status_key(new_task.get("status"))
+        if old_status != new_status:
+            counts = dict(self._status_counts)
+            counts[old_status] -= 1
+            counts[new_status] = counts.get(new_status, 0) + 1
+            clone._status_counts = counts
+            clone._update_readiness(index, old_status, new_status)
+        return clone
+
+    def _deps_completed(self, index: int) -> bool:
+        steps = self["steps"]
+        return all(steps[d].get("status") == COMPLETED_STATUS for d in self._dependencies[index])
+
+    def _update_readiness(self, index: int, old_status: str, new_status: str) -> None:
+        """只调整受影响的任务 (自身及其直接后继) 在就绪队列中的位置，代价与依赖度成正比"""
+        steps = self["steps"]
+        ready = list(self._ready)
+
+        if old_status == "pending":
+            position = bisect.bisect_left(ready, index)
+            if position < len(ready) and ready[position] == index:
+                del ready[position]
+        elif new_status == "pending" and self._deps_completed(index):
+            # 任务被重置为待执行 (例如多轮对话中需要重跑)
+            bisect.insort(ready, index)
+
+        if COMPLETED_STATUS in (old_status, new_status):
+            for dependent in self._dependents.get(index, ()):
+                if _status_key(steps[dependent].get("status")) != "pending":
+                    continue
+                position = bisect.bisect_left(ready, dependent)
+                is_ready = position < len(ready) and ready[position] == dependent
+                if new_status == COMPLETED_STATUS and not is_ready and self._deps_completed(dependent):
+                    ready.insert(position, dependent)
+                elif old_status == COMPLETED_STATUS and is_ready:
+                    # 依赖从完成退回到其他状态，后继任务重新被阻塞
+                    del ready[position]
+        self._ready = ready
+
+
+def amend_plan(plan: Optional[Plan], rerun_task_ids: Iterable[str],
+               new_steps: Iterable[SubTask]) -> Tuple[IndexedPlan, Dict[str, int]]:
+    """
+    多轮对话中增量修改上一轮的计划，返回 (新计划, 统计)。
+    - rerun_task_ids 中的任务及其所有 (传递) 后继任务重置为待执行；
+    - 上一轮没有完成的任务 (跳过、失败等) 也重置为待执行；
+    - 其余已完成任务保留结果，不再执行；
+    - new_steps 追加到计划末尾，与已有任务冲突的 task_id 会被重新编号 (新任务之间的依赖随之更新)。
+    统计中 skipped 为复用结果的任务数，re_executed 为需要重新执行的已有任务数，added 为新增任务数。
+    """
+    base = IndexedPlan.from_plan(plan) or IndexedPlan()
+    steps = base.steps
+
+    to_reset = set()
+    stack = [base.index_of(task_id) for task_id in rerun_task_ids]
+    while stack:
+        index = stack.pop()
+        if index is None or index in to_reset:
+            continue
+        to_reset.add(index)
+        stack.extend(base._dependents.get(index, ()))
+    to_reset.update(i for i, task in enumerate(steps) if task.get("status") != COMPLETED_STATUS)
+
+    amended: List[SubTask] = [
+        {**task, "status": "pending", "result": None, "duration_s": None} if i in to_reset else task
+        for i, task in enumerate(steps)
+    ]
+
+    used_ids = {task["task_id"] for task in steps}
+    renamed: Dict[str, str] = {}
+    added: List[SubTask] = []
+    next_number = len(steps) + 1
+    for task in new_steps:
+        task_id = task.get("task_id") or ""
+        if not task_id or task_id in used_ids:
+            while str(next_number) in used_ids:
+                next_number += 1
+            renamed[task_id] = str(next_number)
+            task_id = str(next_number)
+        used_ids.add(task_id)
+        added.append({**task, "task_id": task_id, "status": "pending", "result": None})
+    if renamed:
+        # 新任务之间的依赖引用的是模型给出的原始 ID，这里随重新编号一起替换
+        new_ids = {task.get("task_id") for task in new_steps}
+        for i, task in enumerate(added):
+            dependencies = [renamed.get(d, d) if d in new_ids else d for d in (task.get("dependencies") or [])]
+            added[i] = {**task, "dependencies": dependencies}
+
+    stats = {"skipped": len(steps) - len(to_reset), "re_executed": len(to_reset), "added": len(added)}
+    return IndexedPlan(amended + added), stats
+
+
+def find_task(plan: Optional[Plan], task_id: Optional[str]) -> Optional[SubTask]:
+    """在计划 (普通字典或 IndexedPlan) 中按 ID 查找子任务"""
+    if not plan or not task_id:
+        return None
+    return IndexedPlan.from_plan(plan).get_task(task_id)
+
+
+def plan_structure_problems(plan: Optional[Plan], known_workers: Iterable[str]) -> List[str]:
+    """
+    不调用 LLM 的结构检查：空计划、重复或缺失的 task_id、空描述、未知工人、
+    引用不存在任务的依赖以及循环依赖。返回问题列表 (空列表表示结构合法)。
+    """
+    steps = (plan or {}).get("steps") or []
+    if not steps:
+        return ["计划中没有任何步骤"]
+    known_workers = set(known_workers)
+    problems = []
+    ids = [task.get("task_id") for task in steps]
+    if len(set(ids)) != len(ids) or not all(ids) or (isinstance(plan, IndexedPlan) and plan.renamed_task_ids):
+        problems.append("存在重复或缺失的 task_id")
+    id_set = set(ids)
+    for task in steps:
+        label = task.get("task_id") or "?"
+        if not (task.get("description") or "").strip():
+            problems.append(f"任务 {label} 没有描述")
+        if task.get("worker") not in known_workers:
+            problems.append(f"任务 {label} 指定了未知的工人 '{task.get('worker')}'")
+        unknown = [d for d in task.get("dependencies") or [] if d not in id_set]
+        if unknown:
+            problems.append(f"任务 {label} 依赖了不存在的任务 {unknown}")
+    if critical_path_length(plan) is None:
+        problems.append("存在循环依赖")
+    return problems
+
+
+def critical_path_length(plan: Optional[Plan]) -> Optional[int]:
+    """最长依赖链上的任务数 (串行执行时的最少轮数)；存在循环依赖时返回 None"""
+    steps = (plan or {}).get("steps") or []
+    ids = {task.get("task_id") for task in steps}
+    dependencies = {task.get("task_id"): [d for d in task.get("dependencies") or [] if d in ids] for task in steps}
+    dependents: Dict[str, List[str]] = {}
+    remaining = {}
+    for task_id, deps in dependencies.items():
+        remaining[task_id] = len(deps)
+        for dep in deps:
+            dependents.setdefault(dep, []).append(task_id)
+    # 拓扑排序 (Kahn)，同时计算每个任务所在依赖链的长度
+    depth = {task_id: 1 for task_id, count in remaining.items() if count == 0}
+    queue = list(depth)
+    for task_id in queue:
+        for child in dependents.get(task_id, ()):
+            depth[child] = max(depth.get(child, 0), depth[task_id] + 1)
+            remaining[child] -= 1
+            if remaining[child] == 0:
+                queue.append(child)
+    if len(queue) < len(dependencies):
+        return None
+    return max(depth.values(), default=0)
+
+
+def rank_plan_candidates(plans: Iterable[Plan], known_workers: Iterable[str]) -> List[Tuple[Plan, List[str]]]:
+    """
+    按结构启发式给候选计划排序，返回 [(计划, 问题列表)]：
+    结构问题少的在前；同样合法时关键路径短的在前 (可并行的计划完成得更快)，再按步骤数少的在前。
+    """
+    known_workers = set(known_workers)
+    scored = []
+    for order, plan in enumerate(plans):
+        problems = plan_structure_problems(plan, known_workers)
+        depth = critical_path_length(plan)
+        scored.append(((len(problems), depth if depth is not None else float("inf"), len(plan.get("steps") or []), order),
+                       plan, problems))
+    scored.sort(key=lambda item: item[0])
+    return [(plan, problems) for _, plan, problems in scored]
@@ -1,7 +1,16 @@
 # app/langgraph_core/tools/common_tools.py
 
+import os
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+
+from app.langgraph_core.tools.file_reader import DEFAULT_MAX_BYTES, get_mapped_file
+from app.langgraph_core.tools.python_repl import get_interpreter_pool
+
+# read_file 只允许读取此目录下的文件 (相对路径按该目录解析)。路径由模型给出，
+# 不能默认开放服务进程可读的所有文件 (.env、~/.ssh 等)
+READ_FILE_ROOT = os.getenv("READ_FILE_ROOT", os.path.join("data", "files"))
 
 
 @tool
@@ -41,4 +50,74 @@ def get_current_weather(location: str, unit: str = "celsius") -> Dict[str, Any]:
         return {"error": f"Weather data for {location} not available."}
 
 
-all_tools = [calculator, get_current_weather]
+def _resolve_readable_path(path: str) -> str:
+    """校验路径是否存在且位于允许的根目录下 (解析符号链接之后)"""
+    root = os.path.realpath(READ_FILE_ROOT)
+    real_path = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, real_path]) != root:
+        raise PermissionError(f"'{path}' is outside of the readable root '{root}'.")
+    if not os.path.isfile(real_path):
+        raise FileNotFoundError(f"File not found: {path}")
+    return real_path
+
+
+@tool("read_file")
+def read_file_tool(path: str, start_line: Optional[int] = None, end_line: Optional[int] = None,
+                   start_byte: Optional[int] = None, end_byte: Optional[int] = None,
+                   max_bytes: int = DEFAULT_MAX_BYTES) -> str:
+    """
+    Reads part of a (possibly very large) text file without loading the whole file.
+    Paths are relative to the readable files directory; files outside it cannot be read.
+    Use start_line/end_line (0-based, end exclusive) to read a range of lines,
+    or start_byte/end_byte to read a byte range. With no range, reads from the beginning.
+    At most max_bytes bytes are returned; the output notes when it was truncated
+    and where to continue reading.
+    """
+    try:
+        mapped = get_mapped_file(_resolve_readable_path(path))
+        max_bytes = max(1, min(max_bytes, DEFAULT_MAX_BYTES))
+
+        if start_line is not None or end_line is not None:
+            first_line = start_line or 0
+            start, end = mapped.line_span(first_line, end_line)
+            location = f"lines {first_line}-{end_line if end_line is not None else first_line + 1}"
+        else:
+            start = start_byte or 0
+            end = mapped.size if end_byte is None else min(end_byte, mapped.size)
+            location = f"bytes {start}-{end}"
+
+        content = b"".join(mapped.iter_chunks(start, end, max_bytes=max_bytes))
+        text = content.decode("utf-8", errors="replace")
+        header = f"[{path}: {location} of {mapped.size} bytes]\n"
+        if start + len(content) < end:
+            next_byte = start + len(content)
+            return header + text + f"\n[truncated at {max_bytes} bytes; continue with start_byte={next_byte}]"
+        return header + text
+    except Exception as e:
+        return f"Error reading file: {e}"
+
+
+@tool("python_repl")
+def python_repl_tool(code: str, config: RunnableConfig) -> str:
+    """
+    Executes Python code in an isolated interpreter process and returns its output.
+    The value of the last expression is echoed like in an interactive shell.
+    numpy (np) and pandas (pd) are pre-imported when available.
+    Variables persist between calls made within the same session.
+    """
+    session_id = (config or {}).get("configurable", {}).get("session_id")
+    result = get_interpreter_pool().execute(code, session_id=session_id)
+
+    parts = []
+    if result.get("stdout"):
+        parts.append(result["stdout"].rstrip())
+    if result.get("value") is not None:
+        parts.append(result["value"])
+    if not result.get("ok"):
+        parts.append(f"Error: {result.get('error')}")
+    if result.get("notice"):
+        parts.append(f"[{result['notice']}]")
+    return "\n".join(parts) if parts else "(no output)"
+
+
+all_tools = [calculator, get_current_weather, read_file_tool, python_repl_tool]
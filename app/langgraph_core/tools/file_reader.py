@@ -0,0 +1,176 @@
+# app/langgraph_core/tools/file_reader.py
+
+import mmap
+import os
+import threading
+import logging
+from array import array
+from collections import OrderedDict
+from typing import Iterator, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # numpy 不是硬依赖，缺失时退回到 mmap.find 逐行扫描
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# 单次返回给 LLM 的最大字节数，避免把整个文件塞进 prompt
+DEFAULT_MAX_BYTES = int(os.getenv("READ_FILE_MAX_BYTES", 64 * 1024))
+# 流式读取时每块的大小
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+# 构建行索引时每次扫描的窗口大小
+_INDEX_SCAN_WINDOW = 16 * 1024 * 1024
+# 最多同时保持映射的文件数量
+_MAX_OPEN_FILES = 16
+
+
+class MappedFile:
+    """
+    对单个文件的只读内存映射，支持按字节区间和按行区间读取。
+    行索引 (每一行起始字节偏移) 按需增量构建并缓存，
+    第一次扫描到第 N 行之后，再定位到任意 <= N 的行都是 O(1)。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        stat = os.stat(path)
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        # 空文件无法被 mmap，直接用空 bytes 代替；mmap 持有自己复制的文件描述符，映射建立后即可关闭文件
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+        self._line_starts = array("q", [0])  # 第 i 行 (0-based) 的起始偏移
+        self._scanned_to = 0  # 行索引已经扫描到的字节位置
+        self._index_lock = threading.Lock()
+
+    def is_stale(self) -> bool:
+        """文件在映射之后被修改过则返回 True"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return True
+        return stat.st_size != self.size or stat.st_mtime_ns != self.mtime_ns
+
+    def close(self) -> None:
+        """立即解除映射。只能由独占这个对象的调用方使用，全局缓存不会调用它"""
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+
+    # --- 行索引 ---
+
+    @property
+    def index_complete(self) -> bool:
+        return self._scanned_to >= self.size
+
+    def _scan_window(self, start: int, end: int) -> None:
+        """扫描 [start, end) 中的换行符，把下一行的起始偏移追加到索引"""
+        if np is not None:
+            window = np.frombuffer(self._mm, dtype=np.uint8, count=end - start, offset=start)
+            newlines = np.flatnonzero(window == 0x0A)
+            if newlines.size:
+                self._line_starts.frombytes((newlines.astype(np.int64) + (start + 1)).tobytes())
+            return
+        find = self._mm.find
+        pos = find(b"\n", start, end)
+        while pos != -1:
+            self._line_starts.append(pos + 1)
+            pos = find(b"\n", pos + 1, end)
+
+    def _ensure_lines(self, line_count: int) -> None:
+        """保证索引至少覆盖 line_count 行 (或已经扫描到文件末尾)"""
+        if len(self._line_starts) > line_count or self.index_complete:
+            return
+        with self._index_lock:
+            while len(self._line_starts) <= line_count and not self.index_complete:
+                end = min(self._scanned_to + _INDEX_SCAN_WINDOW, self.size)
+                self._scan_window(self._scanned_to, end)
+                self._scanned_to = end
+            if self.index_complete and self._line_starts[-1] == self.size and self.size:
+                # 文件以换行结尾时，最后一个 "行起点" 实际上是 EOF，不算作一行
+                self._line_starts.pop()
+
+    def line_count(self) -> int:
+        """返回文件总行数 (会触发完整的索引扫描)"""
+        self._ensure_lines(self.size + 1)
+        return len(self._line_starts) if self.size else 0
+
+    def line_span(self, start_line: int, end_line: Optional[int] = None) -> Tuple[int, int]:
+        """
+        把 [start_line, end_line) 的行区间 (0-based) 转换成字节区间。
+        end_line 为 None 时只取 start_line 这一行。
+        """
+        if start_line < 0:
+            raise ValueError("start_line must be >= 0")
+        if end_line is None:
+            end_line = start_line + 1
+        if end_line < start_line:
+            raise ValueError("end_line must be >= start_line")
+        self._ensure_lines(end_line)
+        starts = self._line_starts
+        if start_line >= len(starts):
+            return self.size, self.size
+        start = starts[start_line]
+        end = starts[end_line] if end_line < len(starts) else self.size
+        return start, end
+
+    # --- 读取 ---
+
+    def read_bytes(self, start: int = 0, end: Optional[int] = None) -> bytes:
+        """按字节区间 [start, end) 读取，越界部分会被截断"""
+        end = self.size if end is None else min(end, self.size)
+        start = max(0, min(start, end))
+        return self._mm[start:end]
+
+    def read_lines(self, start_line: int, end_line: Optional[int] = None) -> bytes:
+        start, end = self.line_span(start_line, end_line)
+        return self._mm[start:end]
+
+    def iter_chunks(self, start: int = 0, end: Optional[int] = None,
+                    chunk_size: int = DEFAULT_CHUNK_SIZE,
+                    max_bytes: Optional[int] = None) -> Iterator[bytes]:
+        """
+        流式地按块读取 [start, end)，总量不超过 max_bytes。
+        每一块都是 mmap 的切片，调用方不需要一次性持有整个文件。
+        """
+        end = self.size if end is None else min(end, self.size)
+        if max_bytes is not None:
+            end = min(end, start + max_bytes)
+        pos = max(0, start)
+        while pos < end:
+            next_pos = min(pos + chunk_size, end)
+            yield self._mm[pos:next_pos]
+            pos = next_pos
+
+
+# --- 全局缓存：同一个文件在多次工具调用之间复用映射和行索引 ---
+# 被淘汰或过期的映射只从缓存中移除，不调用 close()：其他线程可能仍在读取它
+# (例如 _scan_window 中的 numpy 视图会让 mmap.close() 抛出 BufferError)。
+# 最后一个引用释放时映射随之关闭。
+_open_files: "OrderedDict[str, MappedFile]" = OrderedDict()
+_open_files_lock = threading.Lock()
+
+
+def get_mapped_file(path: str) -> MappedFile:
+    """返回 path 对应的 MappedFile，文件被修改过时会重新映射"""
+    real_path = os.path.realpath(path)
+    with _open_files_lock:
+        mapped = _open_files.get(real_path)
+        if mapped is not None and not mapped.is_stale():
+            _open_files.move_to_end(real_path)
+            return mapped
+        if mapped is not None:
+            logger.info(f"File '{real_path}' changed on disk. Re-mapping and dropping its line index.")
+            del _open_files[real_path]
+
+        mapped = MappedFile(real_path)
+        _open_files[real_path] = mapped
+        while len(_open_files) > _MAX_OPEN_FILES:
+            _open_files.popitem(last=False)
+        return mapped
+
+
+def clear_mapped_files() -> None:
+    """清空所有缓存的映射；仍在使用的映射在读取结束后关闭"""
+    with _open_files_lock:
+        _open_files.clear()
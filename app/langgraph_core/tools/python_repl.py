@@ -0,0 +1,341 @@
+# app/langgraph_core/tools/python_repl.py
+
+import atexit
+import json
+import logging
+import os
+import select
+import shutil
+import signal
+import struct
+import subprocess
+import sys
+import sysconfig
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from app.core.metrics import metrics_registry
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct(">I")
+_WORKER_SCRIPT = os.path.join(os.path.dirname(__file__), "repl_worker.py")
+
+# --- 池配置 (均可通过环境变量覆盖) ---
+POOL_SIZE = int(os.getenv("REPL_POOL_SIZE", "2"))  # 保持预热的空闲解释器数量
+MAX_EXECUTIONS = int(os.getenv("REPL_MAX_EXECUTIONS", "50"))  # 每个解释器执行 N 次后回收
+EXEC_TIMEOUT_S = float(os.getenv("REPL_EXEC_TIMEOUT_S", "30"))  # 单次执行的墙钟超时
+SPAWN_TIMEOUT_S = float(os.getenv("REPL_SPAWN_TIMEOUT_S", "30"))  # 启动并完成预导入的超时
+SESSION_IDLE_TTL_S = float(os.getenv("REPL_SESSION_IDLE_TTL_S", "1800"))  # 会话绑定的解释器闲置多久后释放
+
+# --- 隔离方式 ---
+# 执行的是模型生成的代码，必须假定它是恶意的。
+# bwrap (默认): 在 bubblewrap 创建的命名空间中运行解释器。没有网络；文件系统中只能看到
+#   只读的系统目录和 Python 安装目录，以及自己的临时工作目录。应用目录 (.env 等)、用户主目录
+#   和其他会话的工作目录都不可见。没有安装 bwrap 时拒绝执行。
+# none: 只有进程级的保护 (清理过的环境变量和下面的资源限制)。解释器能读写运行用户可访问的
+#   所有文件，也能访问网络，只能在可信环境中使用；此时应通过 REPL_USER 指定一个无权限的用户。
+REPL_ISOLATION = os.getenv("REPL_ISOLATION", "bwrap").lower()
+# 以该用户 (用户名或 uid) 运行解释器；服务进程需要有切换用户的权限
+REPL_USER = os.getenv("REPL_USER") or None
+if REPL_USER is not None and REPL_USER.isdigit():
+    REPL_USER = int(REPL_USER)
+# 传给子进程的资源限制
+WORKER_ENV = {
+    "REPL_CPU_LIMIT_S": os.getenv("REPL_CPU_LIMIT_S", "10"),
+    "REPL_MEMORY_LIMIT_MB": os.getenv("REPL_MEMORY_LIMIT_MB", "1024"),
+    # RLIMIT_NPROC：预导入完成后生效，0 表示不允许创建子进程或线程 (以 root 运行时内核不检查该限制)
+    "REPL_MAX_PROCESSES": os.getenv("REPL_MAX_PROCESSES", "0"),
+    "REPL_MAX_FILE_MB": os.getenv("REPL_MAX_FILE_MB", "64"),  # RLIMIT_FSIZE：单个文件的大小上限
+    "REPL_MAX_OPEN_FILES": os.getenv("REPL_MAX_OPEN_FILES", "64"),  # RLIMIT_NOFILE
+    "REPL_MAX_OUTPUT_CHARS": os.getenv("REPL_MAX_OUTPUT_CHARS", "20000"),
+    "REPL_PRELOAD": os.getenv("REPL_PRELOAD", "numpy:np,pandas:pd"),
+    # 预导入的库不启动线程池，否则会受 REPL_MAX_PROCESSES 限制
+    "OMP_NUM_THREADS": "1",
+    "OPENBLAS_NUM_THREADS": "1",
+    "MKL_NUM_THREADS": "1",
+}
+# bwrap 中只读挂载的系统目录 (不存在的跳过)
+_SYSTEM_DIRS = ("/usr", "/bin", "/sbin", "/lib", "/lib32", "/lib64", "/etc/ld.so.cache", "/etc/localtime")
+
+# --- 指标 ---
+_checkouts = metrics_registry.counter("python_repl_checkouts_total", "Interpreter checkouts by result (hit/miss/sticky)")
+_recycled = metrics_registry.counter("python_repl_recycled_total", "Interpreters recycled by reason")
+_exec_latency = metrics_registry.histogram("python_repl_exec_seconds", "Wall time of python_repl executions")
+_spawn_latency = metrics_registry.histogram("python_repl_spawn_seconds", "Time to spawn and pre-import an interpreter")
+_idle_gauge = metrics_registry.gauge("python_repl_idle_interpreters", "Pre-warmed interpreters waiting in the pool")
+
+
+class InterpreterError(RuntimeError):
+    """解释器进程崩溃、超时或协议错误"""
+
+
+def _interpreter_command(workdir: str) -> List[str]:
+    """按 REPL_ISOLATION 构造启动解释器的命令"""
+    command = [sys.executable, "-I", _WORKER_SCRIPT]
+    if REPL_ISOLATION == "none":
+        return command
+    if REPL_ISOLATION != "bwrap":
+        raise InterpreterError(f"Unknown REPL_ISOLATION '{REPL_ISOLATION}' (expected 'bwrap' or 'none').")
+    bwrap = shutil.which("bwrap")
+    if bwrap is None:
+        raise InterpreterError("python_repl requires bubblewrap (bwrap) for isolation; install it, "
+                               "or set REPL_ISOLATION=none only in a trusted environment.")
+    # Python 安装目录 (虚拟环境和它的基础解释器)；-I 模式下子进程不会从其他位置导入模块
+    python_dirs = {sys.prefix, sys.base_prefix, sys.exec_prefix, os.path.dirname(os.path.realpath(sys.executable)),
+                   *(sysconfig.get_paths()[key] for key in ("stdlib", "platstdlib", "purelib", "platlib"))}
+    args = [bwrap, "--unshare-all", "--die-with-parent", "--proc", "/proc", "--dev", "/dev", "--tmpfs", "/tmp"]
+    for path in [*_SYSTEM_DIRS, *sorted(python_dirs)]:
+        args += ["--ro-bind-try", path, path]
+    # 工作目录挂载在原路径上，HOME 和 cwd 不需要改写
+    args += ["--ro-bind", _WORKER_SCRIPT, _WORKER_SCRIPT, "--bind", workdir, workdir, "--chdir", workdir]
+    return args + command
+
+
+class Interpreter:
+    """
+    一个隔离的 Python 子进程，通过管道接收代码。隔离方式见 REPL_ISOLATION；
+    资源限制 (内存、CPU、进程数、文件大小和打开文件数) 由 repl_worker 在子进程中设置。
+    """
+
+    def __init__(self):
+        started = time.perf_counter()
+        self.workdir = tempfile.mkdtemp(prefix="python_repl_")
+        env = {"PATH": os.environ.get("PATH", ""), "HOME": self.workdir, "LANG": "C.UTF-8", **WORKER_ENV}
+        try:
+            command = _interpreter_command(self.workdir)
+            if REPL_USER is not None:
+                shutil.chown(self.workdir, user=REPL_USER)
+            # 不继承父进程的环境变量，避免 API Key 等敏感信息泄露给执行的代码
+            self.process = subprocess.Popen(
+                command,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                cwd=self.workdir, env=env, start_new_session=True, user=REPL_USER,
+            )
+        except (InterpreterError, OSError, LookupError) as e:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+            if isinstance(e, InterpreterError):
+                raise
+            raise InterpreterError(f"failed to start interpreter: {e}") from e
+        self.executions = 0
+        self.last_used = time.monotonic()
+        try:
+            hello = self._receive(time.monotonic() + SPAWN_TIMEOUT_S)
+        except InterpreterError:
+            self.kill()
+            raise
+        self.preloaded = hello.get("preloaded", [])
+        _spawn_latency.observe(time.perf_counter() - started)
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def _read_exact(self, size: int, deadline: float) -> bytes:
+        fd = self.process.stdout.fileno()
+        buffer = b""
+        while len(buffer) < size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise InterpreterError("timed out")
+            readable, _, _ = select.select([fd], [], [], remaining)
+            if not readable:
+                continue
+            chunk = os.read(fd, size - len(buffer))
+            if not chunk:
+                raise InterpreterError(f"interpreter exited with code {self.process.poll()}")
+            buffer += chunk
+        return buffer
+
+    def _receive(self, deadline: float) -> Dict[str, Any]:
+        (length,) = _HEADER.unpack(self._read_exact(_HEADER.size, deadline))
+        return json.loads(self._read_exact(length, deadline).decode("utf-8"))
+
+    def _send(self, message: Dict[str, Any]) -> None:
+        payload = json.dumps(message).encode("utf-8")
+        try:
+            self.process.stdin.write(_HEADER.pack(len(payload)) + payload)
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise InterpreterError(f"interpreter pipe closed: {e}") from e
+
+    def execute(self, code: str, timeout: float) -> Dict[str, Any]:
+        self.executions += 1
+        self.last_used = time.monotonic()
+        self._send({"op": "exec", "code": code})
+        return self._receive(time.monotonic() + timeout)
+
+    def kill(self) -> None:
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)  # 连同用户代码启动的子进程一起结束
+        except (ProcessLookupError, PermissionError):
+            pass
+        self.process.wait()
+        for stream in (self.process.stdin, self.process.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class InterpreterPool:
+    """
+    预热的解释器池。
+    - 空闲队列中始终保持 pool_size 个已完成预导入的解释器，后台线程负责补充。
+    - 解释器执行 max_executions 次、崩溃或超时后被回收。
+    - 传入 session_id 时，同一会话固定使用同一个解释器，变量在多个步骤之间保留。
+    """
+
+    def __init__(self, pool_size: int = POOL_SIZE, max_executions: int = MAX_EXECUTIONS):
+        self.pool_size = pool_size
+        self.max_executions = max_executions
+        self._idle: Deque[Interpreter] = deque()
+        self._sessions: Dict[str, Interpreter] = {}
+        self._session_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._refill_needed = threading.Event()
+        self._closed = False
+        self._refiller = threading.Thread(target=self._refill_loop, name="python-repl-refill", daemon=True)
+        self._refiller.start()
+        self._refill_needed.set()
+
+    # --- 池维护 ---
+
+    def _refill_loop(self) -> None:
+        while not self._closed:
+            self._refill_needed.wait(timeout=60)
+            self._refill_needed.clear()
+            self._expire_sessions()
+            while not self._closed and len(self._idle) < self.pool_size:
+                try:
+                    interpreter = Interpreter()
+                except Exception as e:
+                    logger.error(f"Failed to pre-warm python_repl interpreter: {e}")
+                    break
+                with self._lock:
+                    self._idle.append(interpreter)
+                    _idle_gauge.set(len(self._idle))
+
+    def _expire_sessions(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            expired = [sid for sid, it in self._sessions.items() if now - it.last_used > SESSION_IDLE_TTL_S]
+        for session_id in expired:
+            logger.info(f"Releasing idle python_repl interpreter for session '{session_id}'.")
+            self.release_session(session_id)
+
+    def _checkout(self) -> Interpreter:
+        with self._lock:
+            while self._idle:
+                interpreter = self._idle.popleft()
+                if interpreter.alive:
+                    _idle_gauge.set(len(self._idle))
+                    _checkouts.inc(result="hit")
+                    self._refill_needed.set()
+                    return interpreter
+                interpreter.kill()
+        # 没有预热好的解释器，只能同步启动一个
+        _checkouts.inc(result="miss")
+        self._refill_needed.set()
+        return Interpreter()
+
+    def _retire(self, interpreter: Interpreter, reason: str) -> None:
+        _recycled.inc(reason=reason)
+        interpreter.kill()
+        self._refill_needed.set()
+
+    # --- 对外接口 ---
+
+    def execute(self, code: str, session_id: Optional[str] = None, timeout: float = EXEC_TIMEOUT_S) -> Dict[str, Any]:
+        """执行代码并返回 {"ok", "stdout", "value", "error"} 字典"""
+        if session_id is None:
+            try:
+                interpreter = self._checkout()
+            except InterpreterError as e:
+                return {"ok": False, "error": f"Interpreter unavailable: {e}"}
+            try:
+                return self._run(interpreter, code, timeout)
+            finally:
+                # 非会话执行结束后解释器状态已被污染，直接回收而不是放回池中
+                if interpreter.alive:
+                    self._retire(interpreter, "single_use")
+
+        with self._lock:
+            session_lock = self._session_locks.setdefault(session_id, threading.Lock())
+        with session_lock:
+            with self._lock:
+                interpreter = self._sessions.get(session_id)
+            if interpreter is not None and interpreter.alive:
+                _checkouts.inc(result="sticky")
+            else:
+                try:
+                    interpreter = self._checkout()
+                except InterpreterError as e:
+                    return {"ok": False, "error": f"Interpreter unavailable: {e}"}
+                with self._lock:
+                    self._sessions[session_id] = interpreter
+            result = self._run(interpreter, code, timeout)
+            if not interpreter.alive or interpreter.executions >= self.max_executions:
+                with self._lock:
+                    self._sessions.pop(session_id, None)
+                if interpreter.alive:
+                    self._retire(interpreter, "max_executions")
+                    result["notice"] = "Interpreter was recycled; variables from earlier steps are no longer available."
+            return result
+
+    def _run(self, interpreter: Interpreter, code: str, timeout: float) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            result = interpreter.execute(code, timeout)
+            if result.get("fatal"):
+                self._retire(interpreter, "fatal_error")
+            return result
+        except InterpreterError as e:
+            reason = "timeout" if "timed out" in str(e) else "crash"
+            logger.warning(f"python_repl interpreter {interpreter.process.pid} failed ({reason}): {e}")
+            self._retire(interpreter, reason)
+            return {"ok": False, "error": f"Execution {reason}: {e}"}
+        finally:
+            _exec_latency.observe(time.perf_counter() - started)
+
+    def release_session(self, session_id: str) -> None:
+        """会话结束时释放其绑定的解释器"""
+        with self._lock:
+            interpreter = self._sessions.pop(session_id, None)
+            self._session_locks.pop(session_id, None)
+        if interpreter is not None:
+            self._retire(interpreter, "session_end")
+
+    def close(self) -> None:
+        self._closed = True
+        self._refill_needed.set()
+        with self._lock:
+            interpreters = list(self._idle) + list(self._sessions.values())
+            self._idle.clear()
+            self._sessions.clear()
+        for interpreter in interpreters:
+            interpreter.kill()
+
+
+_pool: Optional[InterpreterPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_interpreter_pool() -> InterpreterPool:
+    """首次使用时才创建全局解释器池，避免导入模块时就启动子进程"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = InterpreterPool()
+            atexit.register(_pool.close)
+        return _pool
+
+
+def release_session_interpreter(session_id: str) -> None:
+    """会话结束时调用；池尚未创建时什么也不做"""
+    if _pool is not None:
+        _pool.release_session(session_id)
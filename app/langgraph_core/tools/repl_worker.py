@@ -0,0 +1,141 @@
+# app/langgraph_core/tools/repl_worker.py
+"""
+python_repl 工具的解释器子进程。
+由 python_repl.InterpreterPool 以 `python -I repl_worker.py` 的方式启动，
+通过 stdin/stdout 上的 "4 字节长度前缀 + JSON" 消息接收代码并返回执行结果。
+该文件不依赖 app 包中的任何模块。
+"""
+
+import ast
+import contextlib
+import importlib
+import io
+import json
+import os
+import resource
+import signal
+import struct
+import sys
+import traceback
+
+_HEADER = struct.Struct(">I")
+
+CPU_LIMIT_S = int(os.environ.get("REPL_CPU_LIMIT_S", "10"))
+MEMORY_LIMIT_MB = int(os.environ.get("REPL_MEMORY_LIMIT_MB", "1024"))
+MAX_PROCESSES = int(os.environ.get("REPL_MAX_PROCESSES", "0"))
+MAX_FILE_MB = int(os.environ.get("REPL_MAX_FILE_MB", "64"))
+MAX_OPEN_FILES = int(os.environ.get("REPL_MAX_OPEN_FILES", "64"))
+MAX_OUTPUT_CHARS = int(os.environ.get("REPL_MAX_OUTPUT_CHARS", "20000"))
+PRELOAD_MODULES = [m for m in os.environ.get("REPL_PRELOAD", "numpy:np,pandas:pd").split(",") if m]
+
+
+class CpuLimitExceeded(Exception):
+    pass
+
+
+def _on_cpu_limit(signum, frame):
+    raise CpuLimitExceeded(f"CPU time limit of {CPU_LIMIT_S}s exceeded.")
+
+
+def _read_message(stream):
+    header = stream.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+    (length,) = _HEADER.unpack(header)
+    return json.loads(stream.read(length).decode("utf-8"))
+
+
+def _write_message(stream, message) -> None:
+    payload = json.dumps(message, ensure_ascii=False, default=str).encode("utf-8")
+    stream.write(_HEADER.pack(len(payload)) + payload)
+    stream.flush()
+
+
+def _truncate(text: str) -> str:
+    if len(text) <= MAX_OUTPUT_CHARS:
+        return text
+    return text[:MAX_OUTPUT_CHARS] + f"\n... [truncated {len(text) - MAX_OUTPUT_CHARS} chars]"
+
+
+def _cpu_used() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _run(code: str, namespace: dict) -> dict:
+    """像交互式解释器一样执行代码：最后一个表达式的值会被返回"""
+    stdout = io.StringIO()
+    value = None
+    cpu_before = _cpu_used()
+    # 每次执行前把 CPU 软限制推到 "已用时间 + 单次上限"
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = int(cpu_before) + CPU_LIMIT_S + 1
+    if hard == resource.RLIM_INFINITY or soft <= hard:
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+    try:
+        tree = ast.parse(code, mode="exec")
+        last_expr = tree.body.pop() if tree.body and isinstance(tree.body[-1], ast.Expr) else None
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stdout):
+            exec(compile(tree, "<repl>", "exec"), namespace)
+            if last_expr is not None:
+                result = eval(compile(ast.Expression(last_expr.value), "<repl>", "eval"), namespace)
+                if result is not None:
+                    value = repr(result)
+        return {"ok": True, "stdout": _truncate(stdout.getvalue()),
+                "value": _truncate(value) if value else None, "cpu_s": _cpu_used() - cpu_before}
+    except BaseException as e:  # 包括 SystemExit / KeyboardInterrupt，解释器本身必须存活
+        # 内存耗尽之后解释器状态不可信，通知父进程回收它
+        return {"ok": False, "fatal": isinstance(e, MemoryError), "stdout": _truncate(stdout.getvalue()),
+                "error": _truncate("".join(traceback.format_exception_only(type(e), e)).strip()),
+                "traceback": _truncate(traceback.format_exc()), "cpu_s": _cpu_used() - cpu_before}
+
+
+def _limit_processes_and_files() -> None:
+    """
+    预导入完成后设置：进程/线程数、单个文件大小和打开文件数的上限 (软硬限制相同，执行的代码无法再放宽)。
+    RLIMIT_NPROC 按用户统计，限制为 0 时任何 fork 或新线程都会失败，避免用子进程绕过单进程的 CPU 和内存限制。
+    """
+    if MAX_PROCESSES >= 0:
+        resource.setrlimit(resource.RLIMIT_NPROC, (MAX_PROCESSES, MAX_PROCESSES))
+    if MAX_FILE_MB > 0:
+        # 超出时写入操作返回 EFBIG，而不是用 SIGXFSZ 结束解释器
+        signal.signal(signal.SIGXFSZ, signal.SIG_IGN)
+        limit = MAX_FILE_MB * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_FSIZE, (limit, limit))
+    if MAX_OPEN_FILES > 0:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (MAX_OPEN_FILES, MAX_OPEN_FILES))
+
+
+def main() -> None:
+    if MEMORY_LIMIT_MB > 0:
+        limit = MEMORY_LIMIT_MB * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    signal.signal(signal.SIGXCPU, _on_cpu_limit)
+
+    # 协议使用原始的 stdout；把 fd 1 重定向到 /dev/null，避免 C 扩展或子进程的输出破坏协议
+    protocol_in = sys.stdin.buffer
+    protocol_out = os.fdopen(os.dup(1), "wb")
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+
+    namespace = {"__name__": "__main__"}
+    preloaded = []
+    for spec in PRELOAD_MODULES:
+        module_name, _, alias = spec.partition(":")
+        try:
+            namespace[alias or module_name] = importlib.import_module(module_name)
+            preloaded.append(module_name)
+        except Exception:
+            pass
+    _limit_processes_and_files()
+    _write_message(protocol_out, {"ready": True, "pid": os.getpid(), "preloaded": preloaded})
+
+    while True:
+        message = _read_message(protocol_in)
+        if message is None:
+            break
+        _write_message(protocol_out, _run(message.get("code", ""), namespace))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# app/langgraph_core/utils/budget.py
+
+import functools
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+from app.core.profiler import profile_scope
+from app.core.usage_log import usage_log
+from app.llms.usage import track_usage, usage_delta
+
+# --- 配置 ---
+# 请求没有指定时间预算时使用的默认值 (秒)，不设置则不限制
+DEFAULT_TIME_BUDGET_S = float(os.getenv("DEFAULT_TIME_BUDGET_S", "0")) or None
+# 每个会话 (含多轮对话的所有轮次) 的 token 上限，0 表示不限制。
+# 它同时作为默认的 token 预算，让会话在接近上限时先逐步降级；真正超出时直接中止会话
+SESSION_TOKEN_CEILING = int(os.getenv("SESSION_TOKEN_CEILING", "0")) or None
+# 剩余预算比例低于该值时，评估被缩短 (截断输入、最多一次修订)
+BUDGET_SHORTEN_FRACTION = float(os.getenv("BUDGET_SHORTEN_FRACTION", "0.5"))
+# 剩余预算比例低于该值时，跳过 LLM 评估，直接接受计划和结果
+BUDGET_SKIP_EVAL_FRACTION = float(os.getenv("BUDGET_SKIP_EVAL_FRACTION", "0.2"))
+# 为最终报告保留的时间 (秒)，工人和评估调用的截止时间会提前这么多
+SUMMARY_RESERVE_S = float(os.getenv("BUDGET_SUMMARY_RESERVE_S", "15"))
+# 剩余时间少于该值时不再发起新的子任务
+MIN_CALL_TIME_S = float(os.getenv("BUDGET_MIN_CALL_TIME_S", "3"))
+# 缩短模式下评估 prompt 中工人结果的最大长度
+SHORTENED_RESULT_CHARS = 4000
+
+FULL, SHORTENED, MINIMAL, EXHAUSTED = "full", "shortened", "minimal", "exhausted"
+
+
+def init_budget_state(time_budget_s: Optional[float] = None, token_budget: Optional[int] = None,
+                      session_tokens_used: int = 0) -> Dict[str, Any]:
+    """
+    根据请求中的预算生成初始状态字段；截止时间在会话开始时确定。
+    session_tokens_used 为同一会话之前各轮已经消耗的 token，本轮的预算不超过会话上限的剩余部分。
+    """
+    time_budget_s = time_budget_s or DEFAULT_TIME_BUDGET_S
+    if SESSION_TOKEN_CEILING is not None:
+        remaining = max(1, SESSION_TOKEN_CEILING - session_tokens_used)
+        token_budget = min(token_budget, remaining) if token_budget else remaining
+    return {
+        "deadline": time.time() + time_budget_s if time_budget_s else None,
+        "time_budget_s": time_budget_s,
+        "token_budget": token_budget,
+        "tokens_used": 0,
+    }
+
+
+@dataclass(frozen=True)
+class Budget:
+    """会话剩余预算的只读视图，由 AgentState 中的 deadline/token_budget/tokens_used 计算得出"""
+
+    deadline: Optional[float] = None
+    time_budget_s: Optional[float] = None
+    token_budget: Optional[int] = None
+    tokens_used: int = 0
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "Budget":
+        return cls(state.get("deadline"), state.get("time_budget_s"), state.get("token_budget"),
+                   state.get("tokens_used") or 0)
+
+    @property
+    def remaining_s(self) -> Optional[float]:
+        return self.deadline - time.time() if self.deadline is not None else None
+
+    @property
+    def remaining_tokens(self) -> Optional[int]:
+        return self.token_budget - self.tokens_used if self.token_budget is not None else None
+
+    @property
+    def fraction_remaining(self) -> float:
+        """时间和 token 两个维度中剩余比例较小的那个；没有预算时为 1.0"""
+        fractions = [1.0]
+        if self.deadline is not None and self.time_budget_s:
+            fractions.append(self.remaining_s / self.time_budget_s)
+        if self.token_budget:
+            fractions.append(self.remaining_tokens / self.token_budget)
+        return max(0.0, min(fractions))
+
+    @property
+    def mode(self) -> str:
+        remaining_s = self.remaining_s
+        fraction = self.fraction_remaining
+        if fraction <= 0 or (remaining_s is not None and remaining_s < MIN_CALL_TIME_S):
+            return EXHAUSTED
+        if fraction < BUDGET_SKIP_EVAL_FRACTION:
+            return MINIMAL
+        if fraction < BUDGET_SHORTEN_FRACTION:
+            return SHORTENED
+        return FULL
+
+    def revision_limit(self, max_revisions: int) -> int:
+        """预算充足时允许完整的修订次数，缩短模式下最多一次，更少时不再修订"""
+        mode = self.mode
+        if mode == FULL:
+            return max_revisions
+        return min(1, max_revisions) if mode == SHORTENED else 0
+
+    def call_deadline(self) -> Optional[float]:
+        """中间步骤 (工人、评估) 的 LLM 调用截止时间，为最终报告预留 SUMMARY_RESERVE_S"""
+        if self.deadline is None:
+            return None
+        # 剩余时间本身不足预留量时，给中间步骤留一半
+        return self.deadline - min(SUMMARY_RESERVE_S, max(0.0, self.remaining_s) / 2)
+
+    def describe(self) -> str:
+        parts = [f"mode={self.mode}"]
+        if self.deadline is not None:
+            parts.append(f"remaining={self.remaining_s:.1f}s/{self.time_budget_s:.0f}s")
+        if self.token_budget is not None:
+            parts.append(f"tokens={self.tokens_used}/{self.token_budget}")
+        return ", ".join(parts)
+
+
+def llm_budget_kwargs(deadline: Optional[float]) -> Dict[str, Any]:
+    """传给 ResilientChatModel.invoke 的额外参数；没有截止时间时为空"""
+    return {"deadline": deadline} if deadline is not None else {}
+
+
+def _node_label(node: Callable) -> str:
+    # supervisor_agent -> supervisor, other_worker_node -> other_worker，与图中的节点名一致
+    name = node.__name__
+    for suffix in ("_agent", "_node"):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def tracks_token_usage(node: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """
+    节点装饰器：统计节点内所有 LLM 调用消耗的 token，并以 tokens_used 增量的形式写回状态
+    (AgentState.tokens_used 使用加法归约)；同时写回 usage 增量 (token、缓存命中、耗时、费用，
+    按节点和模型分组，见 app.llms.usage.merge_usage)，每次调用的明细写入 JSONL 用量日志。
+    """
+    label = _node_label(node)
+
+    @functools.wraps(node)
+    def wrapper(state: Dict[str, Any]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        with track_usage() as usage, profile_scope(label):
+            result = node(state)
+        if not isinstance(result, dict):
+            return result
+        result = {**result, "usage": usage_delta(label, usage, time.perf_counter() - start)}
+        if usage.total_tokens:
+            result["tokens_used"] = usage.total_tokens
+        for record in usage.records:
+            usage_log.write({"type": "call", "session_id": state.get("session_id"), "turn": state.get("turn"),
+                             "node": label, **record})
+        return result
+
+    return wrapper
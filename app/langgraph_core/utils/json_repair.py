@@ -0,0 +1,100 @@
+# app/langgraph_core/utils/json_repair.py
+
+import re
+from typing import List, Optional
+
+_FENCE_RE = re.compile(r"```(?:json|JSON)?\s*(.*?)(?:```|$)", re.DOTALL)
+_TRAILING_COMMA_RE = re.compile(r",(\s*[}\]])")
+_PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+def _strip_fences(text: str) -> str:
+    match = _FENCE_RE.search(text)
+    return match.group(1) if match else text
+
+
+def _scan(text: str):
+    """
+    从第一个 { 或 [ 开始扫描，返回 (截取的片段, 未闭合的括号栈, 是否停在字符串内部, 各层最后一个完整元素的结束位置)。
+    片段在第一个完整的顶层值结束处截断，忽略其后的解释性文字。
+    """
+    start = min((i for i in (text.find("{"), text.find("[")) if i != -1), default=-1)
+    if start == -1:
+        return None, [], False, []
+    stack: List[str] = []
+    # 与 stack 一一对应：该层中最后一个完整元素之后的位置 (相对片段起点)，还没有完整元素时为 None
+    element_ends: List[Optional[int]] = []
+    in_string = escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+                if stack and stack[-1] == "]":
+                    element_ends[-1] = i + 1 - start
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            element_ends.append(None)
+        elif ch in "}]":
+            if stack and stack[-1] == ch:
+                stack.pop()
+                element_ends.pop()
+            if not stack:
+                return text[start:i + 1], [], False, []
+            if stack[-1] == "]":
+                element_ends[-1] = i + 1 - start
+        elif ch == "," and stack and stack[-1] == "]":
+            # 数字、true 等不带括号和引号的元素在遇到逗号时才算完整
+            element_ends[-1] = i - start
+    return text[start:], stack, in_string, element_ends
+
+
+def _replace_outside_strings(text: str) -> str:
+    """把字符串之外的 Python 字面量 (True/False/None) 替换成 JSON 字面量"""
+    parts = re.split(r'("(?:[^"\\]|\\.)*")', text)
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r"\b(True|False|None)\b", lambda m: _PYTHON_LITERALS[m.group(1)], parts[i])
+    return "".join(parts)
+
+
+def repair_json(text: str, drop_partial: bool = False) -> Optional[str]:
+    """
+    对 LLM 输出做快速的本地修复，尽量得到一个可以被 json.loads 解析的字符串：
+    - 去掉 ```json 代码块围栏和前后的解释文字；
+    - 补全被截断的字符串、对象和数组 (丢弃末尾不完整的键值对)；
+    - 去掉对象/数组末尾多余的逗号，替换 Python 风格的 True/False/None。
+    drop_partial=True 时，被截断的输出不补全最后一个元素，而是丢弃最外层未闭合数组中不完整的末尾元素
+    (例如被截断的最后一个子任务，其描述可能断在半句话中间)；没有可以保留的完整元素时返回 None。
+    无法找到 JSON 起点时返回 None。
+    """
+    if not text:
+        return None
+    fragment, stack, in_string, element_ends = _scan(_strip_fences(text))
+    if fragment is None:
+        return None
+    if stack and drop_partial:
+        if "]" not in stack:
+            return None
+        depth = stack.index("]")
+        if element_ends[depth] is None:
+            return None
+        fragment = fragment[:element_ends[depth]] + "".join(reversed(stack[:depth + 1]))
+    elif stack:
+        if in_string:
+            fragment += '"'
+        fragment = fragment.rstrip()
+        if stack[-1] == "}":
+            # 截断发生在键值对中间时 (只有键、或值是不完整的字面量)，丢弃这个不完整的键值对
+            fragment = re.sub(r'(,|\{)\s*"[^"]*"\s*:\s*(?:t|tr|tru|f|fa|fal|fals|n|nu|nul)?$', r"\1", fragment)
+            fragment = re.sub(r'(,|\{)\s*"[^"]*"$', r"\1", fragment)
+        fragment = fragment.rstrip().rstrip(",")
+        fragment += "".join(reversed(stack))
+    fragment = _TRAILING_COMMA_RE.sub(r"\1", fragment)
+    return _replace_outside_strings(fragment)
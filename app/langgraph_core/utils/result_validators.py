@@ -0,0 +1,107 @@
+# app/langgraph_core/utils/result_validators.py
+
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
+
+from app.langgraph_core.utils.json_repair import repair_json
+
+try:
+    import jsonschema
+except ImportError:  # jsonschema 是可选依赖，没有安装时使用下面的简化校验 (type/required/properties/items/enum)
+    jsonschema = None
+
+
+class ResultValidators(BaseModel):
+    """
+    workers_config.yaml 中工人的 validators 配置：对工人结果做确定性的规则校验。
+    所有规则都通过时 Supervisor 直接接受结果，不再调用 LLM 评估；有规则不通过时直接要求修改。
+    """
+    model_config = ConfigDict(extra="forbid")
+
+    min_length: Optional[int] = Field(default=None, ge=0)
+    max_length: Optional[int] = Field(default=None, ge=1)
+    # 结果中必须出现的关键词 (全部出现，区分大小写)
+    required_keywords: List[str] = []
+    # 结果中必须能匹配到的正则表达式 (re.search)
+    regex: Optional[str] = None
+    # 结果必须是符合该 JSON Schema 的 JSON (允许包在 ```json 代码块中)
+    json_schema: Optional[Dict[str, Any]] = None
+
+    @field_validator("regex")
+    @classmethod
+    def _compiles(cls, pattern: Optional[str]) -> Optional[str]:
+        if pattern is not None:
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise ValueError(f"invalid regex: {e}") from e
+        return pattern
+
+    @model_validator(mode="after")
+    def _length_range(self) -> "ResultValidators":
+        if self.min_length is not None and self.max_length is not None and self.min_length > self.max_length:
+            raise ValueError("min_length must not exceed max_length")
+        return self
+
+
+def _schema_errors(value: Any, schema: Dict[str, Any], path: str = "$") -> List[str]:
+    """jsonschema 不可用时的简化校验，只支持 type、enum、required、properties 和 items"""
+    types = {"object": dict, "array": list, "string": str, "boolean": bool, "null": type(None),
+             "integer": int, "number": (int, float)}
+    expected = schema.get("type")
+    if expected:
+        allowed = expected if isinstance(expected, list) else [expected]
+        ok = any(isinstance(value, types.get(t, object)) and not (t in ("integer", "number") and isinstance(value, bool))
+                 for t in allowed)
+        if not ok:
+            return [f"{path}: expected {expected}, got {type(value).__name__}"]
+    if "enum" in schema and value not in schema["enum"]:
+        return [f"{path}: {value!r} is not one of {schema['enum']}"]
+    errors = []
+    if isinstance(value, dict):
+        errors += [f"{path}: missing required property '{key}'" for key in schema.get("required", []) if key not in value]
+        for key, sub_schema in (schema.get("properties") or {}).items():
+            if key in value:
+                errors += _schema_errors(value[key], sub_schema, f"{path}.{key}")
+    if isinstance(value, list) and isinstance(schema.get("items"), dict):
+        for i, item in enumerate(value):
+            errors += _schema_errors(item, schema["items"], f"{path}[{i}]")
+    return errors
+
+
+def _json_schema_failures(result: str, schema: Dict[str, Any]) -> List[str]:
+    try:
+        value = json.loads(result)
+    except ValueError:
+        repaired = repair_json(result)
+        try:
+            value = json.loads(repaired) if repaired is not None else None
+        except ValueError:
+            repaired = None
+        if repaired is None:
+            return ["结果不是合法的 JSON"]
+    if jsonschema is not None:
+        validator = jsonschema.Draft202012Validator(schema)
+        return [f"JSON 不符合要求的 schema: {e.message}" for e in validator.iter_errors(value)][:5]
+    return [f"JSON 不符合要求的 schema: {error}" for error in _schema_errors(value, schema)][:5]
+
+
+def validate_result(validators: ResultValidators, result: Optional[str]) -> List[str]:
+    """按配置的规则校验工人结果，返回未通过的规则说明 (空列表表示全部通过)"""
+    result = result or ""
+    failures = []
+    if validators.min_length is not None and len(result) < validators.min_length:
+        failures.append(f"结果长度 {len(result)} 少于要求的最小长度 {validators.min_length}")
+    if validators.max_length is not None and len(result) > validators.max_length:
+        failures.append(f"结果长度 {len(result)} 超过了允许的最大长度 {validators.max_length}")
+    missing = [keyword for keyword in validators.required_keywords if keyword not in result]
+    if missing:
+        failures.append(f"结果缺少必须包含的关键词: {', '.join(missing)}")
+    if validators.regex is not None and not re.search(validators.regex, result):
+        failures.append(f"结果没有匹配要求的格式 (正则: {validators.regex})")
+    if validators.json_schema is not None:
+        failures += _json_schema_failures(result, validators.json_schema)
+    return failures
@@ -0,0 +1,176 @@
+# app/langgraph_core/utils/structured_output.py
+
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional, Type, TypeVar, Union, get_type_hints
+
+from langchain_core.messages import BaseMessage, HumanMessage
+from pydantic import BaseModel, ConfigDict, ValidationError, create_model, model_validator
+
+from app.core.metrics import metrics_registry
+from app.langgraph_core.state.graph_state import SubTask
+from app.langgraph_core.utils.json_repair import repair_json
+
+logger = logging.getLogger(__name__)
+
+# json_schema: 使用 OpenAI 的 Structured Outputs (严格 JSON Schema)；
+# json_object: 只要求输出 JSON 对象，适用于不支持 json_schema 的兼容接口
+STRUCTURED_OUTPUT_MODE = os.getenv("STRUCTURED_OUTPUT_MODE", "json_schema")
+# 本地修复失败后，最多重新询问 LLM 的次数
+MAX_REASKS = int(os.getenv("STRUCTURED_OUTPUT_MAX_REASKS", "1"))
+
+_calls = metrics_registry.counter("structured_output_calls_total", "Structured LLM calls by agent")
+_parse_failures = metrics_registry.counter(
+    "structured_output_parse_failures_total", "Responses that failed to parse, by agent and stage (raw/repaired)"
+)
+_repairs = metrics_registry.counter("structured_output_repairs_total", "Responses fixed by local JSON repair, by agent")
+_reasks = metrics_registry.counter("structured_output_reasks_total", "Extra LLM round-trips spent re-asking, by agent")
+_failures = metrics_registry.counter("structured_output_failures_total", "Calls that never produced valid output")
+
+
+class _StrictModel(BaseModel):
+    # 严格模式要求 additionalProperties: false
+    model_config = ConfigDict(extra="forbid")
+
+
+# --- 由 SubTask TypedDict 派生的规划师输出 Schema ---
+# 规划师只负责规划字段，status/result/cached 由系统在执行过程中填写。
+# 解析时给缺失字段提供默认值，避免为了一个可补全的字段重新询问；
+# 发给模型的 JSON Schema 仍然把所有字段标记为必填 (见 _strict_schema)。
+_PLANNER_EXCLUDED_FIELDS = ("status", "result", "cached", "duration_s")
+_PLANNER_DEFAULTS = {"task_id": "", "task_name": "", "description": "", "worker": None,
+                     "estimated_time": "", "dependencies": []}
+PlannedSubTask = create_model(
+    "PlannedSubTask",
+    __base__=_StrictModel,
+    **{
+        name: (hint, _PLANNER_DEFAULTS.get(name, ...))
+        for name, hint in get_type_hints(SubTask).items() if name not in _PLANNER_EXCLUDED_FIELDS
+    },
+)
+
+
+class PlanOutput(_StrictModel):
+    steps: List[PlannedSubTask]
+
+    @model_validator(mode="before")
+    @classmethod
+    def _accept_legacy_shapes(cls, data: Any) -> Any:
+        # 兼容 {"plan": [...]} 或直接返回步骤列表的输出
+        if isinstance(data, list):
+            return {"steps": data}
+        if isinstance(data, dict) and "steps" not in data and isinstance(data.get("plan"), list):
+            return {"steps": data["plan"]}
+        return data
+
+
+class PlanAmendment(_StrictModel):
+    """多轮对话中对已有计划的增量修改：需要重新执行的任务 ID，以及追加的新任务"""
+    rerun_task_ids: List[str] = []
+    new_steps: List[PlannedSubTask] = []
+
+
+# 判定字段必填；说明性字段缺失时按空字符串处理，不值得为此重新询问
+class PlanEvaluation(_StrictModel):
+    evaluation_summary: str = ""
+    is_approved: bool
+    feedback: str = ""
+
+
+class PlanCandidatesEvaluation(_StrictModel):
+    """一次性评估多份候选计划：选出最好的一份，并判断它能否直接执行"""
+    evaluation_summary: str = ""
+    best_candidate: int
+    is_approved: bool
+    feedback: str = ""
+
+
+class ResultEvaluation(_StrictModel):
+    is_satisfactory: bool
+    feedback: str = ""
+
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+LLMInput = Union[str, List[BaseMessage]]
+
+
+class StructuredOutputError(ValueError):
+    """本地修复和重新询问之后仍然无法得到合法的结构化输出"""
+
+
+def _strict_schema(node: Any) -> Any:
+    """严格模式要求每个对象的所有属性都必填，且不支持 default 关键字"""
+    if isinstance(node, dict):
+        node = {k: _strict_schema(v) for k, v in node.items() if k != "default"}
+        if "properties" in node:
+            node["required"] = list(node["properties"])
+            node["additionalProperties"] = False
+    elif isinstance(node, list):
+        node = [_strict_schema(v) for v in node]
+    return node
+
+
+def response_format_for(schema: Type[BaseModel]) -> Dict[str, Any]:
+    """根据 Pydantic 模型生成传给 ChatOpenAI.invoke 的 response_format"""
+    if STRUCTURED_OUTPUT_MODE != "json_schema":
+        return {"type": "json_object"}
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": schema.__name__, "strict": True, "schema": _strict_schema(schema.model_json_schema())},
+    }
+
+
+def parse_structured(content: str, schema: Type[ModelT], agent: str) -> ModelT:
+    """先直接解析；失败后做本地 JSON 修复再解析。都失败时抛出 StructuredOutputError。"""
+    try:
+        return schema.model_validate_json(content)
+    except ValidationError as e:
+        _parse_failures.inc(agent=agent, stage="raw")
+        first_error = e
+    # 被截断的输出只保留完整的元素：补全半截的最后一项 (例如断在句子中间的子任务描述) 会让它看起来合法
+    repaired = repair_json(content, drop_partial=True)
+    if repaired is not None:
+        try:
+            result = schema.model_validate(json.loads(repaired))
+            _repairs.inc(agent=agent)
+            logger.info(f"[{agent}] Structured output recovered by local JSON repair.")
+            return result
+        except (ValueError, ValidationError) as e:
+            first_error = e
+    _parse_failures.inc(agent=agent, stage="repaired")
+    raise StructuredOutputError(f"{type(first_error).__name__}: {first_error}")
+
+
+def _with_correction(llm_input: LLMInput, error: str) -> LLMInput:
+    correction = (
+        f"你上一次的输出无法被解析为要求的 JSON 格式 (错误: {error[:500]})。"
+        "请只输出一个完全符合要求格式的 JSON 对象，不要包含任何其他文字或代码块标记。"
+    )
+    if isinstance(llm_input, str):
+        return f"{llm_input}\n\n{correction}"
+    return [*llm_input, HumanMessage(content=correction)]
+
+
+def invoke_structured(llm, llm_input: LLMInput, schema: Type[ModelT], agent: str, **invoke_kwargs) -> ModelT:
+    """
+    以 schema 约束的结构化输出调用 LLM 并解析结果：
+    1. 通过 response_format 传递由 schema 生成的 JSON Schema；
+    2. 解析失败时先做本地 JSON 修复 (代码块、多余逗号等；截断时丢弃不完整的末尾元素)，不额外消耗 LLM 调用；
+    3. 仍然失败时把错误信息附加到输入中重新询问，最多 MAX_REASKS 次。
+    """
+    _calls.inc(agent=agent)
+    last_error: Optional[str] = None
+    for attempt in range(MAX_REASKS + 1):
+        current_input = llm_input if last_error is None else _with_correction(llm_input, last_error)
+        if attempt:
+            _reasks.inc(agent=agent)
+            logger.warning(f"[{agent}] Re-asking LLM for valid structured output (attempt {attempt + 1}).")
+        response = llm.invoke(current_input, response_format=response_format_for(schema), **invoke_kwargs)
+        try:
+            return parse_structured(response.content, schema, agent)
+        except StructuredOutputError as e:
+            last_error = str(e)
+            logger.error(f"[{agent}] Failed to parse structured output: {e}. Raw content: '{response.content}'")
+    _failures.inc(agent=agent)
+    raise StructuredOutputError(last_error or "unknown error")
@@ -0,0 +1,158 @@
+# app/llms/cassette.py
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Optional
+
+from langchain_core.messages import BaseMessage, HumanMessage, message_to_dict, messages_from_dict
+from langchain_core.prompt_values import PromptValue
+
+from app.core.metrics import metrics_registry
+
+logger = logging.getLogger(__name__)
+
+# --- 配置 ---
+# off: 不启用；record: 把每次 LLM 调用的请求、响应和耗时追加到磁带文件；replay: 只从磁带回放，不访问网络
+LLM_CASSETTE_MODE = os.getenv("LLM_CASSETTE_MODE", "off").lower()
+LLM_CASSETTE_PATH = os.getenv("LLM_CASSETTE_PATH", os.path.join("data", "cassettes", "llm_cassette.jsonl"))
+# 回放时的延迟倍数：1 为按录制时的原始耗时等待，0 为不等待
+LLM_CASSETTE_LATENCY_SCALE = float(os.getenv("LLM_CASSETTE_LATENCY_SCALE", "1.0"))
+
+_events = metrics_registry.counter("llm_cassette_events_total", "Cassette record/replay events, by agent and outcome")
+
+# 参与哈希前统一替换掉每次运行都不同的内容
+_VOLATILE_PATTERNS = [
+    (re.compile(r"\b[0-9a-f]{8}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{12}\b", re.IGNORECASE), "<uuid>"),
+    (re.compile(r"\b\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(\.\d+)?(Z|[+-]\d{2}:?\d{2})?\b"), "<timestamp>"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+class CassetteMissError(LookupError):
+    """回放模式下磁带中没有与请求匹配的录制 (提示词或调用顺序发生了变化)"""
+
+
+def _to_messages(llm_input: Any) -> List[BaseMessage]:
+    if isinstance(llm_input, PromptValue):
+        return llm_input.to_messages()
+    if isinstance(llm_input, str):
+        return [HumanMessage(content=llm_input)]
+    return list(llm_input)
+
+
+def _normalize(text: str) -> str:
+    for pattern, replacement in _VOLATILE_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text.strip()
+
+
+def prompt_hash(agent: str, llm_input: Any, invoke_kwargs: Dict[str, Any]) -> str:
+    """
+    规范化提示词的哈希：agent、每条消息的类型和内容 (合并空白、替换 UUID 和时间戳)
+    以及结构化输出的 schema 名称；timeout、deadline 等与内容无关的参数不参与。
+    """
+    response_format = invoke_kwargs.get("response_format") or {}
+    payload = {
+        "agent": agent,
+        "messages": [[m.type, _normalize(m.content if isinstance(m.content, str) else json.dumps(m.content, ensure_ascii=False))]
+                     for m in _to_messages(llm_input)],
+        "response_format": (response_format.get("json_schema") or {}).get("name") or response_format.get("type"),
+    }
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """
+    LLM 调用的录制与回放。磁带是 JSONL 文件，每行一条记录：
+    - {"type": "llm", "key", "agent", "model", "latency_s", "response"}：一次 LLM 调用；
+    - {"type": "request", "session_id", "request"}：一次会话请求，供离线回放整个会话 (见 benchmarks/cassette_replay.py)。
+    相同 key 的多次调用按录制顺序依次回放，用完后重复最后一条。
+    """
+
+    def __init__(self, path: str, mode: str, latency_scale: float = LLM_CASSETTE_LATENCY_SCALE):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode '{mode}'.")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.misses: Dict[str, int] = defaultdict(int)
+        self._entries: Dict[str, Deque[Dict[str, Any]]] = defaultdict(deque)
+        self._lock = threading.Lock()
+        if mode == "replay":
+            self._load()
+
+    def _load(self) -> None:
+        for record in read_cassette(self.path):
+            if record.get("type") == "llm":
+                self._entries[record["key"]].append(record)
+        logger.info(f"Loaded {sum(len(q) for q in self._entries.values())} LLM calls from cassette '{self.path}'.")
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def record_request(self, session_id: str, request: Dict[str, Any]) -> None:
+        if self.mode == "record":
+            self._append({"type": "request", "session_id": session_id, "request": request, "recorded_at": time.time()})
+
+    def record(self, agent: str, model: Optional[str], llm_input: Any, invoke_kwargs: Dict[str, Any],
+               response: BaseMessage, latency_s: float) -> None:
+        self._append({
+            "type": "llm", "key": prompt_hash(agent, llm_input, invoke_kwargs), "agent": agent, "model": model,
+            "latency_s": round(latency_s, 6), "response": message_to_dict(response),
+        })
+        with self._lock:
+            self.calls[agent] += 1
+        _events.inc(agent=agent, outcome="recorded")
+
+    def replay(self, agent: str, llm_input: Any, invoke_kwargs: Dict[str, Any],
+               deadline: Optional[float] = None) -> Dict[str, Any]:
+        """返回录制的 {"model", "latency_s", "message"}；按 latency_scale 缩放后的录制耗时等待，超过 deadline 时抛出 TimeoutError"""
+        key = prompt_hash(agent, llm_input, invoke_kwargs)
+        with self._lock:
+            queue = self._entries.get(key)
+            if not queue:
+                self.misses[agent] += 1
+                _events.inc(agent=agent, outcome="miss")
+                raise CassetteMissError(f"[{agent}] No recorded LLM response for prompt hash {key[:12]}.")
+            entry = queue.popleft() if len(queue) > 1 else queue[0]
+            self.calls[agent] += 1
+        _events.inc(agent=agent, outcome="hit")
+        delay = entry["latency_s"] * self.latency_scale
+        if deadline is not None and time.time() + delay > deadline:
+            time.sleep(max(0.0, deadline - time.time()))
+            raise TimeoutError(f"[{agent}] Replayed LLM call exceeded the deadline.")
+        time.sleep(delay)
+        return {"model": entry.get("model"), "latency_s": entry["latency_s"],
+                "message": messages_from_dict([entry["response"]])[0]}
+
+
+def read_cassette(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+_cassette: Optional[Cassette] = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette() -> Optional[Cassette]:
+    """按 LLM_CASSETTE_MODE 创建的进程内磁带；off 时返回 None"""
+    global _cassette
+    if LLM_CASSETTE_MODE == "off":
+        return None
+    if _cassette is None:
+        with _cassette_lock:
+            if _cassette is None:
+                _cassette = Cassette(LLM_CASSETTE_PATH, LLM_CASSETTE_MODE)
+    return _cassette
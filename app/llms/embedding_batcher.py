@@ -0,0 +1,138 @@
+# app/llms/embedding_batcher.py
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+from app.core.metrics import metrics_registry
+
+logger = logging.getLogger(__name__)
+
+_batch_size = metrics_registry.histogram(
+    "embedding_batch_size", "Number of texts per coalesced embed_documents call",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+_batch_wait = metrics_registry.histogram(
+    "embedding_batch_wait_seconds", "Time an embed_query call waited before its batch was dispatched",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+)
+_batch_latency = metrics_registry.histogram("embedding_batch_seconds", "Latency of coalesced embed_documents calls")
+_timeouts = metrics_registry.counter("embedding_query_timeouts_total", "embed_query calls abandoned after their timeout")
+
+
+class MicroBatchingEmbeddings(Embeddings):
+    """
+    把并发的 embed_query 调用在一个很短的时间窗口内合并成一次 embed_documents 调用，
+    再把结果分发回各个调用方。
+
+    批处理运行在一个独立的后台事件循环线程上，因此同步调用 (LangGraph 在线程池中执行的节点)
+    和异步调用共享同一个队列，不同会话之间的请求也能被合并。
+    同步调用最多等待 timeout_s (调用方可以传入更短的超时)，避免后台循环卡住或接口无响应时工人线程一直阻塞。
+    """
+
+    def __init__(self, inner: Embeddings, max_batch_size: int = 64, max_wait_ms: float = 10,
+                 timeout_s: Optional[float] = None):
+        self.inner = inner
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000
+        self.timeout_s = timeout_s
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._start_lock = threading.Lock()
+
+    # --- 后台事件循环 ---
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            with self._start_lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    ready = threading.Event()
+
+                    def run():
+                        asyncio.set_event_loop(loop)
+                        self._queue = asyncio.Queue()
+                        loop.create_task(self._collect_batches())
+                        ready.set()
+                        loop.run_forever()
+
+                    threading.Thread(target=run, name="embedding-batcher", daemon=True).start()
+                    ready.wait()
+                    self._loop = loop
+        return self._loop
+
+    async def _collect_batches(self) -> None:
+        while True:
+            batch: List[Tuple[str, asyncio.Future, float]] = [await self._queue.get()]
+            deadline = batch[0][2] + self.max_wait_s
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # 不等待上一批返回，立刻开始收集下一批
+            asyncio.get_running_loop().create_task(self._dispatch(batch))
+
+    async def _dispatch(self, batch: List[Tuple[str, asyncio.Future, float]]) -> None:
+        dispatched_at = time.perf_counter()
+        # 调用方已经超时放弃的请求不再发送
+        batch = [entry for entry in batch if not entry[1].done()]
+        if not batch:
+            return
+        unique_texts = list(dict.fromkeys(text for text, _, _ in batch))  # 同一批内的重复文本只请求一次
+        for _, _, enqueued_at in batch:
+            _batch_wait.observe(dispatched_at - enqueued_at)
+        _batch_size.observe(len(unique_texts))
+        try:
+            vectors = await self.inner.aembed_documents(unique_texts)
+            by_text = dict(zip(unique_texts, vectors))
+            for text, future, _ in batch:
+                if not future.done():
+                    future.set_result(by_text[text])
+        except Exception as e:
+            logger.warning(f"Batched embedding request of {len(unique_texts)} texts failed: {e}")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            _batch_latency.observe(time.perf_counter() - dispatched_at)
+
+    async def _enqueue(self, text: str) -> List[float]:
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((text, future, time.perf_counter()))
+        return await future
+
+    def _submit(self, text: str) -> Future:
+        return asyncio.run_coroutine_threadsafe(self._enqueue(text), self._ensure_started())
+
+    # --- Embeddings 接口 ---
+
+    def embed_query(self, text: str, timeout: Optional[float] = None) -> List[float]:
+        """超过 timeout (秒，与 timeout_s 取较小者) 仍未返回时取消请求并抛出 TimeoutError"""
+        if self.timeout_s is not None:
+            timeout = self.timeout_s if timeout is None else min(timeout, self.timeout_s)
+        future = self._submit(text)
+        try:
+            return future.result(max(0.0, timeout) if timeout is not None else None)
+        except FutureTimeoutError:
+            future.cancel()
+            _timeouts.inc()
+            raise TimeoutError(f"embed_query did not complete within {timeout:.2f}s") from None
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.wrap_future(self._submit(text))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # 调用方已经自行成批，直接透传
+        return self.inner.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.inner.aembed_documents(texts)
@@ -1,9 +1,20 @@
 # app/llms/embedding_models.py
 
+import os
 from langchain_openai import OpenAIEmbeddings
 
+from app.llms.embedding_batcher import MicroBatchingEmbeddings
+
 # 默认的嵌入模型
 default_embedding_model = OpenAIEmbeddings(model="text-embedding-ada-002")
 
+# 在默认模型前加一层微批处理：并发会话的 embed_query 会在短时间窗口内合并成一次请求
+batched_embedding_model = MicroBatchingEmbeddings(
+    default_embedding_model,
+    max_batch_size=int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "64")),
+    max_wait_ms=float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", "10")),
+    timeout_s=float(os.getenv("EMBEDDING_TIMEOUT_S", "30")),
+)
+
 # 如果有其他供应商的嵌入模型，也可以放在这里
 # cohere_embedding_model = CohereEmbeddings(model="embed-english-v3.0")
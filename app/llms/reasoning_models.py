@@ -1,15 +1,46 @@
 # app/llms/reasoning_models.py
 
+import functools
+from typing import Optional
+
 from langchain_openai import ChatOpenAI
 
+from app.llms.resilience import LLM_REQUEST_TIMEOUT_S, with_resilience
+
+# 所有模型都包一层弹性层 (对冲请求、退避重试、熔断与备用模型)，
+# 底层客户端只负责单次请求：设置超时并关闭它自带的重试
+_CLIENT_KWARGS = {"timeout": LLM_REQUEST_TIMEOUT_S, "max_retries": 0}
+
 # 总裁办代理使用的 LLM (可能需要最强的推理能力)
-supervisor_llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.6)
+supervisor_llm = with_resilience(ChatOpenAI(model="gpt-4o-mini", temperature=0.6, **_CLIENT_KWARGS), name="supervisor")
 
 # 总监代理使用的 LLM (这里沿用之前的 director_llm，但现在它可能被 supervisor_llm 替代)
 # director_llm = ChatOpenAI(model="gpt-4o", temperature=0.5) # 暂时保留，但可能不再直接使用
 
 # 策划代理使用的 LLM
-planner_llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.3)
+planner_llm = with_resilience(ChatOpenAI(model="gpt-4o-mini", temperature=0.3, **_CLIENT_KWARGS), name="planner")
 
 # 其他工人代理使用的 LLM (稍后会用到)
-other_worker_llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.7)
+other_worker_llm = with_resilience(ChatOpenAI(model="gpt-4o-mini", temperature=0.7, **_CLIENT_KWARGS), name="other_worker")
+
+
+# 工人默认使用的模型和温度 (与 other_worker_llm 相同)
+DEFAULT_WORKER_MODEL = "gpt-4o-mini"
+DEFAULT_WORKER_TEMPERATURE = 0.7
+
+
+@functools.lru_cache(maxsize=None)
+def _configured_worker_llm(name: str, model: Optional[str], temperature: Optional[float]):
+    return with_resilience(ChatOpenAI(model=model or DEFAULT_WORKER_MODEL,
+                                      temperature=DEFAULT_WORKER_TEMPERATURE if temperature is None else temperature,
+                                      **_CLIENT_KWARGS), name=name)
+
+
+def get_worker_llm(name: str, model: Optional[str] = None, temperature: Optional[float] = None):
+    """
+    工人使用的 LLM：配置了 model 或 temperature 的工人各自拥有一个实例 (按配置缓存)，
+    否则共享 other_worker_llm。
+    """
+    if model is None and temperature is None:
+        return other_worker_llm
+    return _configured_worker_llm(name, model, temperature)
@@ -0,0 +1,395 @@
+# app/llms/resilience.py
+
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Deque, Dict, Iterator, Optional
+
+import httpx
+import openai
+from langchain_core.language_models import BaseChatModel, LanguageModelInput
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from app.core.metrics import metrics_registry
+from app.core.profiler import profile_scope
+from app.llms.cassette import get_cassette
+from app.llms.scheduler import QueueTimeoutError, current_priority, llm_scheduler
+from app.llms.usage import record_usage
+
+logger = logging.getLogger(__name__)
+
+# --- 配置 ---
+# 单次 HTTP 请求的超时；底层客户端的自动重试被关闭，由本模块统一负责重试
+LLM_REQUEST_TIMEOUT_S = float(os.getenv("LLM_REQUEST_TIMEOUT_S", "120"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BASE_DELAY_S = float(os.getenv("LLM_RETRY_BASE_DELAY_S", "0.5"))
+LLM_RETRY_MAX_DELAY_S = float(os.getenv("LLM_RETRY_MAX_DELAY_S", "20"))
+# 对冲请求：请求耗时超过该模型最近延迟的 LLM_HEDGE_QUANTILE 分位数后，再发一个相同的请求，取先返回者
+LLM_HEDGING_ENABLED = os.getenv("LLM_HEDGING_ENABLED", "true").lower() == "true"
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+LLM_HEDGE_MIN_DELAY_S = float(os.getenv("LLM_HEDGE_MIN_DELAY_S", "0.2"))
+LLM_HEDGE_INITIAL_DELAY_S = float(os.getenv("LLM_HEDGE_INITIAL_DELAY_S", "10"))  # 样本不足时使用
+LLM_HEDGE_MAX_RATIO = float(os.getenv("LLM_HEDGE_MAX_RATIO", "0.1"))  # 对冲请求最多占总请求的比例
+# 熔断器：连续失败达到阈值后打开，冷却期内直接失败 (或切换到备用模型)，之后放行一个探测请求
+LLM_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", "5"))
+LLM_CIRCUIT_RESET_S = float(os.getenv("LLM_CIRCUIT_RESET_S", "30"))
+# 备用模型 (可选)：主端点熔断或重试耗尽时使用
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL")
+LLM_FALLBACK_BASE_URL = os.getenv("LLM_FALLBACK_BASE_URL")
+LLM_FALLBACK_API_KEY = os.getenv("LLM_FALLBACK_API_KEY")
+_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "64"))
+_LATENCY_WINDOW = 256
+_MIN_LATENCY_SAMPLES = 20
+
+_request_seconds = metrics_registry.histogram("llm_request_seconds", "Latency of individual LLM HTTP requests")
+_calls = metrics_registry.counter("llm_calls_total", "Resilient LLM calls by model and outcome")
+_hedges = metrics_registry.counter("llm_hedges_total", "Hedged requests by model and result (sent/won/suppressed)")
+_retries = metrics_registry.counter("llm_retries_total", "LLM retries by model and error type")
+_fallbacks = metrics_registry.counter("llm_fallbacks_total", "Calls served by the fallback model")
+_circuit_open = metrics_registry.gauge("llm_circuit_open", "1 while an endpoint's circuit breaker is open")
+_circuit_rejections = metrics_registry.counter("llm_circuit_rejections_total", "Calls rejected by an open circuit")
+
+# 所有 LLM 请求 (包括对冲请求) 都在这个线程池中执行
+_executor = ThreadPoolExecutor(max_workers=_POOL_SIZE, thread_name_prefix="llm-call")
+
+
+class CircuitOpenError(RuntimeError):
+    """端点的熔断器处于打开状态，请求被直接拒绝"""
+
+
+class DeadlineExceededError(TimeoutError):
+    """调用方的截止时间已到 (或剩余时间不足以再发起一次请求)"""
+
+
+def is_retryable_error(exc: BaseException) -> bool:
+    """429、5xx、超时和连接错误可以重试；其他 4xx (请求本身有问题) 不重试"""
+    if isinstance(exc, DeadlineExceededError):
+        return False
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code == 429 or exc.status_code >= 500
+    return isinstance(exc, (openai.APIConnectionError, httpx.TimeoutException, httpx.TransportError, TimeoutError))
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def backoff_delay(attempt: int, exc: Optional[BaseException] = None) -> float:
+    """指数退避 + 全抖动；服务端给出 Retry-After 时以它为下限"""
+    delay = random.uniform(0, min(LLM_RETRY_MAX_DELAY_S, LLM_RETRY_BASE_DELAY_S * 2 ** attempt))
+    retry_after = _retry_after(exc) if exc is not None else None
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, LLM_RETRY_MAX_DELAY_S))
+    return delay
+
+
+class LatencyTracker:
+    """保存最近若干次成功请求的耗时，用于估计自适应的对冲阈值"""
+
+    def __init__(self, window: int = _LATENCY_WINDOW, min_samples: int = _MIN_LATENCY_SAMPLES):
+        self.min_samples = min_samples
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class _HedgeBudget:
+    """令牌桶：每个请求积累 ratio 个令牌，每次对冲消耗一个，防止端点整体变慢时请求量翻倍"""
+
+    def __init__(self, ratio: float, burst: float = 10):
+        self.ratio = ratio
+        self.burst = burst
+        self._tokens = burst
+        self._lock = threading.Lock()
+
+    def on_request(self) -> None:
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class CircuitBreaker:
+    """按端点共享的熔断器 (closed -> open -> half_open -> closed)"""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, endpoint: str, failure_threshold: int = LLM_CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout_s: float = LLM_CIRCUIT_RESET_S):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout_s:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN:
+                # 半开状态只放行一个探测请求
+                if self._probe_in_flight:
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info(f"Circuit for LLM endpoint '{self.endpoint}' closed.")
+                _circuit_open.set(0, endpoint=self.endpoint)
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"Circuit for LLM endpoint '{self.endpoint}' opened after {self._failures} failures.")
+                    _circuit_open.set(1, endpoint=self.endpoint)
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(endpoint: str) -> CircuitBreaker:
+    with _breakers_lock:
+        if endpoint not in _breakers:
+            _breakers[endpoint] = CircuitBreaker(endpoint)
+        return _breakers[endpoint]
+
+
+@contextmanager
+def _scheduler_slot(label: str, deadline: Optional[float]) -> Iterator[None]:
+    """按会话的优先级和租户占用一个调用名额 (见 app/llms/scheduler.py)；排队期间 deadline 到期时抛出 DeadlineExceededError"""
+    priority, tenant = current_priority()
+    try:
+        with llm_scheduler.slot(priority, tenant, deadline):
+            yield
+    except QueueTimeoutError as e:
+        raise DeadlineExceededError(f"[{label}] {e}") from e
+
+
+def _endpoint_key(model: BaseChatModel) -> str:
+    # 以客户端实际使用的地址为准：通过 OPENAI_BASE_URL 配置时 openai_api_base 仍为 None
+    client = getattr(model, "root_client", None)
+    base_url = getattr(client, "base_url", None) or getattr(model, "openai_api_base", None) or "https://api.openai.com/v1"
+    return f"{str(base_url).rstrip('/')}|{getattr(model, 'model_name', type(model).__name__)}"
+
+
+class _Endpoint:
+    """一个具体的模型端点：熔断器按端点共享，延迟统计和对冲预算按包装实例独立"""
+
+    def __init__(self, model: BaseChatModel, label: str):
+        self.model = model
+        self.label = label
+        self.breaker = get_circuit_breaker(_endpoint_key(model))
+        self.latency = LatencyTracker()
+        self.hedge_budget = _HedgeBudget(LLM_HEDGE_MAX_RATIO)
+
+    def hedge_delay(self) -> float:
+        observed = self.latency.quantile(LLM_HEDGE_QUANTILE)
+        return LLM_HEDGE_INITIAL_DELAY_S if observed is None else max(observed, LLM_HEDGE_MIN_DELAY_S)
+
+
+class ResilientChatModel(Runnable[LanguageModelInput, BaseMessage]):
+    """
+    包在 ChatModel 外面的弹性层，对调用方透明 (可以 invoke、bind、用 | 组成链)：
+    - 对冲请求：超过自适应阈值 (该模型最近的 p95) 仍未返回时再发一个相同请求，取先完成者；
+    - 429/5xx/超时按指数退避重试；
+    - 端点熔断：连续失败后快速失败，配置了备用模型时切换过去。
+
+    调用时可以传入 deadline (time.time() 时间戳，例如 llm.bind(deadline=...))：
+    每次请求的超时被截断到剩余时间，剩余时间不够时不再重试，直接抛出 DeadlineExceededError。
+    """
+
+    def __init__(self, model: BaseChatModel, name: str, fallback: Optional[BaseChatModel] = None,
+                 max_retries: int = LLM_MAX_RETRIES, hedging: bool = LLM_HEDGING_ENABLED):
+        self.name = name
+        self.max_retries = max_retries
+        self.hedging = hedging
+        self._primary = _Endpoint(model, name)
+        self._fallback = _Endpoint(fallback, f"{name}:fallback") if fallback is not None else None
+
+    @property
+    def model(self) -> BaseChatModel:
+        return self._primary.model
+
+    @property
+    def model_name(self) -> str:
+        return getattr(self._primary.model, "model_name", self.name)
+
+    def invoke(self, input: LanguageModelInput, config: Optional[RunnableConfig] = None, **kwargs: Any) -> BaseMessage:
+        deadline: Optional[float] = kwargs.pop("deadline", None)
+        return self._invoke(input, config, kwargs, deadline)
+
+    def _invoke(self, input: LanguageModelInput, config: Optional[RunnableConfig], kwargs: Dict[str, Any],
+                deadline: Optional[float]) -> BaseMessage:
+        cassette = get_cassette()
+        if cassette is not None and cassette.mode == "replay":
+            return self._replay(cassette, input, kwargs, deadline)
+        start = time.perf_counter()
+        endpoint = self._primary
+        try:
+            result = self._invoke_endpoint(endpoint, input, config, kwargs, deadline)
+        except Exception as e:
+            if self._fallback is None or not (isinstance(e, CircuitOpenError) or is_retryable_error(e)):
+                raise
+            logger.warning(f"[{self.name}] Primary LLM endpoint unavailable ({type(e).__name__}: {e}). Using fallback model.")
+            _fallbacks.inc(model=self.name)
+            endpoint = self._fallback
+            result = self._invoke_endpoint(endpoint, input, config, kwargs, deadline)
+        latency_s = time.perf_counter() - start
+        model_name = getattr(endpoint.model, "model_name", self.name)
+        record_usage(result, agent=self.name, model=model_name, latency_s=latency_s)
+        if cassette is not None:
+            cassette.record(self.name, model_name, input, kwargs, result, latency_s)
+        return result
+
+    def _replay(self, cassette, input: LanguageModelInput, kwargs: Dict[str, Any],
+                deadline: Optional[float]) -> BaseMessage:
+        """回放模式：从磁带返回录制的响应，不访问网络；用量照常记录，便于比较 token 和调用次数"""
+        try:
+            with _scheduler_slot(self.name, deadline):
+                replayed = cassette.replay(self.name, input, kwargs, deadline)
+        except TimeoutError as e:
+            raise DeadlineExceededError(str(e)) from e
+        record_usage(replayed["message"], agent=self.name, model=replayed["model"],
+                     latency_s=replayed["latency_s"] * cassette.latency_scale)
+        return replayed["message"]
+
+    def _invoke_endpoint(self, endpoint: _Endpoint, input: LanguageModelInput, config: Optional[RunnableConfig],
+                         kwargs: Dict[str, Any], deadline: Optional[float] = None) -> BaseMessage:
+        for attempt in range(self.max_retries + 1):
+            # 每次尝试单独占用名额，退避等待前释放：否则重试中的 batch 调用会在等待期间占着名额，
+            # 让排队的 interactive 调用失去严格优先
+            with _scheduler_slot(endpoint.label, deadline):
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise DeadlineExceededError(f"[{endpoint.label}] Deadline exceeded before LLM call.")
+                    kwargs = {**kwargs, "timeout": min(kwargs.get("timeout") or remaining, remaining)}
+                if not endpoint.breaker.allow_request():
+                    _circuit_rejections.inc(model=endpoint.label)
+                    raise CircuitOpenError(f"Circuit for LLM endpoint '{endpoint.breaker.endpoint}' is open.")
+                try:
+                    result = self._hedged_call(endpoint, input, config, kwargs)
+                except Exception as e:
+                    if not is_retryable_error(e):
+                        # 端点正常响应了，只是请求本身有问题，不计入熔断
+                        endpoint.breaker.record_success()
+                        _calls.inc(model=endpoint.label, outcome="error")
+                        raise
+                    endpoint.breaker.record_failure()
+                    if attempt == self.max_retries:
+                        _calls.inc(model=endpoint.label, outcome="error")
+                        raise
+                    delay = backoff_delay(attempt, e)
+                    if deadline is not None and time.time() + delay >= deadline:
+                        _calls.inc(model=endpoint.label, outcome="error")
+                        raise DeadlineExceededError(f"[{endpoint.label}] Deadline exceeded after {attempt + 1} attempts: {e}") from e
+                    _retries.inc(model=endpoint.label, error=type(e).__name__)
+                    logger.warning(f"[{endpoint.label}] LLM call failed ({type(e).__name__}: {e}). "
+                                   f"Retrying in {delay:.2f}s (attempt {attempt + 2}/{self.max_retries + 1}).")
+                else:
+                    endpoint.breaker.record_success()
+                    _calls.inc(model=endpoint.label, outcome="success")
+                    return result
+            time.sleep(delay)
+
+    def _timed_call(self, endpoint: _Endpoint, input: LanguageModelInput,
+                    config: Optional[RunnableConfig], kwargs: Dict[str, Any]) -> BaseMessage:
+        start = time.perf_counter()
+        with profile_scope():
+            result = endpoint.model.invoke(input, config, **kwargs)
+        elapsed = time.perf_counter() - start
+        endpoint.latency.record(elapsed)
+        _request_seconds.observe(elapsed, model=endpoint.label)
+        return result
+
+    def _submit(self, *args) -> Future:
+        # 复制调用方的 contextvars，让请求级别的上下文在线程池中依然可见
+        return _executor.submit(contextvars.copy_context().run, self._timed_call, *args)
+
+    def _hedged_call(self, endpoint: _Endpoint, input: LanguageModelInput,
+                     config: Optional[RunnableConfig], kwargs: Dict[str, Any]) -> BaseMessage:
+        primary = self._submit(endpoint, input, config, kwargs)
+        if not self.hedging:
+            return primary.result()
+        endpoint.hedge_budget.on_request()
+        done, _ = wait([primary], timeout=endpoint.hedge_delay())
+        if done:
+            return primary.result()
+        if not endpoint.hedge_budget.try_acquire():
+            _hedges.inc(model=endpoint.label, result="suppressed")
+            return primary.result()
+
+        _hedges.inc(model=endpoint.label, result="sent")
+        hedge = self._submit(endpoint, input, config, kwargs)
+        pending = {primary, hedge}
+        first_error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # 落后的请求无法从线程中取消，它会在底层超时内自然结束
+                    if future is hedge:
+                        _hedges.inc(model=endpoint.label, result="won")
+                    return future.result()
+                first_error = first_error or future.exception()
+        raise first_error
+
+
+def with_resilience(model: BaseChatModel, name: str) -> ResilientChatModel:
+    """用弹性层包装模型；设置了 LLM_FALLBACK_MODEL 时同时创建备用模型"""
+    fallback = None
+    if LLM_FALLBACK_MODEL:
+        from langchain_openai import ChatOpenAI
+
+        fallback_kwargs: Dict[str, Any] = {"model": LLM_FALLBACK_MODEL, "temperature": getattr(model, "temperature", None),
+                                           "timeout": LLM_REQUEST_TIMEOUT_S, "max_retries": 0}
+        if LLM_FALLBACK_BASE_URL:
+            fallback_kwargs["base_url"] = LLM_FALLBACK_BASE_URL
+        if LLM_FALLBACK_API_KEY:
+            fallback_kwargs["api_key"] = LLM_FALLBACK_API_KEY
+        fallback = ChatOpenAI(**fallback_kwargs)
+    return ResilientChatModel(model, name=name, fallback=fallback)
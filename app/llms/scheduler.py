@@ -0,0 +1,168 @@
+# app/llms/scheduler.py
+
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from app.core.metrics import metrics_registry
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+DEFAULT_TENANT = "default"
+
+# --- 配置 ---
+# 同时进行的 LLM 调用数上限 (每次尝试占一个名额，对冲请求不额外占用，重试前的退避等待不占用名额)；0 表示不排队
+LLM_SCHEDULER_CONCURRENCY = int(os.getenv("LLM_SCHEDULER_CONCURRENCY", "32"))
+# 租户权重，例如 "team-a=3,team-b=1"；未配置的租户权重为 1
+LLM_TENANT_WEIGHTS: Dict[str, float] = {
+    name.strip(): float(weight)
+    for name, _, weight in (item.partition("=") for item in os.getenv("LLM_TENANT_WEIGHTS", "").split(","))
+    if name.strip() and weight.strip()
+}
+# 防饿死：batch 调用排队超过该时间后提升到 interactive 之前
+LLM_SCHEDULER_MAX_WAIT_S = float(os.getenv("LLM_SCHEDULER_MAX_WAIT_S", "10"))
+
+_queue_wait = metrics_registry.histogram("llm_queue_wait_seconds", "Time LLM calls waited for a scheduler slot, by priority class")
+_queue_depth = metrics_registry.gauge("llm_queue_depth", "LLM calls waiting for a scheduler slot, by priority class")
+_dispatched = metrics_registry.counter("llm_scheduler_dispatched_total", "LLM calls admitted by the scheduler, by priority class")
+_promotions = metrics_registry.counter("llm_scheduler_promotions_total", "Batch LLM calls promoted ahead of interactive ones after waiting too long")
+_timeouts = metrics_registry.counter("llm_scheduler_timeouts_total", "LLM calls whose deadline passed while queued, by priority class")
+
+
+class QueueTimeoutError(TimeoutError):
+    """调用的 deadline 在排队等待名额期间到期"""
+
+
+class _Waiter:
+    __slots__ = ("priority", "tenant", "enqueued_at", "event", "granted", "cancelled")
+
+    def __init__(self, priority: str, tenant: str):
+        self.priority = priority
+        self.tenant = tenant
+        self.enqueued_at = time.monotonic()
+        self.event = threading.Event()
+        self.granted = False
+        self.cancelled = False
+
+
+class LLMScheduler:
+    """
+    LLM 调用的准入调度器，在并发名额用完时决定下一个调用：
+    - 优先级之间严格优先：有 interactive 调用在排队时不放行 batch 调用；
+    - 同一优先级内按租户加权公平排队 (start-time fair queuing)：每个调用的标签是
+      max(当前虚拟时间, 该租户上一个调用的结束标签) + 1/权重，标签最小的先放行，
+      因此一个租户的大量调用不会挤占其他租户，权重高的租户按比例得到更多名额；
+    - 防饿死：batch 调用排队超过 max_wait_s 后不再等待 interactive 队列清空。
+    调用方在自己的线程中阻塞等待 (节点和 LLM 调用都是同步的)。
+    """
+
+    def __init__(self, concurrency: int = LLM_SCHEDULER_CONCURRENCY, weights: Optional[Dict[str, float]] = None,
+                 max_wait_s: float = LLM_SCHEDULER_MAX_WAIT_S):
+        self.concurrency = concurrency
+        self.weights = weights if weights is not None else LLM_TENANT_WEIGHTS
+        self.max_wait_s = max_wait_s
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._queues: Dict[str, List[Tuple[float, int, _Waiter]]] = {p: [] for p in PRIORITIES}
+        self._virtual_time: Dict[str, float] = {p: 0.0 for p in PRIORITIES}
+        self._last_finish: Dict[str, Dict[str, float]] = {p: {} for p in PRIORITIES}
+        self._sequence = itertools.count()
+
+    @contextmanager
+    def slot(self, priority: str = INTERACTIVE, tenant: str = DEFAULT_TENANT, deadline: Optional[float] = None) -> Iterator[None]:
+        """占用一个调用名额；deadline (time.time() 时间戳) 在排队期间到期时抛出 QueueTimeoutError"""
+        if self.concurrency <= 0:
+            yield
+            return
+        priority = priority if priority in self._queues else INTERACTIVE
+        waiter = _Waiter(priority, tenant)
+        with self._lock:
+            self._enqueue(waiter)
+            self._dispatch()
+        if not waiter.granted:
+            timeout = max(0.0, deadline - time.time()) if deadline is not None else None
+            if not waiter.event.wait(timeout):
+                with self._lock:
+                    if not waiter.granted:
+                        waiter.cancelled = True
+                        _queue_depth.dec(priority=priority)
+                        _timeouts.inc(priority=priority)
+                        raise QueueTimeoutError(f"Deadline exceeded after waiting {time.monotonic() - waiter.enqueued_at:.2f}s "
+                                                f"for an LLM slot ({priority}).")
+        _queue_wait.observe(time.monotonic() - waiter.enqueued_at, priority=priority)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._dispatch()
+
+    def _enqueue(self, waiter: _Waiter) -> None:
+        priority, tenant = waiter.priority, waiter.tenant
+        start_tag = max(self._virtual_time[priority], self._last_finish[priority].get(tenant, 0.0))
+        finish_tag = start_tag + 1.0 / max(self.weights.get(tenant, 1.0), 1e-6)
+        self._last_finish[priority][tenant] = finish_tag
+        heapq.heappush(self._queues[priority], (start_tag, next(self._sequence), waiter))
+        _queue_depth.inc(priority=priority)
+
+    def _pop(self, priority: str) -> Optional[_Waiter]:
+        queue = self._queues[priority]
+        while queue:
+            start_tag, _, waiter = heapq.heappop(queue)
+            if not waiter.cancelled:
+                self._virtual_time[priority] = start_tag
+                return waiter
+        return None
+
+    def _promote_starved(self) -> Optional[_Waiter]:
+        """排队最久的 batch 调用等待超过 max_wait_s 时，让它越过 interactive 队列"""
+        queue = self._queues[BATCH]
+        live = [entry for entry in queue if not entry[2].cancelled]
+        if not live or not self._queues[INTERACTIVE]:
+            return None
+        oldest = min(live, key=lambda entry: entry[2].enqueued_at)
+        if time.monotonic() - oldest[2].enqueued_at < self.max_wait_s:
+            return None
+        queue.remove(oldest)
+        heapq.heapify(queue)
+        _promotions.inc()
+        return oldest[2]
+
+    def _dispatch(self) -> None:
+        while self._in_flight < self.concurrency:
+            waiter = self._promote_starved() or self._pop(INTERACTIVE) or self._pop(BATCH)
+            if waiter is None:
+                return
+            waiter.granted = True
+            self._in_flight += 1
+            _queue_depth.dec(priority=waiter.priority)
+            _dispatched.inc(priority=waiter.priority)
+            waiter.event.set()
+
+
+llm_scheduler = LLMScheduler()
+
+_current_class: contextvars.ContextVar[Tuple[str, str]] = contextvars.ContextVar("llm_priority_class", default=(INTERACTIVE, DEFAULT_TENANT))
+
+
+@contextmanager
+def llm_priority(priority: Optional[str], tenant: Optional[str]) -> Iterator[None]:
+    """在 with 块 (以及从中复制了上下文的线程) 内，LLM 调用按该优先级和租户排队"""
+    token = _current_class.set((priority or INTERACTIVE, tenant or DEFAULT_TENANT))
+    try:
+        yield
+    finally:
+        _current_class.reset(token)
+
+
+def current_priority() -> Tuple[str, str]:
+    return _current_class.get()
@@ -0,0 +1,167 @@
+# app/llms/usage.py
+
+import contextvars
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from langchain_core.messages import BaseMessage
+
+from app.core.metrics import metrics_registry
+
+_prompt_tokens = metrics_registry.counter("llm_prompt_tokens_total", "Prompt tokens sent, by agent")
+_cached_prompt_tokens = metrics_registry.counter(
+    "llm_cached_prompt_tokens_total", "Prompt tokens served from the provider's prefix cache, by agent"
+)
+_cache_hit_ratio = metrics_registry.gauge("llm_prompt_cache_hit_ratio", "Cached / total prompt tokens, by agent")
+
+logger = logging.getLogger(__name__)
+
+# --- 配置 ---
+# 每百万 token 的价格 (美元)，JSON 格式，按模型名配置，例如
+# {"gpt-4o": {"input": 2.5, "cached_input": 1.25, "output": 10}}；没有配置的模型不计算费用
+try:
+    LLM_PRICES_PER_1M: Dict[str, Dict[str, float]] = json.loads(os.getenv("LLM_PRICES_PER_1M", "{}"))
+except ValueError:
+    logger.error("LLM_PRICES_PER_1M is not valid JSON. Cost accounting is disabled.")
+    LLM_PRICES_PER_1M = {}
+
+
+def estimate_cost(model: Optional[str], prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> Optional[float]:
+    """按 LLM_PRICES_PER_1M 估算一次调用的费用 (美元)；模型没有配置价格时返回 None"""
+    prices = LLM_PRICES_PER_1M.get(model or "")
+    if not prices:
+        return None
+    input_price = prices.get("input", 0.0)
+    cached_price = prices.get("cached_input", input_price)
+    return ((prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+            + completion_tokens * prices.get("output", 0.0)) / 1_000_000
+
+
+class UsageMeter:
+    """累计一段代码内所有 LLM 调用消耗的 token (线程安全，可在对冲请求的线程中写入)"""
+
+    def __init__(self):
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cached_tokens = 0
+        self.calls = 0
+        # 每次调用的明细：agent、model、token 数和耗时
+        self.records: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    def add(self, input_tokens: int, output_tokens: int, cached_tokens: int = 0,
+            agent: Optional[str] = None, model: Optional[str] = None, latency_s: Optional[float] = None) -> None:
+        with self._lock:
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            self.cached_tokens += cached_tokens
+            self.calls += 1
+            self.records.append({
+                "agent": agent, "model": model, "prompt_tokens": input_tokens, "completion_tokens": output_tokens,
+                "cached_tokens": cached_tokens, "latency_s": round(latency_s, 6) if latency_s is not None else None,
+                "cost_usd": estimate_cost(model, input_tokens, output_tokens, cached_tokens),
+            })
+
+
+_current_meter: contextvars.ContextVar[Optional[UsageMeter]] = contextvars.ContextVar("llm_usage_meter", default=None)
+
+
+@contextmanager
+def track_usage() -> Iterator[UsageMeter]:
+    """在 with 块内统计 LLM 用量；ResilientChatModel 会把每次调用的 usage_metadata 记到当前的 meter 上"""
+    meter = UsageMeter()
+    token = _current_meter.set(meter)
+    try:
+        yield meter
+    finally:
+        _current_meter.reset(token)
+
+
+def cached_tokens_of(usage: dict) -> int:
+    """usage_metadata 中命中前缀缓存的输入 token 数 (OpenAI 的 prompt_tokens_details.cached_tokens)"""
+    return (usage.get("input_token_details") or {}).get("cache_read") or 0
+
+
+def cache_hit_ratio(agent: str) -> Optional[float]:
+    prompt_tokens = _prompt_tokens.value(agent=agent)
+    return _cached_prompt_tokens.value(agent=agent) / prompt_tokens if prompt_tokens else None
+
+
+def record_usage(message: BaseMessage, agent: Optional[str] = None, model: Optional[str] = None,
+                 latency_s: Optional[float] = None) -> None:
+    usage = getattr(message, "usage_metadata", None)
+    if not usage:
+        return
+    input_tokens = usage.get("input_tokens", 0)
+    cached_tokens = cached_tokens_of(usage)
+    if agent is not None and input_tokens:
+        _prompt_tokens.inc(input_tokens, agent=agent)
+        _cached_prompt_tokens.inc(cached_tokens, agent=agent)
+        _cache_hit_ratio.set(round(cache_hit_ratio(agent), 4), agent=agent)
+    meter = _current_meter.get()
+    if meter is not None:
+        meter.add(input_tokens, usage.get("output_tokens", 0), cached_tokens, agent=agent, model=model, latency_s=latency_s)
+
+
+# --- AgentState.usage 的结构与归约 ---
+# {"prompt_tokens", "completion_tokens", "cached_tokens", "total_tokens", "calls", "latency_s" (LLM 调用耗时之和),
+#  "cost_usd" (没有配置价格时为 None), "by_node": {节点: 同样的计数 + "wall_s" 节点耗时}, "by_model": {模型: 同样的计数}}
+USAGE_COUNTERS = ("prompt_tokens", "completion_tokens", "cached_tokens", "total_tokens", "calls", "latency_s", "cost_usd")
+
+
+def _add_counters(a: Optional[Dict[str, Any]], b: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    a, b = a or {}, b or {}
+    merged: Dict[str, Any] = {}
+    for key in dict.fromkeys([*USAGE_COUNTERS, *a, *b]):
+        if key in ("by_node", "by_model"):
+            continue
+        values = [v for v in (a.get(key), b.get(key)) if v is not None]
+        if key == "cost_usd":
+            merged[key] = round(sum(values), 8) if values else None
+        else:
+            merged[key] = round(sum(values), 6) if isinstance(sum(values), float) else sum(values)
+    return merged
+
+
+def merge_usage(a: Optional[Dict[str, Any]], b: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """AgentState.usage 的归约函数：总数、按节点、按模型分别累加"""
+    if not b:
+        return a or {}
+    if not a:
+        return b
+    merged = _add_counters(a, b)
+    for group in ("by_node", "by_model"):
+        combined = dict(a.get(group) or {})
+        for name, counters in (b.get(group) or {}).items():
+            combined[name] = _add_counters(combined.get(name), counters)
+        merged[group] = combined
+    return merged
+
+
+def usage_delta(node: str, meter: UsageMeter, wall_s: float) -> Dict[str, Any]:
+    """把一个节点内的调用明细汇总为 AgentState.usage 的增量"""
+    totals = _add_counters({}, {})
+    by_model: Dict[str, Dict[str, Any]] = {}
+    for record in meter.records:
+        counters = {
+            "prompt_tokens": record["prompt_tokens"], "completion_tokens": record["completion_tokens"],
+            "cached_tokens": record["cached_tokens"], "total_tokens": record["prompt_tokens"] + record["completion_tokens"],
+            "calls": 1, "latency_s": record["latency_s"] or 0.0, "cost_usd": record["cost_usd"],
+        }
+        totals = _add_counters(totals, counters)
+        model = record["model"] or "unknown"
+        by_model[model] = _add_counters(by_model.get(model), counters)
+    return {**totals, "by_node": {node: {**totals, "wall_s": round(wall_s, 6)}}, "by_model": by_model}
+
+
+def usage_summary(usage: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """事件中附带的会话累计用量 (不含按节点/模型的明细)"""
+    return _add_counters({key: (usage or {}).get(key) for key in USAGE_COUNTERS}, {})
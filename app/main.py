@@ -34,6 +34,7 @@ app.add_middleware(
     allow_credentials=True, # 允许发送 cookie
     allow_methods=["*"], # 允许所有 HTTP 方法 (GET, POST, OPTIONS, etc.)
     allow_headers=["*"], # 允许所有请求头
+    expose_headers=["X-Session-Id"], # 让浏览器端脚本能读到流式接口返回的会话 ID
 )
 # --- CORS 中间件结束 ---
 
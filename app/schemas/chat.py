@@ -1,16 +1,26 @@
 # app/schemas/chat.py
 
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from pydantic import BaseModel, Field
+from typing import Literal, Optional, Dict, Any
 
 class ChatRequest(BaseModel):
     message: str
+    # 传入上一轮返回的 session_id 即可在同一会话中继续 (复用计划和已完成的结果)；不传则开始新会话
+    session_id: Optional[str] = Field(default=None, min_length=1, max_length=128, description="Continue an existing session")
+    # 可选的会话预算：超出前系统会逐步缩减评估和修订，最终给出尽力而为的答案
+    time_budget_s: Optional[float] = Field(default=None, gt=0, description="Wall-clock budget for the whole session, in seconds")
+    token_budget: Optional[int] = Field(default=None, gt=0, description="Total LLM token budget for the session")
+    # LLM 调用的调度类别：interactive 严格优先于 batch；同一类别内按租户加权公平排队 (见 app/llms/scheduler.py)。
+    # tenant 同时是会话的所有者：继续一个会话时必须与创建它的请求相同
+    priority: Literal["interactive", "batch"] = Field(default="interactive", description="Scheduling class for the session's LLM calls")
+    tenant: Optional[str] = Field(default=None, min_length=1, max_length=64, description="Tenant used for fair sharing of LLM capacity; also owns the session")
 
 class StreamEvent(BaseModel):
     """
     Represents a single event to be streamed to the client.
     """
-    event_type: str  # e.g., "node_update", "final_answer", "error"
+    event_type: str  # e.g., "session", "node_update", "final_answer", "error"
     node: Optional[str] = None # Which node just executed (for node_update)
     data: Dict[str, Any] # The state or relevant data for the event
     message: Optional[str] = None # A human-readable message for the event
+    usage: Optional[Dict[str, Any]] = None # Cumulative session token/latency/cost totals (node_update, final_answer)
@@ -1,21 +1,33 @@
 # app/services/chat_service.py
 
-import json
-from typing import AsyncGenerator, Dict, Any
+import uuid
+from typing import AsyncGenerator, Dict, Any, Optional
 from langchain_core.messages import HumanMessage
 
 from app.schemas.chat import ChatRequest, StreamEvent
 from app.langgraph_core.graphs.main_graph import main_app_graph
 from app.langgraph_core.state.graph_state import AgentState
+from app.langgraph_core.state.blob_store import state_size_bytes
+from app.langgraph_core.memory.duration_store import schedule_report
+from app.langgraph_core.tools.python_repl import release_session_interpreter
+from app.langgraph_core.utils.budget import SESSION_TOKEN_CEILING, init_budget_state
+from app.core.metrics import metrics_registry
+from app.core.profiler import profile_scope, profile_session
+from app.llms.scheduler import llm_priority
+from app.core.usage_log import usage_log
+from app.llms.cassette import get_cassette
+from app.llms.usage import merge_usage, usage_summary
+from app.services.event_encoder import EventEncoder
+from app.services.session_store import SessionAccessError, session_store
 
+_state_bytes = metrics_registry.histogram("graph_state_bytes", "Approximate size of the full graph state after each step, by node")
 
-async def stream_langgraph_response(request: ChatRequest) -> AsyncGenerator[str, None]:
-    """
-    Streams the execution state of the LangGraph workflow.
-    Yields events in Server-Sent Events (SSE) format.
-    """
-    initial_state: AgentState = {
-        "messages": [HumanMessage(content=request.message)],
+
+def _build_initial_state(request: ChatRequest, session_id: str, previous: Optional[Dict[str, Any]]) -> AgentState:
+    """新会话从零开始；追加请求在上一轮的最终状态上继续 (消息历史、计划和已完成的结果)"""
+    message = HumanMessage(content=request.message)
+    state: AgentState = {
+        "messages": [message],
         "current_agent_role": None, # <--- 第一次调用时，让它为 None，由 supervisor_agent 来设置下一个角色
         "current_request": None,
         "overall_plan": None,
@@ -25,57 +37,183 @@ async def stream_langgraph_response(request: ChatRequest) -> AsyncGenerator[str,
         "plan_revision_count": 0,  # 初始化计划修订计数器
         "task_revision_count": 0,  # 初始化任务修订计数器
         "tool_calls": None,
-        "tool_output": None
+        "tool_output": None,
+        "session_id": session_id,
+        "tenant": request.tenant,
+        "turn": 1,
+        "previous_requests": None,
+        "amendment_stats": None,
+        "usage": {},
+        **init_budget_state(request.time_budget_s, request.token_budget),
     }
+    if previous:
+        # 用量按会话累计，会话 token 上限覆盖所有轮次
+        session_usage = previous.get("usage") or {}
+        state.update(init_budget_state(request.time_budget_s, request.token_budget,
+                                       session_tokens_used=session_usage.get("total_tokens", 0)))
+        previous_requests = list(previous.get("previous_requests") or [])
+        if previous.get("current_request"):
+            previous_requests.append(previous["current_request"])
+        state.update({
+            "messages": [*previous.get("messages", []), message],
+            "overall_plan": previous.get("overall_plan"),
+            "turn": previous.get("turn", 1) + 1,
+            "previous_requests": previous_requests,
+            "usage": session_usage,
+        })
+    return state
 
-    try:
-        # Use astream() for asynchronous streaming
-        async for state_update in main_app_graph.astream(initial_state):
-            # 打印完整的状态更新，便于调试
-            print(f"LangGraph Stream Update: {state_update}")
-
-            # 提取节点名称和更新后的当前状态
-            # LangGraph 的 astream 会返回 {node_name: state_after_node_execution}
-            # 或者在图结束时返回 {__end__: final_state}
-            node_name = list(state_update.keys())[0]
-            current_state = state_update[node_name]  # 获取该节点执行后的完整状态
-
-            event = StreamEvent(
-                event_type="node_update",
-                node=node_name,
-                data=current_state,
-                message=f"Node '{node_name}' executed."
-            )
-            yield f"data: {event.model_dump_json()}\n\n"
 
-            final_state = current_state  # 持续跟踪最终状态
+async def stream_langgraph_response(request: ChatRequest, encoder: Optional[EventEncoder] = None,
+                                    profile: bool = False) -> AsyncGenerator[bytes, None]:
+    """
+    Streams the execution state of the LangGraph workflow.
+    Yields events in Server-Sent Events (SSE) format, encoded (and optionally compressed) by `encoder`.
+    Requests carrying a known session_id continue that session (plan and results are reused).
+    With `profile` set, the session runs under the sampling profiler and a final "profile" event
+    reports per-node wall/CPU time and the flame-graph files written under logs/.
+    """
+    encoder = encoder or EventEncoder()
+    # 会话 ID 通过 config 传递给节点和工具 (例如 python_repl 的会话绑定解释器)；未指定时每次请求一个新会话
+    session_id = request.session_id or uuid.uuid4().hex
+    # 本会话 (包括图节点所在的线程) 的 LLM 调用按请求的优先级和租户排队
+    with llm_priority(request.priority, request.tenant):
+        if not profile:
+            async for chunk in _stream_session(request, encoder, session_id):
+                yield chunk
+        else:
+            with profile_session(session_id) as session_profile:
+                async for chunk in _stream_session(request, encoder, session_id):
+                    yield chunk
+            files_prefix = session_profile.write()
+            yield encoder.encode(StreamEvent(
+                event_type="profile",
+                data={**session_profile.summary(), "files_prefix": files_prefix},
+                message=f"Profile written to {files_prefix}.*"
+            ))
+    # 压缩流需要写入结尾 (gzip 尾部)；未压缩时为空
+    tail = encoder.close()
+    if tail:
+        yield tail
 
-        # 循环结束后，输出最终答案
-        if final_state and final_state.get("messages"):
-            final_llm_message = final_state["messages"][-1]
-            final_answer_content = final_llm_message.content
 
-            final_event = StreamEvent(
-                event_type="final_answer",
-                data={"final_message": final_llm_message.dict()},
-                message=final_answer_content
-            )
-            yield f"data: {final_event.model_dump_json()}\n\n"
-        else:
+async def _stream_session(request: ChatRequest, encoder: EventEncoder, session_id: str) -> AsyncGenerator[bytes, None]:
+    config = {"configurable": {"session_id": session_id}}
+
+    async with session_store.lock(session_id):
+        try:
+            # 会话归创建它的租户所有，其他租户即使知道 session_id 也不能读取或继续它
+            previous = session_store.get(session_id, owner=request.tenant)
+        except SessionAccessError:
+            yield encoder.encode(StreamEvent(
+                event_type="error",
+                data={"session_id": session_id},
+                message=f"Session '{session_id}' cannot be continued by this tenant."
+            ))
+            return
+        session_store.record_turn(previous is not None)
+        cassette = get_cassette()
+        if cassette is not None:
+            # 录制模式下同时记下会话请求，之后可以离线回放整个会话
+            cassette.record_request(session_id, request.model_dump(exclude_none=True, exclude={"session_id"}))
+        initial_state = _build_initial_state(request, session_id, previous)
+        yield encoder.encode(StreamEvent(
+            event_type="session",
+            data={"session_id": session_id, "turn": initial_state["turn"], "resumed": previous is not None},
+            message=f"Session '{session_id}' turn {initial_state['turn']}."
+        ))
+
+        final_state = None
+        final_values = None
+        usage_totals = initial_state["usage"]
+        node_name = None
+        state_sizes = [] # 每一步之后完整状态的大小，随最终答案返回
+        try:
+            # updates 用于逐节点推送事件，values 保留每一步之后的完整状态，结束后存入会话
+            graph_stream = main_app_graph.astream(initial_state, config=config, stream_mode=["updates", "values"])
+            async for mode, chunk in graph_stream:
+                if mode == "values":
+                    final_values = chunk
+                    if node_name is not None:
+                        size = state_size_bytes(chunk)
+                        _state_bytes.observe(size, node=node_name)
+                        state_sizes.append({"node": node_name, "bytes": size})
+                    continue
+                # 事件的构造和编码在事件循环上同步执行，被分析的会话中计入 "stream"
+                with profile_scope("stream"):
+                    # 打印完整的状态更新，便于调试
+                    print(f"LangGraph Stream Update: {chunk}")
+
+                    # 提取节点名称和该节点返回的状态更新
+                    node_name = list(chunk.keys())[0]
+                    current_state = chunk[node_name]
+                    usage_totals = merge_usage(usage_totals, (current_state or {}).get("usage"))
+
+                    event = StreamEvent(
+                        event_type="node_update",
+                        node=node_name,
+                        data=current_state,
+                        message=f"Node '{node_name}' executed.",
+                        usage=usage_summary(usage_totals)
+                    )
+                    encoded = encoder.encode(event)
+                yield encoded
+
+                final_state = current_state  # 持续跟踪最终状态
+
+                if (SESSION_TOKEN_CEILING is not None and usage_totals.get("total_tokens", 0) > SESSION_TOKEN_CEILING
+                        and (current_state or {}).get("current_agent_role") != "end_process"):
+                    # 预算降级没能让会话停在上限以内：中止图的执行，不再发起新的 LLM 调用
+                    # (已经生成的最终报告仍然照常返回)
+                    await graph_stream.aclose()
+                    final_state = None
+                    break
+
+            # 循环结束后，输出最终答案
+            if final_state and final_state.get("messages"):
+                final_llm_message = final_state["messages"][-1]
+                final_answer_content = final_llm_message.content
+                if final_values is not None:
+                    session_store.save(session_id, final_values, owner=request.tenant)
+
+                final_event = StreamEvent(
+                    event_type="final_answer",
+                    data={
+                        "final_message": final_llm_message,
+                        "session_id": session_id,
+                        "amendment_stats": (final_values or {}).get("amendment_stats"),
+                        "state_bytes": state_sizes,
+                        # 子任务的预计耗时与实际耗时对比
+                        "schedule": schedule_report((final_values or {}).get("overall_plan"), (final_values or {}).get("task_schedule")),
+                    },
+                    message=final_answer_content,
+                    usage=usage_summary(usage_totals)
+                )
+                yield encoder.encode(final_event)
+            elif final_state is None and SESSION_TOKEN_CEILING is not None and usage_totals.get("total_tokens", 0) > SESSION_TOKEN_CEILING:
+                yield encoder.encode(StreamEvent(
+                    event_type="error",
+                    data={"session_id": session_id},
+                    message=f"Session token ceiling exceeded ({usage_totals['total_tokens']} > {SESSION_TOKEN_CEILING} tokens).",
+                    usage=usage_summary(usage_totals)
+                ))
+            else:
+                error_event = StreamEvent(
+                    event_type="error",
+                    data={},
+                    message="No final message found in LangGraph state."
+                )
+                yield encoder.encode(error_event)
+
+        except Exception as e:
+            # 打印实际的异常类型和信息，这将提供关键的调试线索
+            print(f"Error during LangGraph streaming: {type(e).__name__}: {e}")
             error_event = StreamEvent(
                 event_type="error",
-                data={},
-                message="No final message found in LangGraph state."
+                data={"error_details": f"{type(e).__name__}: {e}"},
+                message=f"An error occurred during processing: {type(e).__name__}: {e}"
             )
-            yield f"data: {error_event.model_dump_json()}\n\n"
-
-    except Exception as e:
-        # 打印实际的异常类型和信息，这将提供关键的调试线索
-        print(f"Error during LangGraph streaming: {type(e).__name__}: {e}")
-        error_event = StreamEvent(
-            event_type="error",
-            data={"error_details": f"{type(e).__name__}: {e}"},
-            message=f"An error occurred during processing: {type(e).__name__}: {e}"
-        )
-        yield f"data: {error_event.model_dump_json()}\n\n"
-
+            yield encoder.encode(error_event)
+        finally:
+            release_session_interpreter(session_id)
+            usage_log.write({"type": "session", "session_id": session_id, "turn": initial_state["turn"], **usage_totals})
@@ -0,0 +1,145 @@
+# app/services/event_encoder.py
+
+import logging
+import os
+import zlib
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import pydantic_core
+from pydantic import BaseModel
+
+from app.schemas.chat import StreamEvent
+
+try:
+    import orjson
+except ImportError:  # orjson 是可选依赖，没有安装时退回 pydantic_core 的 Rust 序列化器
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# --- 配置 ---
+# 是否允许按请求头协商压缩 SSE 流 (客户端没有声明 Accept-Encoding 时始终不压缩)
+SSE_COMPRESSION_ENABLED = os.getenv("SSE_COMPRESSION", "true").lower() == "true"
+SSE_COMPRESSION_LEVEL = int(os.getenv("SSE_COMPRESSION_LEVEL", "6"))
+
+# 服务端支持的编码及对应的 zlib wbits (gzip 头 / zlib 头)
+_WBITS = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+_SERVER_PREFERENCE = ("gzip", "deflate")
+
+# 按类型预先取出的序列化函数，避免每个事件都走一遍通用的类型探测
+_serializers: Dict[type, Callable[[Any], Any]] = {}
+
+
+def _serializer_for(cls: type) -> Optional[Callable[[Any], Any]]:
+    serializer = _serializers.get(cls)
+    if serializer is None and issubclass(cls, BaseModel):
+        # LangChain 消息等 pydantic 模型：直接使用该类已经编译好的 SchemaSerializer
+        schema_serializer = cls.__pydantic_serializer__
+        serializer = _serializers[cls] = lambda obj: schema_serializer.to_python(obj, mode="json")
+    return serializer
+
+
+def _default(obj: Any) -> Any:
+    serializer = _serializer_for(type(obj))
+    if serializer is not None:
+        return serializer(obj)
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    return str(obj)
+
+
+if orjson is not None:
+    def dumps(obj: Any) -> bytes:
+        # orjson 原生支持 dict 子类 (IndexedPlan)，只有消息等对象才会走 _default
+        return orjson.dumps(obj, default=_default)
+else:
+    def dumps(obj: Any) -> bytes:
+        return pydantic_core.to_json(obj, fallback=_default, serialize_as_any=True)
+
+
+def serialize_event(event: StreamEvent) -> bytes:
+    """序列化 StreamEvent，输出与 model_dump_json() 的结构一致"""
+    return dumps({"event_type": event.event_type, "node": event.node, "data": event.data, "message": event.message,
+                  "usage": event.usage})
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """根据 Accept-Encoding 选择 gzip/deflate (按 q 值，相同时优先 gzip)；不支持时返回 None"""
+    if not SSE_COMPRESSION_ENABLED or not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+    candidates: Tuple[Tuple[float, int, str], ...] = tuple(
+        (weights.get(name, weights.get("*", 0.0)), -rank, name) for rank, name in enumerate(_SERVER_PREFERENCE)
+    )
+    q, _, name = max(candidates)
+    return name if q > 0 else None
+
+
+class EventEncoder:
+    """
+    把 StreamEvent 编码成 SSE 帧。
+    启用压缩时整个响应是一个连续的 gzip/deflate 流，每个事件之后做一次 Z_SYNC_FLUSH，
+    客户端可以立刻解出完整的事件，同时后续事件还能复用前面事件的压缩字典。
+    """
+
+    def __init__(self, encoding: Optional[str] = None):
+        self.encoding = encoding
+        self._compressor = zlib.compressobj(SSE_COMPRESSION_LEVEL, zlib.DEFLATED, _WBITS[encoding]) if encoding else None
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Vary": "Accept-Encoding"}
+        if self.encoding:
+            headers["Content-Encoding"] = self.encoding
+        return headers
+
+    def encode(self, event: StreamEvent) -> bytes:
+        frame = b"data: " + serialize_event(event) + b"\n\n"
+        if self._compressor is None:
+            return frame
+        return self._compressor.compress(frame) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def close(self) -> bytes:
+        """结束压缩流 (写入 gzip 尾部)；未压缩时为空"""
+        if self._compressor is None:
+            return b""
+        compressor, self._compressor = self._compressor, None
+        return compressor.flush(zlib.Z_FINISH)
+
+
+class WebSocketEventEncoder(EventEncoder):
+    """
+    WebSocket 多路复用连接上单个会话的编码器：每个 StreamEvent 编码为一条带会话 ID 和序号的 JSON 帧，
+    {"type": "event", "session_id": ..., "seq": n, "event": {...}}，event 部分与 SSE 的 data 完全相同。
+    序号在会话内从 1 递增，客户端据此确认 (流量控制) 和断线后续传。
+    压缩交给 WebSocket 的 permessage-deflate 扩展，这里不再压缩。
+    """
+
+    def __init__(self, session_id: str):
+        super().__init__(None)
+        self.session_id = session_id
+        self.seq = 0
+        self._prefix = b'"session_id":' + dumps(session_id) + b',"seq":'
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {}
+
+    def encode(self, event: StreamEvent) -> bytes:
+        self.seq += 1
+        return b'{"type":"event",' + self._prefix + str(self.seq).encode() + b',"event":' + serialize_event(event) + b"}"
+
+    def control(self, frame_type: str, **data: Any) -> bytes:
+        """会话内的控制帧 (例如 end)，与事件共用序号，断线续传时按顺序重发"""
+        self.seq += 1
+        return dumps({"type": frame_type, "session_id": self.session_id, "seq": self.seq, **data})
@@ -0,0 +1,88 @@
+# app/services/session_store.py
+
+import asyncio
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.metrics import metrics_registry
+
+logger = logging.getLogger(__name__)
+
+# --- 配置 ---
+SESSION_TTL_S = float(os.getenv("SESSION_TTL_S", "3600"))  # 会话最后一次使用后保留的时间
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "1000"))  # 超出后按最近最少使用淘汰
+
+_sessions_gauge = metrics_registry.gauge("sessions_active", "Sessions currently held in the session store")
+_turns = metrics_registry.counter("session_turns_total", "Chat turns by kind (new/follow_up)")
+_rejected = metrics_registry.counter("session_access_rejected_total", "Follow-up requests rejected because the session belongs to another owner")
+
+
+class SessionAccessError(PermissionError):
+    """请求的会话属于另一个所有者 (租户)"""
+
+
+class SessionStore:
+    """
+    进程内的会话状态存储：保存每个会话最后一轮结束时的 AgentState，供后续请求继续使用。
+    每个会话记录创建它的所有者 (请求的 tenant)，只有同一所有者的请求才能读取和继续它。
+    带 TTL 和 LRU 上限；同一会话的并发请求通过 lock() 串行执行。
+    """
+
+    def __init__(self, ttl_s: float = SESSION_TTL_S, max_count: int = SESSION_MAX_COUNT):
+        self.ttl_s = ttl_s
+        self.max_count = max_count
+        self._items: "OrderedDict[str, Tuple[float, Optional[str], Dict[str, Any]]]" = OrderedDict()
+        self._guard = threading.Lock()
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def get(self, session_id: str, owner: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """返回会话最后保存的状态；会话属于其他所有者时抛出 SessionAccessError"""
+        with self._guard:
+            item = self._items.get(session_id)
+            if item is None:
+                return None
+            saved_at, session_owner, state = item
+            if time.time() - saved_at > self.ttl_s:
+                del self._items[session_id]
+                _sessions_gauge.set(len(self._items))
+                return None
+            if session_owner != owner:
+                _rejected.inc()
+                raise SessionAccessError(f"Session '{session_id}' belongs to another owner.")
+            self._items.move_to_end(session_id)
+            return state
+
+    def save(self, session_id: str, state: Dict[str, Any], owner: Optional[str] = None) -> None:
+        with self._guard:
+            self._items[session_id] = (time.time(), owner, state)
+            self._items.move_to_end(session_id)
+            while len(self._items) > self.max_count:
+                evicted, _ = self._items.popitem(last=False)
+                logger.info(f"Session '{evicted}' evicted from the session store (LRU).")
+            _sessions_gauge.set(len(self._items))
+
+    def delete(self, session_id: str) -> None:
+        with self._guard:
+            self._items.pop(session_id, None)
+            _sessions_gauge.set(len(self._items))
+
+    def lock(self, session_id: str) -> asyncio.Lock:
+        """同一会话的请求按顺序执行，避免两轮对话同时基于同一个旧状态"""
+        with self._guard:
+            lock = self._locks.get(session_id)
+            if lock is None:
+                lock = asyncio.Lock()
+                self._locks[session_id] = lock
+            return lock
+
+    @staticmethod
+    def record_turn(follow_up: bool) -> None:
+        _turns.inc(kind="follow_up" if follow_up else "new")
+
+
+session_store = SessionStore()
@@ -0,0 +1,265 @@
+# app/services/ws_multiplexer.py
+
+import asyncio
+import hmac
+import json
+import logging
+import os
+import secrets
+import uuid
+from collections import deque
+from contextlib import aclosing
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from fastapi import WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
+
+from app.core.metrics import metrics_registry
+from app.core.profiler import profiling_requested
+from app.schemas.chat import ChatRequest
+from app.services.chat_service import stream_langgraph_response
+from app.services.event_encoder import WebSocketEventEncoder, dumps
+
+logger = logging.getLogger(__name__)
+
+# --- 配置 ---
+# 每个会话最多缓存的未确认帧数 (流量控制窗口)：客户端读得慢时会话暂停产生事件，而不是在服务端无限堆积
+WS_SESSION_WINDOW = int(os.getenv("WS_SESSION_WINDOW", "64"))
+WS_MAX_SESSIONS_PER_CONNECTION = int(os.getenv("WS_MAX_SESSIONS_PER_CONNECTION", "256"))
+# 连接断开后会话保留的时间，期间可以在新连接上用 resume 续传；超时后取消会话
+WS_RESUME_GRACE_S = float(os.getenv("WS_RESUME_GRACE_S", "60"))
+
+_connections = metrics_registry.gauge("ws_connections_active", "Open multiplexed WebSocket connections")
+_sessions = metrics_registry.counter("ws_sessions_total", "Sessions run over WebSocket connections, by outcome")
+_frames_sent = metrics_registry.counter("ws_frames_sent_total", "Frames sent over WebSocket connections")
+_flow_waits = metrics_registry.counter("ws_flow_control_waits_total", "Times a session paused because its window of unacknowledged frames was full")
+_resumes = metrics_registry.counter("ws_resumes_total", "Resume requests, by outcome")
+
+# 所有连接上尚未结束的会话流，按 session_id 索引，断线后可以在另一个连接上续传
+_streams: Dict[str, "SessionStream"] = {}
+
+
+def _sequence_number(message: Dict[str, Any], key: str) -> Optional[int]:
+    """客户端发来的帧序号；缺失时为 0，不是非负整数时返回 None"""
+    value = message.get(key) or 0
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        return None
+    return value
+
+
+class SessionStream:
+    """
+    一个会话在 WebSocket 上的事件流。后台任务运行 stream_langgraph_response，产生的帧在客户端确认 (ack) 之前
+    都保留在 frames 中：窗口满时暂停读取图的事件 (背压传递到图的执行)，断线重连时从这里重发。
+    """
+
+    def __init__(self, request: ChatRequest, profile: bool, connection: "MultiplexedConnection", resume_token: str):
+        self.session_id = request.session_id
+        # 只发给开始会话的连接；续传时必须出示，知道 session_id 的其他客户端无法接管这个流
+        self.resume_token = resume_token
+        self.encoder = WebSocketEventEncoder(self.session_id)
+        self.frames: Deque[Tuple[int, bytes]] = deque()
+        self.finished = False
+        self.connection: Optional["MultiplexedConnection"] = connection
+        self._space = asyncio.Event()
+        self._space.set()
+        self._send_lock = asyncio.Lock()
+        self._expiry: Optional[asyncio.TimerHandle] = None
+        self.task = asyncio.create_task(self._produce(request, profile))
+
+    async def _produce(self, request: ChatRequest, profile: bool) -> None:
+        outcome = "completed"
+        try:
+            # 取消时立即关闭生成器，释放会话锁和会话绑定的解释器，而不是等到垃圾回收
+            async with aclosing(stream_langgraph_response(request, self.encoder, profile=profile)) as frames:
+                async for frame in frames:
+                    await self._push(frame)
+            await self._push(self.encoder.control("end"))
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            outcome = "failed"
+            logger.error(f"WebSocket stream for session '{self.session_id}' failed: {type(e).__name__}: {e}", exc_info=True)
+        finally:
+            self.finished = True
+            _sessions.inc(outcome=outcome)
+            self._release_if_done()
+
+    async def _push(self, frame: bytes) -> None:
+        if len(self.frames) >= WS_SESSION_WINDOW:
+            _flow_waits.inc()
+        while len(self.frames) >= WS_SESSION_WINDOW:
+            self._space.clear()
+            await self._space.wait()
+        async with self._send_lock:
+            self.frames.append((self.encoder.seq, frame))
+            if self.connection is not None:
+                await self.connection.send(frame)
+
+    def ack(self, seq: int) -> None:
+        """客户端确认收到 seq 及之前的帧：释放这部分缓冲，窗口有空位时会话继续"""
+        while self.frames and self.frames[0][0] <= seq:
+            self.frames.popleft()
+        self._space.set()
+        self._release_if_done()
+
+    async def attach(self, connection: "MultiplexedConnection", last_seq: int) -> None:
+        """把会话绑定到 (新的) 连接上，并重发 last_seq 之后尚未确认的帧"""
+        if self._expiry is not None:
+            self._expiry.cancel()
+            self._expiry = None
+        previous = self.connection
+        if previous is not None and previous is not connection:
+            previous.streams.pop(self.session_id, None)
+        self.ack(last_seq)
+        async with self._send_lock:
+            self.connection = connection
+            connection.streams[self.session_id] = self
+            for _, frame in list(self.frames):
+                await connection.send(frame)
+
+    def detach(self, connection: "MultiplexedConnection") -> None:
+        """连接断开：帧继续留在缓冲区 (窗口满后会话暂停)，WS_RESUME_GRACE_S 内没有续传则取消会话"""
+        if self.connection is not connection:
+            return
+        self.connection = None
+        if not self.finished:
+            self._expiry = asyncio.get_running_loop().call_later(WS_RESUME_GRACE_S, self._expire)
+        else:
+            self._expiry = asyncio.get_running_loop().call_later(WS_RESUME_GRACE_S, self._forget)
+
+    def _expire(self) -> None:
+        if self.connection is None:
+            logger.info(f"Session '{self.session_id}' was not resumed within {WS_RESUME_GRACE_S}s; cancelling it.")
+            self.cancel()
+
+    def cancel(self) -> None:
+        self.task.cancel()
+        self._forget()
+
+    def _forget(self) -> None:
+        if _streams.get(self.session_id) is self:
+            del _streams[self.session_id]
+        if self.connection is not None:
+            self.connection.streams.pop(self.session_id, None)
+
+    def _release_if_done(self) -> None:
+        # 会话结束且所有帧 (包括 end) 都已确认后不再需要续传
+        if self.finished and not self.frames:
+            self._forget()
+
+
+class MultiplexedConnection:
+    """
+    一个 WebSocket 连接上的多个会话。客户端发送的 JSON 消息：
+    - {"type": "start", "id": <客户端标记>, "request": {ChatRequest 字段}, "profile": <可选>}：开始一个会话，
+      服务端先回复 {"type": "started", "id": ..., "session_id": ..., "resume_token": ...}，之后是该会话的 event 帧，最后是 end 帧；
+    - {"type": "ack", "session_id": ..., "seq": n}：确认收到 n 及之前的帧，每个会话最多有 WS_SESSION_WINDOW 个未确认帧；
+    - {"type": "cancel", "session_id": ...}：取消会话，回复 cancelled；
+    - {"type": "resume", "session_id": ..., "last_seq": n, "resume_token": ...}：断线重连后 (可以是新连接) 续传 n 之后的帧，
+      resume_token 必须与 started 帧中的相同。
+    出错时回复 {"type": "error", "id"/"session_id": ..., "message": ...}。
+    """
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.streams: Dict[str, SessionStream] = {}
+        self.closed = False
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, frame: bytes) -> None:
+        if self.closed:
+            return
+        try:
+            async with self._send_lock:
+                await self.websocket.send_text(frame.decode("utf-8"))
+            _frames_sent.inc()
+        except Exception:
+            # 连接已经断开：之后的帧留在各会话的缓冲区里，等待 resume
+            self.closed = True
+
+    async def send_control(self, frame_type: str, **data: Any) -> None:
+        await self.send(dumps({"type": frame_type, **data}))
+
+    async def run(self) -> None:
+        _connections.inc()
+        try:
+            while True:
+                await self._handle(await self.websocket.receive_text())
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self.closed = True
+            _connections.dec()
+            for stream in list(self.streams.values()):
+                stream.detach(self)
+
+    async def _handle(self, text: str) -> None:
+        try:
+            message = json.loads(text)
+            kind = message.get("type")
+        except (ValueError, AttributeError):
+            await self.send_control("error", message="Malformed message: expected a JSON object.")
+            return
+        if kind == "start":
+            await self._start(message)
+            return
+        session_id = message.get("session_id")
+        if kind == "ack":
+            seq = _sequence_number(message, "seq")
+            if seq is None:
+                await self.send_control("error", session_id=session_id, message="'seq' must be a non-negative integer.")
+                return
+            stream = self.streams.get(session_id)
+            if stream is not None:
+                stream.ack(seq)
+        elif kind == "cancel":
+            stream = self.streams.get(session_id)
+            if stream is None:
+                await self.send_control("error", session_id=session_id, message="No active session with this id on the connection.")
+                return
+            stream.cancel()
+            await self.send_control("cancelled", session_id=session_id)
+        elif kind == "resume":
+            last_seq = _sequence_number(message, "last_seq")
+            if last_seq is None:
+                await self.send_control("error", session_id=session_id, message="'last_seq' must be a non-negative integer.")
+                return
+            stream = _streams.get(session_id)
+            token = message.get("resume_token")
+            # 未知会话和令牌不符返回同样的错误，不泄露会话是否存在
+            if stream is None or not isinstance(token, str) or not hmac.compare_digest(token, stream.resume_token):
+                _resumes.inc(outcome="unknown" if stream is None else "rejected")
+                await self.send_control("error", session_id=session_id, message="Session cannot be resumed (finished, expired, unknown or wrong resume_token).")
+                return
+            _resumes.inc(outcome="resumed")
+            await stream.attach(self, last_seq)
+        else:
+            await self.send_control("error", message=f"Unknown message type '{kind}'.")
+
+    async def _start(self, message: Dict[str, Any]) -> None:
+        client_id = message.get("id")
+        if len(self.streams) >= WS_MAX_SESSIONS_PER_CONNECTION:
+            await self.send_control("error", id=client_id,
+                                    message=f"Too many concurrent sessions on this connection (limit {WS_MAX_SESSIONS_PER_CONNECTION}).")
+            return
+        try:
+            request = ChatRequest(**(message.get("request") or {}))
+        except (ValidationError, TypeError) as e:
+            await self.send_control("error", id=client_id, message=f"Invalid request: {e}")
+            return
+        if not request.session_id:
+            request = request.model_copy(update={"session_id": uuid.uuid4().hex})
+        existing = _streams.get(request.session_id)
+        if existing is not None and not existing.finished:
+            await self.send_control("error", id=client_id, session_id=request.session_id,
+                                    message="Session already has a turn in progress; resume it or wait for it to end.")
+            return
+        if existing is not None:
+            existing._forget()
+        resume_token = secrets.token_urlsafe(24)
+        await self.send_control("started", id=client_id, session_id=request.session_id, resume_token=resume_token)
+        stream = SessionStream(request, profiling_requested(message.get("profile")), self, resume_token)
+        _streams[request.session_id] = stream
+        self.streams[request.session_id] = stream
@@ -0,0 +1,151 @@
+# benchmarks/cassette_replay.py
+"""
+离线回放录制的会话：把 LLM 磁带 (LLM_CASSETTE_MODE=record 时录制) 中的会话请求依次送入 main_app_graph，
+所有 LLM 调用都由磁带提供 (按录制时的耗时或缩放后的耗时等待)，不访问网络。
+用于在 CI 中发现编排层的回归：LLM 调用次数的变化、提示词变化导致的未命中，以及会话延迟的变化。
+
+录制 (对真实或桩服务运行应用，建议关闭长期记忆和结果缓存，否则回放时的提示词和调用次数会不同)：
+    LLM_CASSETTE_MODE=record LLM_CASSETTE_PATH=benchmarks/cassettes/smoke.jsonl \\
+        LONG_TERM_MEMORY_ENABLED=false RESULT_CACHE_ENABLED=false uvicorn app.main:app
+回放并保存/对比基线：
+    python -m benchmarks.cassette_replay benchmarks/cassettes/smoke.jsonl --save-baseline benchmarks/baselines/replay.json
+    python -m benchmarks.cassette_replay benchmarks/cassettes/smoke.jsonl --compare benchmarks/baselines/replay.json
+
+调用次数与磁带不一致、出现未命中，或延迟超出基线 --tolerance 时以非零状态码退出。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def replay_sessions(requests: List[Dict[str, Any]]) -> Dict[str, Any]:
+    from app.schemas.chat import ChatRequest
+    from app.services.chat_service import stream_langgraph_response
+
+    latencies, errors = [], []
+    for record in requests:
+        request = ChatRequest(**record["request"], session_id=record["session_id"])
+        start = time.perf_counter()
+        async for chunk in stream_langgraph_response(request):
+            event = json.loads(chunk.decode("utf-8")[len("data: "):])
+            if event["event_type"] == "error":
+                errors.append(event.get("message"))
+        latencies.append(time.perf_counter() - start)
+    return {"latencies": latencies, "errors": errors}
+
+
+def run(cassette_path: str) -> Dict[str, Any]:
+    from app.llms.cassette import get_cassette, read_cassette
+
+    records = read_cassette(cassette_path)
+    requests = [r for r in records if r.get("type") == "request"]
+    recorded_calls = Counter(r["agent"] for r in records if r.get("type") == "llm")
+
+    start = time.perf_counter()
+    outcome = asyncio.run(replay_sessions(requests))
+    total_s = time.perf_counter() - start
+
+    cassette = get_cassette()
+    latencies = outcome["latencies"]
+    results: Dict[str, Any] = {
+        "sessions": len(requests),
+        "session_p50_ms": round(percentile(latencies, 0.5) * 1000, 1) if latencies else None,
+        "session_p95_ms": round(percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+        "total_s": round(total_s, 3),
+        "llm_calls": sum(cassette.calls.values()),
+        "cassette_misses": sum(cassette.misses.values()),
+        "error_events": len(outcome["errors"]),
+    }
+    for agent in sorted(set(recorded_calls) | set(cassette.calls)):
+        results[f"llm_calls_{agent}"] = cassette.calls.get(agent, 0)
+    results["recorded_calls"] = dict(recorded_calls)
+    return results
+
+
+def find_regressions(results: Dict[str, Any], baseline: Optional[Dict[str, Any]], tolerance: float) -> List[str]:
+    problems = []
+    if results["cassette_misses"]:
+        problems.append(f"{results['cassette_misses']} LLM call(s) had no recorded response (prompts or call order changed)")
+    for agent, expected in results["recorded_calls"].items():
+        actual = results.get(f"llm_calls_{agent}", 0)
+        if actual != expected:
+            problems.append(f"{agent}: {actual} LLM call(s) replayed, {expected} recorded")
+    if baseline:
+        for key, value in results.items():
+            base = baseline.get(key)
+            if key.startswith("llm_calls") and base is not None and value != base:
+                problems.append(f"{key}: {value} (baseline {base})")
+            elif key in ("session_p50_ms", "session_p95_ms") and value and base and value > base * (1 + tolerance):
+                problems.append(f"{key}: {value:.1f}ms exceeds baseline {base:.1f}ms by more than {tolerance:.0%}")
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("cassette", help="录制的磁带文件 (JSONL)")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="回放延迟倍数，0 为不等待 (只检查调用次数)")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="会话延迟相对基线允许增加的比例")
+    parser.add_argument("--save-baseline", default=None, help="把结果保存为基线 JSON 文件")
+    parser.add_argument("--compare", default=None, help="与之前保存的基线 JSON 文件对比")
+    args = parser.parse_args()
+
+    # 必须在导入应用模块之前设置：磁带模式和各项开关在导入时读取
+    os.environ.update({
+        "LLM_CASSETTE_MODE": "replay",
+        "LLM_CASSETTE_PATH": args.cassette,
+        "LLM_CASSETTE_LATENCY_SCALE": str(args.latency_scale),
+    })
+    os.environ.setdefault("OPENAI_API_KEY", "cassette-replay")
+    os.environ.setdefault("LONG_TERM_MEMORY_ENABLED", "false")
+    os.environ.setdefault("RESULT_CACHE_ENABLED", "false")
+    # 回放的耗时不是真实耗时 (尤其是 --latency-scale 0)，不能写入生产调度使用的耗时统计
+    os.environ.setdefault("TASK_DURATIONS_ENABLED", "false")
+
+    results = run(args.cassette)
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    for key, value in results.items():
+        if key == "recorded_calls":
+            continue
+        line = f"{key:>28} | {value if value is not None else '-':>12}"
+        if baseline:
+            base = baseline.get(key)
+            line += f" | {base if base is not None else '-':>12}"
+        print(line)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.save_baseline) or ".", exist_ok=True)
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump({
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+                "config": {"cassette": args.cassette, "latency_scale": args.latency_scale},
+                "results": results,
+            }, f, indent=2, ensure_ascii=False)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    problems = find_regressions(results, baseline, args.tolerance)
+    for problem in problems:
+        print(f"REGRESSION: {problem}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# benchmarks/event_encoding_bench.py
+"""
+SSE 事件编码的基准测试：对不同规模计划的 node_update 事件，对比
+原来的 StreamEvent.model_dump_json() 与 EventEncoder (orjson / pydantic_core 后端) 的每事件 CPU 耗时，
+以及一个会话的事件流 (计划逐步完成) 在未压缩、gzip、deflate (逐事件 Z_SYNC_FLUSH) 时
+平均每个事件的字节数和压缩耗时。
+
+用法 (在项目根目录下):
+    python -m benchmarks.event_encoding_bench --steps 1 10 100 1000
+"""
+
+import argparse
+import random
+import time
+
+import pydantic_core
+from langchain_core.messages import AIMessage
+
+from app.langgraph_core.state.plan_index import IndexedPlan
+from app.schemas.chat import StreamEvent
+from app.services import event_encoder
+from app.services.event_encoder import EventEncoder
+
+RESULT_TEXT = "这是子任务的执行结果，包含一些分析和结论。" * 12
+
+
+def make_event(steps: int, variant: int = 0) -> StreamEvent:
+    # 不同 variant 的结果文本带有不同的随机片段，避免压缩流中的事件完全相同
+    rng = random.Random(variant)
+    plan = IndexedPlan([
+        {"task_id": str(i), "task_name": f"步骤 {i}", "description": f"完成用户请求的第 {i} 部分",
+         "worker": "other_worker", "estimated_time": "10分钟", "dependencies": [str(i - 1)] if i > 1 else [],
+         "status": "completed" if i <= variant else "pending",
+         "result": f"[{i}] {rng.getrandbits(128):032x} {RESULT_TEXT}" if i <= variant else None}
+        for i in range(1, steps + 1)
+    ])
+    data = {
+        "overall_plan": plan,
+        "messages": [AIMessage(content=RESULT_TEXT, usage_metadata={"input_tokens": 100, "output_tokens": 50, "total_tokens": 150})],
+        "active_subtask_id": str(steps),
+        "current_agent_role": "other_worker",
+        "last_agent_role": "supervisor",
+        "tokens_used": 1234,
+    }
+    return StreamEvent(event_type="node_update", node="supervisor", data=data, message="Node 'supervisor' executed.")
+
+
+def cpu_per_call(fn, min_time: float = 0.3) -> float:
+    """返回每次调用的 CPU 时间 (秒)"""
+    iterations = 0
+    start = time.process_time()
+    while True:
+        fn()
+        iterations += 1
+        elapsed = time.process_time() - start
+        if elapsed >= min_time:
+            return elapsed / iterations
+
+
+def legacy_encode(event: StreamEvent) -> bytes:
+    return f"data: {event.model_dump_json()}\n\n".encode("utf-8")
+
+
+def pydantic_core_encode(event: StreamEvent) -> bytes:
+    payload = {"event_type": event.event_type, "node": event.node, "data": event.data, "message": event.message,
+               "usage": event.usage}
+    return b"data: " + pydantic_core.to_json(payload, fallback=event_encoder._default, serialize_as_any=True) + b"\n\n"
+
+
+def compressed_stream(steps: int, encoding: str, events: int = 20):
+    """
+    模拟一个会话连续发送 events 个事件 (计划逐步完成，每个事件的结果不同)，
+    返回 (未压缩平均字节数, 压缩后平均字节数, 平均每事件压缩 CPU 时间)。
+    """
+    stream = [make_event(steps, min(steps, (k + 1) * max(1, steps // events))) for k in range(events)]
+    frames = [EventEncoder().encode(event) for event in stream]
+    encoder = EventEncoder(encoding)
+    start = time.process_time()
+    total = sum(len(encoder.encode(event)) for event in stream) + len(encoder.close())
+    cpu = (time.process_time() - start) / events
+    return sum(map(len, frames)) / events, total / events, cpu
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--steps", type=int, nargs="+", default=[1, 10, 100, 1000])
+    args = parser.parse_args()
+
+    backend = "orjson" if event_encoder.orjson is not None else "pydantic_core"
+    print(f"EventEncoder backend: {backend}")
+    print(f"{'steps':>6} | {'legacy us':>10} | {'pyd_core us':>11} | {'encoder us':>10} | {'speedup':>7} | "
+          f"{'raw B':>9} | {'gzip B':>9} | {'gzip us':>8} | {'deflate B':>9} | {'deflate us':>10}")
+    for steps in args.steps:
+        event = make_event(steps, steps)
+        plain = EventEncoder()
+        legacy = cpu_per_call(lambda: legacy_encode(event))
+        core = cpu_per_call(lambda: pydantic_core_encode(event))
+        fast = cpu_per_call(lambda: plain.encode(event))
+        raw_bytes, gzip_bytes, gzip_cpu = compressed_stream(steps, "gzip")
+        _, deflate_bytes, deflate_cpu = compressed_stream(steps, "deflate")
+        print(f"{steps:6d} | {legacy * 1e6:10.1f} | {core * 1e6:11.1f} | {fast * 1e6:10.1f} | {legacy / fast:6.1f}x | "
+              f"{raw_bytes:9.0f} | {gzip_bytes:9.0f} | {gzip_cpu * 1e6:8.1f} | {deflate_bytes:9.0f} | {deflate_cpu * 1e6:10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# benchmarks/llm_tail_latency_bench.py
+"""
+LLM 调用尾延迟的基准测试：对一个注入了长尾延迟和错误的本地桩服务，
+对比 "原始 ChatOpenAI (SDK 自带重试)" 与 "ResilientChatModel (对冲 + 退避重试 + 熔断)"
+的 p50/p95/p99 延迟、失败数和对冲请求占比。
+
+用法 (在项目根目录下):
+    python -m benchmarks.llm_tail_latency_bench --requests 400 --concurrency 16 --tail-prob 0.05 --tail-ms 3000
+"""
+
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+from langchain_openai import ChatOpenAI
+
+from app.core.metrics import metrics_registry
+from app.llms.resilience import ResilientChatModel
+from benchmarks.stub_llm_server import StubServer, add_arguments, config_from_args
+
+PROMPT = "ping"
+
+
+def run_load(llm, requests: int, concurrency: int) -> Tuple[List[float], int]:
+    def one(_):
+        start = time.perf_counter()
+        try:
+            llm.invoke(PROMPT)
+            return time.perf_counter() - start, False
+        except Exception:
+            return time.perf_counter() - start, True
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    return [latency for latency, _ in results], sum(failed for _, failed in results)
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=40, help="预热请求数，用于积累自适应对冲阈值所需的延迟样本")
+    add_arguments(parser)
+    parser.set_defaults(tail_ms=3000, error_rate=0.01, rate_limit_rate=0.01)
+    args = parser.parse_args()
+
+    with StubServer(config_from_args(args)) as server:
+        client_kwargs = {"model": "stub-model", "base_url": server.base_url, "api_key": "stub", "timeout": 60}
+        variants = {
+            "baseline": ChatOpenAI(max_retries=2, **client_kwargs),
+            "resilient": ResilientChatModel(ChatOpenAI(max_retries=0, **client_kwargs), name="bench"),
+        }
+        print(f"stub: median={args.latency_ms}ms tail_prob={args.tail_prob} tail=+{args.tail_ms}ms "
+              f"500={args.error_rate} 429={args.rate_limit_rate}; {args.requests} requests x {args.concurrency} concurrent")
+        print(f"{'variant':>10} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8} | {'max ms':>8} | {'mean ms':>8} | {'failed':>6} | {'upstream req':>12}")
+        for name, llm in variants.items():
+            run_load(llm, args.warmup, args.concurrency)
+            requests_before = server.app.state.requests
+            latencies, failed = run_load(llm, args.requests, args.concurrency)
+            upstream = server.app.state.requests - requests_before
+            print(f"{name:>10} | {percentile(latencies, 0.5) * 1000:8.0f} | {percentile(latencies, 0.95) * 1000:8.0f} | "
+                  f"{percentile(latencies, 0.99) * 1000:8.0f} | {max(latencies) * 1000:8.0f} | "
+                  f"{statistics.mean(latencies) * 1000:8.0f} | {failed:6d} | {upstream:12d}")
+
+    hedges = metrics_registry.counter("llm_hedges_total").snapshot()
+    retries = metrics_registry.counter("llm_retries_total").snapshot()
+    print(f"hedges: {hedges}")
+    print(f"retries: {retries}")
+
+
+if __name__ == "__main__":
+    main()
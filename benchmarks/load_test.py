@@ -0,0 +1,271 @@
+# benchmarks/load_test.py
+"""
+端到端 HTTP 压测：并发打开大量 /api/v1/chat/stream SSE 会话，测量
+首个事件延迟 (TTFE)、最终答案延迟 (TTFA) 的 p50/p95/p99、事件吞吐量和服务端 RSS。
+
+默认会在本进程中启动桩服务 (benchmarks/stub_llm_server.py)，并以子进程方式启动指向它的 FastAPI 应用，
+整个过程不消耗真实 token。也可以用 --url 压测一个已经在运行的服务 (此时可用 --server-pid 采样 RSS)。
+
+结果可以保存为基线文件，之后的运行可以与之对比：
+    python -m benchmarks.load_test --sessions 200 --concurrency 50 --save-baseline benchmarks/baselines/load_test.json
+    python -m benchmarks.load_test --sessions 200 --concurrency 50 --compare benchmarks/baselines/load_test.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import httpx
+
+from benchmarks.stub_llm_server import StubServer, add_arguments, config_from_args
+
+DEFAULT_MESSAGE = "请帮我写一份关于 Python 异步编程的简短介绍"
+# 越小越好的指标；其余 (吞吐量) 越大越好
+_LOWER_IS_BETTER = ("ttfe", "ttfa", "rss", "errors")
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def read_rss_mb(pid: int) -> Optional[float]:
+    """读取进程的常驻内存 (Linux /proc)，其他平台返回 None"""
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def spawn_app(stub_base_url: str, extra_env: Dict[str, str]) -> Iterator[subprocess.Popen]:
+    """以子进程启动 FastAPI 应用，LLM 和 embedding 请求都指向桩服务"""
+    port = _free_port()
+    env = {
+        **os.environ,
+        "OPENAI_BASE_URL": stub_base_url,
+        "OPENAI_API_KEY": "stub",
+        "LONG_TERM_MEMORY_ENABLED": "false",
+        "TASK_DURATIONS_ENABLED": "false", # 桩服务的耗时不能写入生产调度使用的耗时统计
+        "MEMORY_STORE_DIR": tempfile.mkdtemp(prefix="load-test-memory-"),
+        **extra_env,
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", "--no-access-log"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    process.url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"App process exited with code {process.returncode} during startup.")
+            try:
+                if httpx.get(process.url + "/", timeout=1).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                time.sleep(0.2)
+        else:
+            raise RuntimeError("App did not become ready within 60s.")
+        yield process
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+async def run_session(client: httpx.AsyncClient, url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """打开一个 SSE 会话直到结束，记录首个事件、最终答案的时间和事件数"""
+    result = {"ttfe": None, "ttfa": None, "events": 0, "error": None}
+    start = time.perf_counter()
+    try:
+        async with client.stream("POST", url, json=payload) as response:
+            if response.status_code != 200:
+                result["error"] = f"HTTP {response.status_code}"
+                return result
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                elapsed = time.perf_counter() - start
+                result["events"] += 1
+                if result["ttfe"] is None:
+                    result["ttfe"] = elapsed
+                event = json.loads(line[5:])
+                if event.get("event_type") == "final_answer":
+                    result["ttfa"] = elapsed
+                elif event.get("event_type") == "error":
+                    result["error"] = event.get("message") or "error event"
+    except (httpx.HTTPError, json.JSONDecodeError) as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+async def run_load(url: str, sessions: int, concurrency: int, payload: Dict[str, Any],
+                   server_pid: Optional[int]) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+    rss_samples: List[float] = []
+    done = asyncio.Event()
+
+    async def sample_rss():
+        while not done.is_set() and server_pid is not None:
+            rss = read_rss_mb(server_pid)
+            if rss is not None:
+                rss_samples.append(rss)
+            await asyncio.sleep(0.25)
+
+    async def one(client):
+        async with semaphore:
+            return await run_session(client, url, payload)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    rss_before = read_rss_mb(server_pid) if server_pid is not None else None
+    sampler = asyncio.create_task(sample_rss())
+    start = time.perf_counter()
+    async with httpx.AsyncClient(timeout=httpx.Timeout(None, connect=30), limits=limits) as client:
+        results = await asyncio.gather(*(one(client) for _ in range(sessions)))
+    wall = time.perf_counter() - start
+    done.set()
+    await sampler
+
+    ttfe = [r["ttfe"] for r in results if r["ttfe"] is not None]
+    ttfa = [r["ttfa"] for r in results if r["ttfa"] is not None]
+    total_events = sum(r["events"] for r in results)
+    errors = [r["error"] for r in results if r["error"]]
+    return {
+        "sessions": sessions,
+        "completed": len(ttfa),
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:5],
+        "wall_s": wall,
+        "sessions_per_s": len(ttfa) / wall,
+        "events_per_s": total_events / wall,
+        "ttfe_p50_ms": _ms(percentile(ttfe, 0.5)),
+        "ttfe_p95_ms": _ms(percentile(ttfe, 0.95)),
+        "ttfe_p99_ms": _ms(percentile(ttfe, 0.99)),
+        "ttfa_p50_ms": _ms(percentile(ttfa, 0.5)),
+        "ttfa_p95_ms": _ms(percentile(ttfa, 0.95)),
+        "ttfa_p99_ms": _ms(percentile(ttfa, 0.99)),
+        "rss_start_mb": rss_before,
+        "rss_peak_mb": max(rss_samples) if rss_samples else None,
+        "rss_end_mb": read_rss_mb(server_pid) if server_pid is not None else None,
+    }
+
+
+def fetch_cache_hit_ratios(base_url: str) -> Dict[str, float]:
+    """从服务的 /api/v1/metrics 读取每个 agent 的前缀缓存命中率 (cached / prompt tokens)"""
+    try:
+        metrics = httpx.get(base_url + "/api/v1/metrics", timeout=10).json()
+    except (httpx.HTTPError, ValueError):
+        return {}
+    ratios = (metrics.get("llm_prompt_cache_hit_ratio") or {}).get("values") or {}
+    return {f"cache_hit_{label.split('=', 1)[-1]}": value for label, value in sorted(ratios.items())}
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+def print_results(results: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    print(f"{'metric':>22} | {'current':>12}" + (f" | {'baseline':>12} | {'change':>8}" if baseline else ""))
+    for key, value in results.items():
+        if key == "error_samples" or not isinstance(value, (int, float)) and value is not None:
+            continue
+        line = f"{key:>22} | {_fmt(value):>12}"
+        if baseline:
+            base = baseline.get(key)
+            line += f" | {_fmt(base):>12} | {_change(key, value, base):>8}"
+        print(line)
+    for sample in results.get("error_samples", []):
+        print(f"  error: {sample}")
+
+
+def _fmt(value: Any) -> str:
+    if value is None:
+        return "-"
+    return f"{value:.1f}" if isinstance(value, float) else str(value)
+
+
+def _change(key: str, value: Any, base: Any) -> str:
+    if not isinstance(value, (int, float)) or not isinstance(base, (int, float)) or not base:
+        return "-"
+    change = (value - base) / base * 100
+    better = change < 0 if key.startswith(_LOWER_IS_BETTER) else change > 0
+    return f"{change:+.1f}%" + ("" if abs(change) < 1 else (" ✓" if better else " ✗"))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--message", default=DEFAULT_MESSAGE)
+    parser.add_argument("--url", default=None, help="已在运行的服务地址 (例如 http://127.0.0.1:8000)；不指定则自动启动")
+    parser.add_argument("--server-pid", type=int, default=None, help="配合 --url 使用，用于采样服务端 RSS")
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="传给自动启动的应用进程的环境变量，可重复")
+    parser.add_argument("--save-baseline", default=None, help="把结果保存为基线 JSON 文件")
+    parser.add_argument("--compare", default=None, help="与之前保存的基线 JSON 文件对比")
+    add_arguments(parser)
+    parser.set_defaults(latency_ms=50, tail_prob=0.0)
+    args = parser.parse_args()
+
+    payload = {"message": args.message}
+    config = {k: v for k, v in vars(args).items() if k not in ("save_baseline", "compare", "url", "server_pid")}
+
+    if args.url:
+        results = asyncio.run(run_load(args.url + "/api/v1/chat/stream", args.sessions, args.concurrency,
+                                       payload, args.server_pid))
+        results.update(fetch_cache_hit_ratios(args.url))
+    else:
+        extra_env = dict(item.split("=", 1) for item in args.app_env)
+        with StubServer(config_from_args(args)) as stub, spawn_app(stub.base_url, extra_env) as app:
+            print(f"stub at {stub.base_url}, app at {app.url} (pid {app.pid})")
+            # 先跑一个会话预热 (导入、图编译、连接池)
+            asyncio.run(run_load(app.url + "/api/v1/chat/stream", 1, 1, payload, None))
+            results = asyncio.run(run_load(app.url + "/api/v1/chat/stream", args.sessions, args.concurrency,
+                                           payload, app.pid))
+            results.update(fetch_cache_hit_ratios(app.url))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.save_baseline) or ".", exist_ok=True)
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump({
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+                "config": config,
+                "results": results,
+            }, f, indent=2, ensure_ascii=False)
+        print(f"Baseline saved to {args.save_baseline}")
+
+
+if __name__ == "__main__":
+    main()
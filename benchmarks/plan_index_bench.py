@@ -0,0 +1,94 @@
+# benchmarks/plan_index_bench.py
+"""
+计划表示的基准测试：模拟 supervisor/路由在一个 N 步计划上完整执行一遍的开销，
+对比原来的 "线性扫描 + 原地修改" 与 IndexedPlan 的 "ID 索引 + 就绪队列 + 写时复制"。
+
+每个步骤包含与一次图循环等价的操作：路由查找激活任务、worker 查找子任务、
+supervisor 查找子任务并标记完成、查找下一个待执行任务并激活。
+
+用法 (在项目根目录下):
+    python -m benchmarks.plan_index_bench --sizes 100 1000 5000
+"""
+
+import argparse
+import copy
+import time
+
+from app.langgraph_core.state.plan_index import IndexedPlan
+
+
+def make_plan(size: int) -> dict:
+    return {"steps": [
+        {"task_id": str(i), "task_name": f"task {i}", "description": f"do step {i}", "worker": "other_worker",
+         "estimated_time": "1小时", "dependencies": [str(i - 1)] if i > 1 else [], "status": "pending", "result": None}
+        for i in range(1, size + 1)
+    ]}
+
+
+def _find(plan: dict, task_id: str):
+    for task in plan.get("steps", []):
+        if task.get("task_id") == task_id:
+            return task
+    return None
+
+
+def run_linear(plan: dict, deep_copy_state: bool) -> None:
+    """原实现：每一步多次线性扫描，并原地修改子任务"""
+    active_id = None
+    while True:
+        if deep_copy_state:
+            plan = copy.deepcopy(plan)  # 需要隔离状态时，原地修改迫使每步深拷贝
+        if active_id is not None:
+            _find(plan, active_id)  # route_to_agent
+            _find(plan, active_id)  # other_worker_node
+            task = _find(plan, active_id)  # supervisor
+            task["status"] = "completed"
+            task["result"] = "ok"
+        next_task = None
+        for task in plan["steps"]:
+            if task.get("status") is None or task.get("status") == "pending":
+                next_task = task
+                break
+        if next_task is None:
+            return
+        next_task["status"] = "active"
+        active_id = next_task["task_id"]
+
+
+def run_indexed(plan: dict) -> None:
+    plan = IndexedPlan.from_plan(plan)
+    active_id = None
+    while True:
+        if active_id is not None:
+            plan.get_task(active_id)
+            plan.get_task(active_id)
+            plan = plan.with_task_update(active_id, status="completed", result="ok")
+        next_task = plan.next_ready_task()
+        if next_task is None:
+            return
+        plan = plan.with_task_update(next_task["task_id"], status="active")
+        active_id = next_task["task_id"]
+
+
+def timed(fn) -> float:
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100, 1000, 5000])
+    args = parser.parse_args()
+
+    print(f"{'steps':>8} {'linear_ms':>12} {'linear+copy_ms':>16} {'indexed_ms':>12} {'per_step_us':>12}")
+    for size in args.sizes:
+        linear = timed(lambda: run_linear(make_plan(size), deep_copy_state=False))
+        linear_copy = timed(lambda: run_linear(make_plan(size), deep_copy_state=True)) if size <= 2000 else float("nan")
+        indexed = timed(lambda: run_indexed(make_plan(size)))
+        print(f"{size:>8} {linear * 1000:>12.1f} {linear_copy * 1000:>16.1f} {indexed * 1000:>12.1f} "
+              f"{indexed / size * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
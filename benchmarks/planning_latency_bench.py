@@ -0,0 +1,101 @@
+# benchmarks/planning_latency_bench.py
+"""
+规划阶段端到端延迟的基准测试：从收到请求到 Supervisor 批准计划、分配第一个子任务为止。
+对比三种方式在不同计划否决率下的 p50/p95 延迟和平均 LLM 调用数：
+- serial: 现有的串行循环 (生成 -> 评估 -> 修订 -> 评估 ...，最多 MAX_PLAN_REVISIONS 次)；
+- best_of_n_llm: 并行生成 N 份候选，一次批量评估选出最好的一份，全部不合格才修订；
+- best_of_n_heuristic: 并行生成 N 份候选，只用结构启发式选择，不调用 LLM 评估。
+
+桩服务 (benchmarks/stub_llm_server.py) 中每份计划独立地以 --reject-rates 中的概率被否决。
+
+用法 (在项目根目录下):
+    python -m benchmarks.planning_latency_bench --runs 40 --candidates 3 --latency-ms 300 --reject-rates 0,0.3,0.6
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+from benchmarks.stub_llm_server import StubServer, add_arguments, config_from_args
+
+MESSAGE = "调研三款主流开源向量数据库的性能差异，并给出选型建议"
+MAX_STEPS = 12
+
+
+def plan_once(planner_node, supervisor_node, initial_state) -> Tuple[float, bool]:
+    """交替执行 Supervisor 和 Planner，直到 Supervisor 把第一个子任务分配给工人；返回 (耗时, 是否成功)"""
+    state: Dict[str, Any] = initial_state()
+    start = time.perf_counter()
+    for _ in range(MAX_STEPS):
+        node = planner_node if state.get("current_agent_role") == "planner" else supervisor_node
+        update = node(state)
+        for key, value in update.items():
+            if key == "messages":
+                state["messages"] = state["messages"] + value
+            elif key == "tokens_used":
+                state["tokens_used"] = state.get("tokens_used", 0) + value
+            elif key != "usage":
+                state[key] = value
+        if state.get("current_agent_role") not in (None, "planner", "supervisor"):
+            return time.perf_counter() - start, state["current_agent_role"] != "end_process"
+    return time.perf_counter() - start, False
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=40, help="每种方式、每个否决率下的规划次数")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--candidates", type=int, default=3, help="Best-of-N 的候选数 N")
+    parser.add_argument("--reject-rates", default="0,0.3,0.6")
+    add_arguments(parser)
+    parser.set_defaults(tail_prob=0.0)
+    args = parser.parse_args()
+    config = config_from_args(args)
+
+    with StubServer(config) as stub:
+        # 必须在导入应用模块之前设置：模型在导入时创建
+        os.environ.update({"OPENAI_BASE_URL": stub.base_url, "OPENAI_API_KEY": "stub"})
+        os.environ.setdefault("LONG_TERM_MEMORY_ENABLED", "false")
+        from langchain_core.messages import HumanMessage
+
+        import app.langgraph_core.agents.main.planner_agent as planner_module
+        import app.langgraph_core.agents.main.supervisor_agent as supervisor_module
+        from app.langgraph_core.utils.budget import init_budget_state
+
+        def initial_state() -> Dict[str, Any]:
+            return {"messages": [HumanMessage(content=MESSAGE)], "current_agent_role": None, "current_request": None,
+                    "overall_plan": None, "last_agent_role": None, "plan_revision_count": 0,
+                    "task_revision_count": 0, "usage": {}, **init_budget_state()}
+
+        modes = {
+            "serial": (1, "llm"),
+            "best_of_n_llm": (args.candidates, "llm"),
+            "best_of_n_heuristic": (args.candidates, "heuristic"),
+        }
+        print(f"{'reject_rate':>11} | {'mode':>20} | {'p50_ms':>8} | {'p95_ms':>8} | {'llm_calls':>9} | {'failed':>6}")
+        for reject_rate in [float(r) for r in args.reject_rates.split(",")]:
+            config.reject_rate = reject_rate
+            for mode, (candidates, selection) in modes.items():
+                planner_module.PLAN_CANDIDATES = candidates
+                supervisor_module.PLAN_SELECTION = selection
+                requests_before = stub.app.state.requests
+                with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                    results = list(pool.map(
+                        lambda _: plan_once(planner_module.planner_agent, supervisor_module.supervisor_agent, initial_state),
+                        range(args.runs)))
+                latencies = [latency for latency, _ in results]
+                calls = (stub.app.state.requests - requests_before) / args.runs
+                failed = sum(not ok for _, ok in results)
+                print(f"{reject_rate:>11.2f} | {mode:>20} | {percentile(latencies, 0.5) * 1000:>8.1f} | "
+                      f"{percentile(latencies, 0.95) * 1000:>8.1f} | {calls:>9.2f} | {failed:>6}")
+
+
+if __name__ == "__main__":
+    main()
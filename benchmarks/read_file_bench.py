@@ -0,0 +1,89 @@
+# benchmarks/read_file_bench.py
+"""
+read_file 工具的基准测试：在 1MB ~ 5GB 的生成文件上测量
+行索引首次构建耗时、建索引后的随机行定位耗时、字节区间读取和限额流式读取耗时。
+
+用法 (在项目根目录下):
+    python -m benchmarks.read_file_bench --sizes 1MB 100MB 1GB 5GB --dir /tmp/read_file_bench
+"""
+
+import argparse
+import os
+import random
+import time
+
+from app.langgraph_core.tools.file_reader import MappedFile, DEFAULT_MAX_BYTES
+
+_UNITS = {"KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+_LINE = b"2024-01-01T00:00:00.000Z INFO worker-%06d processed request id=%010d status=200 latency_ms=%04d\n"
+
+
+def parse_size(text: str) -> int:
+    text = text.upper()
+    for unit, factor in _UNITS.items():
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * factor)
+    return int(text)
+
+
+def ensure_file(directory: str, size: int) -> str:
+    """生成一个大约 size 字节、类似日志的文件 (已存在则复用)"""
+    path = os.path.join(directory, f"bench_{size}.log")
+    if os.path.exists(path) and os.path.getsize(path) >= size:
+        return path
+    block = b"".join(_LINE % (i % 1000000, i, i % 9999) for i in range(10000))
+    with open(path, "wb") as f:
+        written = 0
+        while written < size:
+            f.write(block)
+            written += len(block)
+        f.truncate(size)
+    return path
+
+
+def timed(fn, repeat: int = 1) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def run(path: str, seeks: int) -> dict:
+    mapped = MappedFile(path)
+    try:
+        index_s = timed(mapped.line_count)
+        total_lines = mapped.line_count()
+        targets = [random.randrange(total_lines) for _ in range(seeks)]
+        seek_s = timed(lambda: [mapped.read_lines(n, n + 10) for n in targets]) / seeks
+        offsets = [random.randrange(max(1, mapped.size - DEFAULT_MAX_BYTES)) for _ in range(seeks)]
+        range_s = timed(lambda: [mapped.read_bytes(o, o + DEFAULT_MAX_BYTES) for o in offsets]) / seeks
+        stream_s = timed(lambda: sum(len(c) for c in mapped.iter_chunks(0, max_bytes=DEFAULT_MAX_BYTES)))
+        return {
+            "size_mb": mapped.size / _UNITS["MB"],
+            "lines": total_lines,
+            "index_build_s": index_s,
+            "line_seek_us": seek_s * 1e6,
+            "byte_range_us": range_s * 1e6,
+            "capped_stream_us": stream_s * 1e6,
+        }
+    finally:
+        mapped.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=["1MB", "10MB", "100MB", "1GB", "5GB"])
+    parser.add_argument("--dir", default="/tmp/read_file_bench")
+    parser.add_argument("--seeks", type=int, default=1000)
+    args = parser.parse_args()
+
+    os.makedirs(args.dir, exist_ok=True)
+    print(f"{'size_mb':>10} {'lines':>12} {'index_s':>10} {'seek_us':>10} {'range_us':>10} {'stream_us':>10}")
+    for size in args.sizes:
+        result = run(ensure_file(args.dir, parse_size(size)), args.seeks)
+        print(f"{result['size_mb']:>10.1f} {result['lines']:>12} {result['index_build_s']:>10.3f} "
+              f"{result['line_seek_us']:>10.1f} {result['byte_range_us']:>10.1f} {result['capped_stream_us']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+# benchmarks/stub_llm_server.py
+"""
+本地的 OpenAI 兼容桩服务，用于在不消耗真实 token 的情况下做延迟、容错和端到端压测。
+
+- /v1/chat/completions：支持流式 (SSE) 和非流式响应；
+- /v1/embeddings：按文本哈希生成确定性的单位向量；
+- 延迟服从对数正态分布，并以一定概率注入长尾延迟；可以按比例返回 429 和 500；
+- 响应内容是脚本化的：按 response_format 中的 JSON Schema 名称 (或 prompt 中的关键词)
+  返回规划、计划评估、结果评估的 JSON，其余请求返回普通文本。
+  可以用 --script 指定一个 JSON 文件，按顺序匹配的规则优先于内置规则：
+      [{"schema": "PlanEvaluation", "contains": "关键词", "content": {...} 或 "文本"}]
+
+用法 (在项目根目录下):
+    python -m benchmarks.stub_llm_server --port 8900 --latency-ms 300 --tail-prob 0.05 --tail-ms 5000
+然后把 OPENAI_BASE_URL 指向 http://127.0.0.1:8900/v1。
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import socket
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+@dataclass
+class StubConfig:
+    latency_ms: float = 300  # 延迟中位数 (流式响应中为首个 token 的延迟)
+    latency_sigma: float = 0.3  # 对数正态分布的 sigma
+    tail_prob: float = 0.05  # 注入长尾延迟的概率
+    tail_ms: float = 5000  # 长尾请求额外增加的延迟
+    error_rate: float = 0.0  # 返回 500 的概率
+    rate_limit_rate: float = 0.0  # 返回 429 的概率
+    chunk_ms: float = 20  # 流式响应中相邻两个分块的间隔
+    chunk_chars: int = 8  # 流式响应中每个分块的字符数
+    plan_steps: int = 3  # 脚本化计划包含的子任务数
+    reject_rate: float = 0.0  # 计划/结果评估给出 "不通过" 的概率，用于触发修订
+    response_chars: int = 400  # 普通文本响应的长度
+    embedding_dim: int = 1536
+    embedding_latency_ms: float = 20
+    script: List[Dict[str, Any]] = field(default_factory=list)
+    seed: Optional[int] = None
+    # 模拟服务商的前缀缓存：与之前请求逐字节相同的前导消息计为 cached_tokens
+    # (OpenAI 只缓存至少 1024 token 的前缀，需要模拟这一点时设为 1024)
+    cache_min_tokens: int = 0
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _prompt_text(body: dict) -> str:
+    parts = []
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        parts.append(content or "")
+    return "\n".join(parts)
+
+
+class PrefixCache:
+    """记录见过的消息前缀；返回本次请求中与之前某次请求完全相同的最长前导消息序列的 token 数"""
+
+    def __init__(self, min_tokens: int):
+        self.min_tokens = min_tokens
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def cached_tokens(self, body: dict) -> int:
+        digest = hashlib.sha256()
+        cached = tokens = 0
+        messages = body.get("messages", [])
+        with self._lock:
+            # 最后一条消息是本次的输入，不计入可缓存的前缀
+            for message in messages[:-1]:
+                digest.update(json.dumps(message, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+                tokens += _estimate_tokens(_prompt_text({"messages": [message]}))
+                key = digest.hexdigest()
+                if key in self._seen:
+                    cached = tokens
+                else:
+                    self._seen.add(key)
+        return cached if cached >= self.min_tokens else 0
+
+
+def _schema_name(body: dict) -> Optional[str]:
+    response_format = body.get("response_format") or {}
+    return (response_format.get("json_schema") or {}).get("name")
+
+
+class ScriptedResponder:
+    """根据请求决定响应内容：先匹配用户脚本，再按 schema 名称/关键词使用内置规则"""
+
+    def __init__(self, config: StubConfig, rng: random.Random):
+        self.config = config
+        self.rng = rng
+
+    def respond(self, body: dict) -> str:
+        prompt = _prompt_text(body)
+        schema = _schema_name(body)
+        for rule in self.config.script:
+            if rule.get("schema") not in (None, schema):
+                continue
+            if rule.get("contains") and rule["contains"] not in prompt:
+                continue
+            content = rule.get("content", "")
+            return content if isinstance(content, str) else json.dumps(content, ensure_ascii=False)
+
+        if schema == "PlanOutput" or (schema is None and "任务规划师" in prompt):
+            return self._plan()
+        if schema == "PlanAmendment" or (schema is None and "增量修改" in prompt):
+            # 追加请求：不重跑已有任务，只新增一个任务
+            return json.dumps({"rerun_task_ids": [], "new_steps": [{
+                "task_id": str(self.config.plan_steps + 1), "task_name": "追加步骤", "description": "完成追加请求",
+                "worker": "other_worker", "estimated_time": "10分钟", "dependencies": [],
+            }]}, ensure_ascii=False)
+        if schema == "PlanCandidatesEvaluation" or (schema is None and "候选计划" in prompt):
+            # 每份候选独立地以 reject_rate 的概率不合格，选第一份合格的候选
+            approved = [self.rng.random() >= self.config.reject_rate for _ in range(max(1, prompt.count('"candidate":')))]
+            best = approved.index(True) if any(approved) else 0
+            return json.dumps({"evaluation_summary": "选出了最合适的候选计划。", "best_candidate": best,
+                               "is_approved": any(approved), "feedback": "" if any(approved) else "请把步骤拆分得更细。"},
+                              ensure_ascii=False)
+        if schema == "PlanEvaluation" or (schema is None and "规划师的计划" in prompt):
+            approved = self.rng.random() >= self.config.reject_rate
+            return json.dumps({"evaluation_summary": "计划合理。" if approved else "计划需要调整。",
+                               "is_approved": approved, "feedback": "" if approved else "请把步骤拆分得更细。"},
+                              ensure_ascii=False)
+        if schema == "ResultEvaluation" or (schema is None and "工人的执行结果" in prompt):
+            satisfactory = self.rng.random() >= self.config.reject_rate
+            return json.dumps({"is_satisfactory": satisfactory, "feedback": "" if satisfactory else "请补充更多细节。"},
+                              ensure_ascii=False)
+        return self._text(prompt)
+
+    def _plan(self) -> str:
+        steps = [{
+            "task_id": str(i), "task_name": f"步骤 {i}", "description": f"完成用户请求的第 {i} 部分",
+            "worker": "other_worker", "estimated_time": "10分钟", "dependencies": [str(i - 1)] if i > 1 else [],
+        } for i in range(1, self.config.plan_steps + 1)]
+        return json.dumps({"steps": steps}, ensure_ascii=False)
+
+    def _text(self, prompt: str) -> str:
+        seed = hashlib.md5(prompt.encode("utf-8")).hexdigest()[:8]
+        filler = "这是桩服务生成的模拟回答。"
+        return (f"[stub {seed}] " + filler * (self.config.response_chars // len(filler) + 1))[:self.config.response_chars]
+
+
+def _embed(text: str, dim: int) -> List[float]:
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def create_app(config: StubConfig) -> FastAPI:
+    app = FastAPI()
+    rng = random.Random(config.seed)
+    responder = ScriptedResponder(config, rng)
+    prefix_cache = PrefixCache(config.cache_min_tokens)
+    app.state.requests = 0
+
+    def sample_latency() -> float:
+        latency = config.latency_ms * math.exp(rng.gauss(0, config.latency_sigma))
+        if rng.random() < config.tail_prob:
+            latency += config.tail_ms
+        return latency / 1000
+
+    def injected_error() -> Optional[JSONResponse]:
+        roll = rng.random()
+        if roll < config.rate_limit_rate:
+            return JSONResponse({"error": {"message": "Rate limit exceeded (stub)", "type": "rate_limit"}},
+                                status_code=429, headers={"retry-after": "0.1"})
+        if roll < config.rate_limit_rate + config.error_rate:
+            return JSONResponse({"error": {"message": "Internal error (stub)", "type": "server_error"}}, status_code=500)
+        return None
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        await asyncio.sleep(sample_latency())
+        error = injected_error()
+        if error is not None:
+            return error
+
+        model = body.get("model", "stub")
+        content = responder.respond(body)
+        usage = {"prompt_tokens": _estimate_tokens(_prompt_text(body)), "completion_tokens": _estimate_tokens(content)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        usage["prompt_tokens_details"] = {"cached_tokens": prefix_cache.cached_tokens(body)}
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+
+        if not body.get("stream"):
+            return {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+        async def stream():
+            def chunk(delta: dict, finish_reason: Optional[str] = None, **extra) -> str:
+                payload = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                           "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}], **extra}
+                return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+            yield chunk({"role": "assistant", "content": ""})
+            for start in range(0, len(content), config.chunk_chars):
+                yield chunk({"content": content[start:start + config.chunk_chars]})
+                await asyncio.sleep(config.chunk_ms / 1000)
+            yield chunk({}, "stop")
+            if include_usage:
+                yield f"data: {json.dumps({'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model, 'choices': [], 'usage': usage})}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        await asyncio.sleep(config.embedding_latency_ms / 1000)
+        error = injected_error()
+        if error is not None:
+            return error
+        inputs = body.get("input", [])
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        # OpenAIEmbeddings 默认会先分词再发送 token ID 列表，这里把它们当作普通文本处理
+        texts = [text if isinstance(text, str) else " ".join(map(str, text)) for text in inputs]
+        return {
+            "object": "list",
+            "model": body.get("model", "stub-embedding"),
+            "data": [{"object": "embedding", "index": i, "embedding": _embed(text, config.embedding_dim)}
+                     for i, text in enumerate(texts)],
+            "usage": {"prompt_tokens": sum(map(_estimate_tokens, texts)), "total_tokens": sum(map(_estimate_tokens, texts))},
+        }
+
+    return app
+
+
+class StubServer:
+    """在后台线程中运行桩服务，作为上下文管理器使用，base_url 可直接传给 ChatOpenAI"""
+
+    def __init__(self, config: StubConfig, host: str = "127.0.0.1", port: int = 0):
+        self.app = create_app(config)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((host, port))
+        self.host, self.port = self._socket.getsockname()
+        self._server = uvicorn.Server(uvicorn.Config(self.app, log_level="warning", backlog=4096))
+        self._thread = threading.Thread(target=self._server.run, kwargs={"sockets": [self._socket]}, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def __enter__(self) -> "StubServer":
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency-ms", type=float, default=StubConfig.latency_ms)
+    parser.add_argument("--latency-sigma", type=float, default=StubConfig.latency_sigma)
+    parser.add_argument("--tail-prob", type=float, default=StubConfig.tail_prob)
+    parser.add_argument("--tail-ms", type=float, default=StubConfig.tail_ms)
+    parser.add_argument("--error-rate", type=float, default=StubConfig.error_rate)
+    parser.add_argument("--rate-limit-rate", type=float, default=StubConfig.rate_limit_rate)
+    parser.add_argument("--chunk-ms", type=float, default=StubConfig.chunk_ms)
+    parser.add_argument("--plan-steps", type=int, default=StubConfig.plan_steps)
+    parser.add_argument("--reject-rate", type=float, default=StubConfig.reject_rate)
+    parser.add_argument("--response-chars", type=int, default=StubConfig.response_chars)
+    parser.add_argument("--cache-min-tokens", type=int, default=StubConfig.cache_min_tokens,
+                        help="模拟前缀缓存时可缓存前缀的最小 token 数")
+    parser.add_argument("--script", default=None, help="JSON 规则文件，优先于内置的脚本化响应")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def config_from_args(args: argparse.Namespace) -> StubConfig:
+    script = []
+    if args.script:
+        with open(args.script, "r", encoding="utf-8") as f:
+            script = json.load(f)
+    return StubConfig(latency_ms=args.latency_ms, latency_sigma=args.latency_sigma, tail_prob=args.tail_prob,
+                      tail_ms=args.tail_ms, error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+                      chunk_ms=args.chunk_ms, plan_steps=args.plan_steps, reject_rate=args.reject_rate,
+                      response_chars=args.response_chars, cache_min_tokens=args.cache_min_tokens,
+                      script=script, seed=args.seed)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_arguments(parser)
+    args = parser.parse_args()
+    with StubServer(config_from_args(args), host=args.host, port=args.port) as server:
+        print(f"Stub LLM server listening on {server.base_url}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# benchmarks/ws_vs_sse_bench.py
+"""
+对比两种传输方式同时观看大量会话时的表现：
+- sse: 每个会话一个 /api/v1/chat/stream 请求；--sse-connections 限制同时打开的连接数，
+  用来模拟浏览器对同一主机的连接数上限 (HTTP/1.1 下通常为 6)，超出的会话只能排队；
+- ws: 所有会话复用一个 /api/v1/ws 连接 (每个会话按帧确认，参与流量控制)。
+测量首个事件 (TTFE)、最终答案 (TTFA) 的 p50/p95、总耗时和服务端 RSS 峰值。
+
+默认在本进程中启动桩服务，并以子进程启动指向它的应用 (与 benchmarks/load_test.py 相同)：
+    python -m benchmarks.ws_vs_sse_bench --sessions 200 --sse-connections 6,200
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+import websockets
+
+from benchmarks.load_test import _ms, percentile, read_rss_mb, run_session, spawn_app
+from benchmarks.stub_llm_server import StubServer, add_arguments, config_from_args
+
+DEFAULT_MESSAGE = "请帮我写一份关于 Python 异步编程的简短介绍"
+
+
+async def _sample_rss(pid: int, samples: List[float], done: asyncio.Event) -> None:
+    while not done.is_set():
+        rss = read_rss_mb(pid)
+        if rss is not None:
+            samples.append(rss)
+        await asyncio.sleep(0.25)
+
+
+def _summarize(results: List[Dict[str, Any]], wall: float, rss_samples: List[float]) -> Dict[str, Any]:
+    ttfe = [r["ttfe"] for r in results if r["ttfe"] is not None]
+    ttfa = [r["ttfa"] for r in results if r["ttfa"] is not None]
+    return {
+        "completed": len(ttfa),
+        "errors": sum(1 for r in results if r["error"]),
+        "wall_s": round(wall, 2),
+        "ttfe_p50_ms": _ms(percentile(ttfe, 0.5)),
+        "ttfe_p95_ms": _ms(percentile(ttfe, 0.95)),
+        "ttfa_p50_ms": _ms(percentile(ttfa, 0.5)),
+        "ttfa_p95_ms": _ms(percentile(ttfa, 0.95)),
+        "rss_peak_mb": round(max(rss_samples), 1) if rss_samples else None,
+    }
+
+
+async def run_sse(base_url: str, sessions: int, connections: int, message: str, pid: int) -> Dict[str, Any]:
+    """所有会话同时发起，但最多 connections 个连接；超出的会话在客户端连接池中排队，排队时间计入延迟"""
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    rss_samples: List[float] = []
+    done = asyncio.Event()
+    sampler = asyncio.create_task(_sample_rss(pid, rss_samples, done))
+    start = time.perf_counter()
+    async with httpx.AsyncClient(timeout=httpx.Timeout(None, connect=30, pool=None), limits=limits) as client:
+        results = await asyncio.gather(*(run_session(client, base_url + "/api/v1/chat/stream", {"message": message})
+                                         for _ in range(sessions)))
+    wall = time.perf_counter() - start
+    done.set()
+    await sampler
+    return _summarize(results, wall, rss_samples)
+
+
+async def run_ws(base_url: str, sessions: int, message: str, pid: int) -> Dict[str, Any]:
+    """所有会话复用同一个 WebSocket 连接，收到每个帧后立即确认"""
+    ws_url = base_url.replace("http://", "ws://", 1) + "/api/v1/ws"
+    results = {i: {"ttfe": None, "ttfa": None, "events": 0, "error": None} for i in range(sessions)}
+    rss_samples: List[float] = []
+    done = asyncio.Event()
+    sampler = asyncio.create_task(_sample_rss(pid, rss_samples, done))
+    start = time.perf_counter()
+    async with websockets.connect(ws_url, max_size=None, compression="deflate") as ws:
+        for i in range(sessions):
+            await ws.send(json.dumps({"type": "start", "id": i, "request": {"message": message}}))
+        by_session: Dict[str, Dict[str, Any]] = {}
+        remaining = sessions
+        while remaining:
+            frame = json.loads(await ws.recv())
+            elapsed = time.perf_counter() - start
+            if frame["type"] == "started":
+                by_session[frame["session_id"]] = results[frame["id"]]
+                continue
+            result = by_session.get(frame.get("session_id")) or results.get(frame.get("id"))
+            if frame["type"] == "error":
+                result["error"] = frame.get("message")
+                remaining -= 1
+                continue
+            await ws.send(json.dumps({"type": "ack", "session_id": frame["session_id"], "seq": frame["seq"]}))
+            if frame["type"] == "end":
+                remaining -= 1
+                continue
+            event = frame["event"]
+            result["events"] += 1
+            if result["ttfe"] is None:
+                result["ttfe"] = elapsed
+            if event["event_type"] == "final_answer":
+                result["ttfa"] = elapsed
+            elif event["event_type"] == "error":
+                result["error"] = event.get("message") or "error event"
+    wall = time.perf_counter() - start
+    done.set()
+    await sampler
+    return _summarize(list(results.values()), wall, rss_samples)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--sse-connections", default="6,100", help="SSE 同时打开的连接数上限，逗号分隔，逐个测量")
+    parser.add_argument("--message", default=DEFAULT_MESSAGE)
+    add_arguments(parser)
+    parser.set_defaults(latency_ms=50, tail_prob=0.0)
+    args = parser.parse_args()
+
+    rows: Dict[str, Optional[Dict[str, Any]]] = {}
+    with StubServer(config_from_args(args)) as stub, spawn_app(stub.base_url, {}) as app:
+        print(f"stub at {stub.base_url}, app at {app.url} (pid {app.pid})")
+        # 预热 (导入、图编译、连接池)
+        asyncio.run(run_sse(app.url, 1, 1, args.message, app.pid))
+        for connections in [int(c) for c in args.sse_connections.split(",")]:
+            rows[f"sse ({connections} conn)"] = asyncio.run(run_sse(app.url, args.sessions, connections, args.message, app.pid))
+        rows["ws (1 conn)"] = asyncio.run(run_ws(app.url, args.sessions, args.message, app.pid))
+
+    columns = list(next(iter(rows.values())).keys())
+    print(f"{'transport':>16} | " + " | ".join(f"{c:>12}" for c in columns))
+    for name, row in rows.items():
+        print(f"{name:>16} | " + " | ".join(f"{'-' if row[c] is None else row[c]:>12}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()